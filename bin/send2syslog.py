@@ -21,9 +21,18 @@ import string
 import re
 import json
 import time
+import errno
+import select
+import socket
 import logging
 from logging.handlers import SysLogHandler
 from optparse import OptionParser, OptionGroup
+try:
+    import ctypes
+    import ctypes.util
+except ImportError:
+    # Files are polled then.
+    ctypes = None
 
 
 # Add syslog levels to logging module.
@@ -42,6 +51,22 @@ rfc5424_format = '{version} {timestamp} {hostname} {appname} {procid}'\
 date_format = '%Y-%m-%dT%H:%M:%SZ'
 # Define global semaphore.
 sending_in_progress = 0
+# Maximum bytes read from one file at once.
+batch_size = 65536
+# Seconds to wait after wakeup, so burst of writes is sent as one batch.
+batch_delay = 0.1
+# Seconds to wait for changes if files can't be watched by inotify.
+poll_interval = 0.5
+# Seconds to wait for changes if all files are watched by inotify.
+watch_interval = 5
+# Seconds to wait before reconnecting to TCP server.
+reconnect_delay = 1
+# Seconds TCP server has to accept data, unsent data is kept.
+send_timeout = 1
+# Files aren't read while server has this many bytes unsent.
+max_pending = 1048576
+# Seconds servers have to accept unsent data before exit.
+flush_timeout = 5
 # Define file types.
 msg_levels = {'ruby': {'regex': '(?P<level>[DIWEF]), \[[0-9-]{10}T',
                        'levels': {'D': logging.DEBUG,
@@ -102,12 +127,16 @@ class WatchedFile:
         self.name = name
         self.fo = None
         self.where = 0
+        self.more = False
+        # Last line which isn't written completely yet.
+        self.partial = ''
 
     def reset(self):
         if self.fo:
             self.fo.close()
             self.fo = None
             self.where = 0
+            self.partial = ''
 
     def _checkRewrite(self):
         try:
@@ -117,22 +146,104 @@ class WatchedFile:
             self.close()
 
     def readLines(self):
-        """Return list of last append lines from file if exist. """
+        """Return list of last append lines from file if exist.
+        At most about batch_size bytes are read, self.more is set
+        if there are more lines to read. Line without newline is kept
+        until it's finished or until nothing more is written.
+        """
 
+        self.more = False
         self._checkRewrite()
         if not self.fo:
             try:
                 self.fo = open(self.name, 'r')
             except IOError:
                 return ()
-        lines = self.fo.readlines()
+        lines = self.fo.readlines(batch_size)
         self.where = self.fo.tell()
+        self.more = self.where < os.fstat(self.fo.fileno())[6]
+        written = bool(lines)
+        if self.partial:
+            lines = lines or ['']
+            lines[0] = self.partial + lines[0]
+            self.partial = ''
+        if written and not lines[-1].endswith('\n'):
+            self.partial = lines.pop()
         return lines
 
     def close(self):
         self.reset()
 
 
+class UDPTransport:
+    """ Sends every message as separate datagram like SysLogHandler. """
+
+    def __init__(self, host, port):
+        self.address = (host, port)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.pending = ''
+
+    def send(self, messages):
+        for message in messages:
+            try:
+                self.socket.sendto(message + '\000', self.address)
+            except socket.error:
+                pass
+        return True
+
+    def flush(self):
+        return True
+
+
+class TCPTransport:
+    """ Sends messages over TCP framed by octet counting (RFC 6587).
+    All messages of batch are written at once. Data server doesn't
+    accept in time is kept and sent on next flush.
+    """
+
+    def __init__(self, host, port):
+        self.address = (host, port)
+        self.socket = None
+        self.pending = ''
+        self.retry_at = 0
+
+    def send(self, messages):
+        self.pending += ''.join(
+            ['{0} {1}'.format(len(m), m) for m in messages]
+        )
+        return self.flush()
+
+    def flush(self):
+        """ Send pending data, return True if all of it is sent. """
+
+        if not self.pending:
+            return True
+        if time.time() < self.retry_at:
+            return False
+        try:
+            if self.socket is None:
+                self.socket = socket.create_connection(self.address,
+                                                       send_timeout)
+            while self.pending:
+                sent = self.socket.send(self.pending)
+                self.pending = self.pending[sent:]
+        except socket.timeout:
+            return False
+        except socket.error:
+            self.close()
+            self.retry_at = time.time() + reconnect_delay
+            return False
+        return True
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+
+transports = {'udp': UDPTransport, 'tcp': TCPTransport}
+
+
 class WatchedGroup:
     """ Can send data from group of specified files to specified servers. """
 
@@ -141,103 +252,232 @@ class WatchedGroup:
         self.files = files
         self.log_type = files.get('log_type', 'syslog')
         self.name = name
-        self._createLogger()
-
-    def _createLogger(self):
+        self._compilePatterns()
+        self._createTransports()
+
+    def _compilePatterns(self):
+        """ Compile patterns of log type once. """
+
+        self.level_regex = None
+        self.strip_regex = None
+        self.levels = {}
+        if self.log_type in msg_levels:
+            msg_type = msg_levels[self.log_type]
+            self.level_regex = re.compile(msg_type['regex'])
+            # Get rid of duplicated information in anaconda logs
+            self.strip_regex = re.compile(msg_type['regex'] + "\s*:?\s?")
+            self.levels = msg_type['levels']
+        # Ignore meaningless errors
+        self.relevels = [
+            (re.compile(r['regex']), r['levelfrom'], r['levelto'])
+            for r in relevel_errors.get(self.log_type, ())
+        ]
+
+    def _createTransports(self):
         self.watchedfiles = []
-        logger = logging.getLogger(self.name)
-        logger.setLevel(logging.NOTSET)
-        logger.propagate = False
-        # Create log formatter.
+        # Create message header without timestamp and message.
         format_dict = {'version': '1',
-                       'timestamp': '%(asctime)s',
+                       'timestamp': '{0}',
                        'hostname': config['hostname'],
                        'appname': self.files['tag'],
                        'procid': '-',
                        'msgid': '-',
                        'structured_data': '-',
-                       'msg': '%(message)s'
+                       'msg': ''
                        }
-        log_format = rfc5424_format.format(**format_dict)
-        formatter = logging.Formatter(log_format, date_format)
-        # Add log handler for each server.
+        self.header = rfc5424_format.format(**format_dict)
+        # Create transport for each server.
+        self.transports = []
         for server in self.servers:
             port = 'port' in server and server['port'] or 514
-            syslog = SysLogHandler((server["host"], port))
-            syslog.setFormatter(formatter)
-            logger.addHandler(syslog)
-        self.logger = logger
+            protocol = server.get('protocol', 'udp')
+            self.transports.append(
+                transports[protocol](server["host"], port))
         # Create WatchedFile objects from list of files.
         for name in self.files['files']:
             self.watchedfiles.append(WatchedFile(name))
 
     def send(self):
-        """ Send append data from files to servers. """
-
+        """ Send append data from files to servers.
+        Files aren't read while any server has too much unsent data,
+        so lines wait in files instead of memory. Return True if
+        there are more lines to send.
+        """
+
+        for transport in self.transports:
+            transport.flush()
+        if [t for t in self.transports if len(t.pending) >= max_pending]:
+            return True
+        header = self.header.format(time.strftime(date_format))
+        messages = []
+        more = False
         for watchedfile in self.watchedfiles:
             for line in watchedfile.readLines():
                 line = line.strip()
-                level = self._get_msg_level(line, self.log_type)
-                # Get rid of duplicated information in anaconda logs
-                line = re.sub(
-                    msg_levels[self.log_type]['regex'] + "\s*:?\s?",
-                    "",
-                    line
-                )
-                # Ignore meaningless errors
-                try:
-                    for r in relevel_errors[self.log_type]:
-                        if level == r['levelfrom'] and \
-                                re.match(r['regex'], line):
-                            level = r['levelto']
-                except KeyError:
-                    pass
-                self.logger.log(level, line)
+                level = self._get_msg_level(line)
+                if self.strip_regex is not None:
+                    line = self.strip_regex.sub("", line)
+                for regex, levelfrom, levelto in self.relevels:
+                    if level == levelfrom and regex.match(line):
+                        level = levelto
+                messages.append(priorities[level] + header + line)
                 main_logger and main_logger.log(
                     level,
                     'From file "%s" send: %s' % (watchedfile.name, line)
                 )
-
-    @staticmethod
-    def _get_msg_level(line, log_type):
-        if log_type in msg_levels:
-            msg_type = msg_levels[log_type]
-            regex = re.match(msg_type['regex'], line)
+            more = more or watchedfile.more
+        if messages:
+            for transport in self.transports:
+                transport.send(messages)
+        return more
+
+    def _get_msg_level(self, line):
+        if self.level_regex is not None:
+            regex = self.level_regex.match(line)
             if regex:
-                return msg_type['levels'][regex.group('level')]
+                return self.levels[regex.group('level')]
         return logging.INFO
 
 
+def _priority(level):
+    """ Encode syslog priority of level like SysLogHandler does. """
+
+    name = SysLogHandler.priority_map.get(logging.getLevelName(level),
+                                          'warning')
+    return '<{0}>'.format(SysLogHandler.LOG_USER << 3 |
+                          SysLogHandler.priority_names[name])
+
+
+priorities = dict([(level, _priority(level)) for level in (
+    logging.DEBUG, logging.INFO, logging.NOTICE, logging.WARNING,
+    logging.ERROR, logging.CRITICAL, logging.ALERT, logging.EMERG)])
+
+
+class Inotify:
+    """ Wakes main loop up when watched files are written.
+    Directories of files are watched, as files can be created or
+    rotated later. Directories which don't exist yet and systems
+    without inotify are polled.
+    """
+
+    IN_MODIFY = 0x2
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    mask = IN_MODIFY | IN_MOVED_TO | IN_CREATE
+
+    def __init__(self):
+        self.fd = None
+        self.watched = set()
+        self.unwatched = set()
+        if ctypes is None:
+            return
+        try:
+            self.libc = ctypes.CDLL(ctypes.util.find_library('c'))
+            fd = self.libc.inotify_init()
+        except (OSError, AttributeError):
+            return
+        if fd >= 0:
+            self.fd = fd
+
+    def watch(self, path):
+        """ Watch directory of file, return False if it's impossible. """
+
+        directory = os.path.dirname(os.path.abspath(path))
+        if isinstance(directory, unicode):
+            # ctypes would pass unicode as wchar_t string.
+            directory = directory.encode(sys.getfilesystemencoding())
+        if directory in self.watched:
+            return True
+        if self.fd is not None and \
+                self.libc.inotify_add_watch(self.fd, directory,
+                                            self.mask) >= 0:
+            self.watched.add(directory)
+            self.unwatched.discard(directory)
+            return True
+        self.unwatched.add(directory)
+        return False
+
+    def wait(self):
+        """ Wait until watched directory changes or until timeout. """
+
+        if self.fd is None or self.unwatched:
+            time.sleep(poll_interval)
+            return
+        try:
+            readable = select.select([self.fd], [], [], watch_interval)[0]
+        except select.error, e:
+            if e.args[0] != errno.EINTR:
+                raise
+            return
+        if readable:
+            # Events don't matter, all files are checked anyway.
+            os.read(self.fd, 65536)
+            time.sleep(batch_delay)
+
+
 def sig_handler(signum, frame):
     """ Send all new data when signal arrived. """
 
     if not sending_in_progress:
-        send_all()
+        send_rest()
         exit(signum)
     else:
         config['run_once'] = True
 
 
 def send_all():
-    """ Send any updates. """
+    """ Send any updates, return True if there are more to send. """
 
+    global sending_in_progress
     sending_in_progress = 1
+    more = False
     for group in watchlist:
-        group.send()
+        more = group.send() or more
     sending_in_progress = 0
+    return more
+
+
+def send_rest():
+    """ Send all new data before exit. Wait for servers to accept
+    unsent data, but give up after flush_timeout seconds.
+    """
+
+    deadline = time.time() + flush_timeout
+    while True:
+        more = send_all()
+        pending = [t for group in watchlist for t in group.transports
+                   if not t.flush()]
+        if not pending:
+            if not more:
+                return
+            deadline = time.time() + flush_timeout
+        elif time.time() >= deadline:
+            return
+        else:
+            time.sleep(poll_interval)
 
 
 def main_loop():
-    """ Periodicaly call sendlogs() for each group in watchlist. """
+    """ Call send_all() when watched files change. """
 
     signal.signal(signal.SIGINT, sig_handler)
     signal.signal(signal.SIGTERM, sig_handler)
+    inotify = Inotify()
     while watchlist:
-        time.sleep(0.5)
-        send_all()
-        # If asked to run_once, exit now
+        for group in watchlist:
+            for watchedfile in group.watchedfiles:
+                inotify.watch(watchedfile.name)
+        # If asked to run_once, send the rest and exit
         if config['run_once']:
+            send_rest()
             break
+        more = send_all()
+        pending = [t for group in watchlist for t in group.transports
+                   if not t.flush()]
+        if pending:
+            time.sleep(poll_interval)
+        elif not more:
+            inotify.wait()
 
 
 class Config:
@@ -254,7 +494,8 @@ class Config:
         #       "run_once": False,
         #       "debug": False,
         #       "watchlist": [
-        #           {"servers": [ {"host": "localhost", "port": 514} ],
+        #           {"servers": [ {"host": "localhost", "port": 514,
+        #                          "protocol": "udp"} ],
         #            "watchfiles": [
         #               {"tag": "anaconda",
         #                "log_type": "anaconda",
@@ -304,7 +545,8 @@ class Config:
             # If no config file specified use watchlist setting from
             # command line.
             watchlist = {"servers": [{"host": cmdline.host,
-                                      "port": cmdline.port}],
+                                      "port": cmdline.port,
+                                      "protocol": cmdline.protocol}],
                          "watchfiles": [{"tag": cmdline.tag,
                                          "log_type": cmdline.log_type,
                                          "files": cmdline.watchfiles}]}
@@ -362,6 +604,11 @@ class Config:
         parser.add_option("-p", "--port", dest="port", type="int", default=514,
                           metavar="PORT",
                           help="Set remote port as PORT (default: %default).")
+        parser.add_option("-P", "--protocol", dest="protocol",
+                          choices=sorted(transports), default='udp',
+                          metavar="PROTOCOL",
+                          help="Send messages by PROTOCOL, udp or tcp"
+                               " (default: %default).")
 
         options, args = parser.parse_args()
         # Validate gathered options.
@@ -373,7 +620,8 @@ class Config:
                 (options.tag or options.watchfiles or options.host)):
             main_logger.warning("If --config or --stdin is set up options"
                                 " --tag, --watchfile, --type,"
-                                " --host and --port will be ignored.")
+                                " --host, --port and --protocol"
+                                " will be ignored.")
         if (not (options.config_file or options.stdin_config) and
                 not (options.tag and options.watchfiles and options.host)):
             parser.error("Options --tag, --watchfile and --host"
@@ -441,6 +689,15 @@ class Config:
                 key, name = "port", "watchlist[n]  => servers[n] => port"
                 if key in item2:
                     cls._checkType(item2[key], int, name)
+                key = "protocol"
+                name = "watchlist[n]  => servers[n] => protocol"
+                if key in item2:
+                    cls._checkType(item2[key], basestring, name)
+                    if item2[key] not in transports:
+                        main_logger.error(
+                            "Value %r in config must be one of %s." %
+                            (name, ', '.join(sorted(transports))))
+                        exit(1)
 
             for item2 in item["watchfiles"]:
                 cls._checkType(item2, dict, "watchlist[n]  => watchfiles[n]")
@@ -14,15 +14,26 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-import json
 import uuid
+import urllib
+from itertools import izip
+from operator import attrgetter, itemgetter
 from wsgiref.handlers import format_date_time
 from datetime import datetime
 
 import web
 import netaddr
+from sqlalchemy import or_, null
+from sqlalchemy import Boolean, Enum, Integer
+from sqlalchemy.orm import class_mapper, joinedload, subqueryload, defer
+from sqlalchemy.orm import undefer
+from sqlalchemy.orm.properties import ColumnProperty
+from sqlalchemy.orm.properties import RelationshipProperty
+from sqlalchemy.orm.attributes import ScalarObjectAttributeImpl
+from sqlalchemy.orm.attributes import CollectionAttributeImpl
 
 import nailgun.rpc as rpc
+from nailgun import jsonutils
 from nailgun.db import db
 from nailgun import notifier
 from nailgun.settings import settings
@@ -34,6 +45,7 @@ from nailgun.api.models import Node
 from nailgun.api.models import Network
 from nailgun.api.models import Vlan
 from nailgun.api.models import Task
+from nailgun.api.versions import versions
 from nailgun.api.validators.base import BasicValidator
 
 
@@ -66,10 +78,39 @@ def content_json(func):
     return json_header
 
 
+def check_etag(resource):
+    """
+    Decorator for GET methods of frequently polled collections.
+    Sets ETag header to current version of resource and responds
+    with '304 Not Modified' before any query is made if client
+    sent the same ETag in If-None-Match header.
+    """
+    def decorator(func):
+        def etag_checker(*args, **kwargs):
+            etag = versions.etag(resource)
+            web.header('ETag', etag)
+            if_none_match = web.ctx.env.get('HTTP_IF_NONE_MATCH', '')
+            tags = [t.strip() for t in if_none_match.split(',')]
+            if etag in tags or 'W/' + etag in tags:
+                raise web.notmodified()
+            return func(*args, **kwargs)
+        return etag_checker
+    return decorator
+
+
+def pretty_requested():
+    """
+    Checks if client asked for indented JSON with '?pretty'
+    request parameter. Compact JSON is sent otherwise.
+    """
+    pretty = web.input(_method='get', pretty=None).pretty
+    return pretty is not None and pretty.lower() not in ('0', 'false')
+
+
 def build_json_response(data):
     web.header('Content-Type', 'application/json')
     if type(data) in (dict, list):
-        return json.dumps(data, indent=4)
+        return jsonutils.dumps(data, pretty=pretty_requested())
     return data
 
 
@@ -92,6 +133,14 @@ class JSONHandler(object):
     validator = BasicValidator
 
     fields = []
+    # columns which collection can be filtered by, see get_collection
+    collection_filters = ()
+    # filters which are skipped for empty value instead of matching NULL
+    collection_skip_empty = ()
+    # number of objects returned by collection if limit isn't specified
+    collection_limit = None
+    # sort collection by descending id, so first page has newest objects
+    collection_newest_first = False
 
     def checked_data(self, validate_method=None):
         try:
@@ -138,51 +187,297 @@ class JSONHandler(object):
                 getattr(logger, log_get[0])(log_get[1])
         return obj
 
+    def requested_fields(self):
+        """
+        Returns set of field names requested by client
+        with '?fields=a,b,c' or None if all fields are needed.
+        """
+        user_data = web.input(fields=None)
+        if not user_data.fields:
+            return None
+        return set(f for f in user_data.fields.split(',') if f)
+
+    def get_collection(self, handler, query, required=()):
+        """
+        Returns list of objects and tuple of fields to render
+        for collection GET request. Request parameters are:
+
+        * filters by columns listed in collection_filters,
+          '?status=ready,error' matches any of values,
+          empty value matches NULL unless filter is listed
+          in collection_skip_empty;
+        * '?fields=a,b,c' - sparse fieldset, only these fields
+          of handler are rendered and other columns are not
+          even loaded from database;
+        * '?limit=N&after_id=M' - keyset pagination, objects are
+          sorted by id (descending if collection_newest_first),
+          link to the next page is sent in 'Link' response header.
+
+        :param handler: Handler which renders collection items.
+        :param query: Query to apply parameters to.
+        :param required: Columns which must be loaded anyway.
+        :returns: (list of objects, tuple of fields)
+        :raises: web.badrequest
+        """
+        model = handler.model
+        user_data = web.input(limit=None, after_id=None)
+
+        for name in self.collection_filters:
+            if name in user_data:
+                if not user_data[name] and \
+                        name in self.collection_skip_empty:
+                    continue
+                query = query.filter(
+                    self._filter_clause(model, name, user_data[name])
+                )
+
+        fields = handler.fields
+        requested = self.requested_fields()
+        if requested is not None:
+            fields = tuple(
+                f for f in handler.fields
+                if (f[0] if isinstance(f, tuple) else f) in requested
+                or f == 'id'
+            )
+            loaded = set(fields) | set(required) | set(['id'])
+            query = query.options(*[
+                defer(prop.key)
+                for prop in class_mapper(model).iterate_properties
+                if isinstance(prop, ColumnProperty)
+                and prop.key not in loaded
+            ])
+        query = handler.eager(query, fields)
+
+        try:
+            limit = int(user_data.limit or self.collection_limit or 0)
+            after_id = int(user_data.after_id or 0)
+        except ValueError:
+            raise web.badrequest("Invalid pagination parameters")
+        if limit < 0:
+            raise web.badrequest("Invalid pagination parameters")
+
+        if self.collection_newest_first:
+            query = query.order_by(model.id.desc())
+            if after_id:
+                query = query.filter(model.id < after_id)
+        else:
+            query = query.order_by(model.id)
+            if after_id:
+                query = query.filter(model.id > after_id)
+        if not limit:
+            return query.all(), fields
+
+        objects = query.limit(limit + 1).all()
+        if len(objects) > limit:
+            objects = objects[:limit]
+            params = dict(web.input())
+            params.update({'limit': limit, 'after_id': objects[-1].id})
+            web.header('Link', '<{0}?{1}>; rel="next"'.format(
+                web.ctx.path,
+                urllib.urlencode(sorted(params.iteritems()))
+            ))
+        return objects, fields
+
+    def _filter_clause(self, model, name, value):
+        column = getattr(model, name)
+        column_type = column.property.columns[0].type
+        values = []
+        for v in value.split(','):
+            if v == '':
+                values.append(None)
+            elif isinstance(column_type, Boolean):
+                if v.lower() not in ('true', 'false', '1', '0'):
+                    raise web.badrequest(
+                        "Invalid value for '{0}': {1}".format(name, v))
+                values.append(v.lower() in ('true', '1'))
+            elif isinstance(column_type, Integer):
+                try:
+                    values.append(int(v))
+                except ValueError:
+                    raise web.badrequest(
+                        "Invalid value for '{0}': {1}".format(name, v))
+            elif isinstance(column_type, Enum) and \
+                    v not in column_type.enums:
+                raise web.badrequest(
+                    "Invalid value for '{0}': {1}".format(name, v))
+            else:
+                values.append(v)
+
+        clauses = []
+        if None in values:
+            values.remove(None)
+            clauses.append(column == null())
+        if values:
+            clauses.append(column.in_(values))
+        return or_(*clauses)
+
     @classmethod
-    def render(cls, instance, fields=None):
-        json_data = {}
+    def eager_options(cls, model=None, fields=None, path=()):
+        """
+        Returns list of query options which load in advance
+        all relationships and deferred columns used by render,
+        so rendering of objects collection doesn't produce
+        additional query for every object. Scalar relationships
+        are joined, collections are loaded by separate subquery.
+        """
+        model = model or cls.model
         use_fields = fields if fields else cls.fields
-        if not use_fields:
-            raise ValueError("No fields for serialize")
+        mapper = class_mapper(model)
+        options = []
         for field in use_fields:
-            if isinstance(field, (tuple,)):
+            name = field[0] if isinstance(field, tuple) else field
+            if not mapper.has_property(name):
+                continue
+            prop = mapper.get_property(name)
+            if isinstance(prop, ColumnProperty) and prop.deferred:
+                options.append(undefer('.'.join(path + (name,))))
+            if not isinstance(prop, RelationshipProperty):
+                continue
+            rel_path = path + (name,)
+            loader = subqueryload if prop.uselist else joinedload
+            options.append(loader('.'.join(rel_path)))
+            if isinstance(field, tuple):
+                rel_model = prop.mapper.class_
                 if field[1] == '*':
-                    subfields = None
+                    handler = handlers.get(rel_model.__name__)
+                    subfields = handler.fields if handler else None
                 else:
                     subfields = field[1:]
+                if subfields:
+                    options.extend(cls.eager_options(
+                        rel_model, subfields, rel_path
+                    ))
+        return options
+
+    @classmethod
+    def eager(cls, query, fields=None):
+        return query.options(*cls.eager_options(fields=fields))
+
+    @classmethod
+    def render(cls, instance, fields=None):
+        use_fields = fields if fields else cls.fields
+        if not use_fields:
+            raise ValueError("No fields for serialize")
+        return get_serializer(instance.__class__, use_fields)(instance)
+
+
+serializers = {}
+
 
-                value = getattr(instance, field[0])
-                rel = getattr(
-                    instance.__class__, field[0]).impl.__class__.__name__
-                if value is None:
-                    pass
-                elif rel == 'ScalarObjectAttributeImpl':
-                    handler = handlers[value.__class__.__name__]
-                    json_data[field[0]] = handler.render(
-                        value, fields=subfields
-                    )
-                elif rel == 'CollectionAttributeImpl':
-                    if not value:
-                        json_data[field[0]] = []
-                    else:
-                        handler = handlers[value[0].__class__.__name__]
-                        json_data[field[0]] = [
-                            handler.render(v, fields=subfields) for v in value
-                        ]
+def get_serializer(model, fields):
+    """
+    Returns serializer function for model and fields
+    compiled by compile_serializer. Serializers are
+    cached, so reflection on model is done only once
+    for every (model, fields) pair.
+    """
+    if isinstance(fields, list):
+        fields = tuple(fields)
+    key = (model, fields)
+    serializer = serializers.get(key)
+    if serializer is None:
+        serializer = serializers[key] = compile_serializer(model, fields)
+    return serializer
+
+
+def compile_serializer(model, fields):
+    """
+    Builds function which renders instance of model into dict
+    with given fields. Plain attributes are fetched at once by
+    attrgetter, relationships are handled by precomputed
+    functions, so no reflection is done per rendered object.
+    """
+    columns = []
+    plain = []
+    related = []
+    for field in fields:
+        if isinstance(field, tuple):
+            name = field[0]
+            subfields = None if field[1] == '*' else field[1:]
+            impl = getattr(getattr(model, name), 'impl', None)
+            if isinstance(impl, ScalarObjectAttributeImpl):
+                related.append(_nested_scalar(name, subfields))
+            elif isinstance(impl, CollectionAttributeImpl):
+                related.append(_nested_collection(name, subfields))
+        else:
+            impl = getattr(getattr(model, field), 'impl', None)
+            if isinstance(impl, ScalarObjectAttributeImpl):
+                related.append(_scalar_id(field))
+            elif isinstance(impl, CollectionAttributeImpl):
+                related.append(_collection_ids(field))
+            elif impl is not None:
+                columns.append(field)
             else:
-                value = getattr(instance, field)
-                if value is None:
-                    json_data[field] = value
-                else:
-                    f = getattr(instance.__class__, field)
-                    if hasattr(f, "impl"):
-                        rel = f.impl.__class__.__name__
-                        if rel == 'ScalarObjectAttributeImpl':
-                            json_data[field] = value.id
-                        elif rel == 'CollectionAttributeImpl':
-                            json_data[field] = [v.id for v in value]
-                        else:
-                            json_data[field] = value
-                    else:
-                        json_data[field] = value
+                plain.append(field)
+
+    # loaded column values are taken right from instance dict,
+    # expired or not loaded ones are fetched by usual getattr
+    columns = tuple(columns)
+    get_loaded = _getter(itemgetter, columns)
+    get_columns = _getter(attrgetter, columns)
+    plain = tuple(plain)
+    get_plain = _getter(attrgetter, plain)
+
+    def serialize(instance):
+        try:
+            values = get_loaded(instance.__dict__)
+        except KeyError:
+            values = get_columns(instance)
+        json_data = dict(izip(columns, values))
+        if plain:
+            json_data.update(izip(plain, get_plain(instance)))
+        for render_related in related:
+            render_related(instance, json_data)
         return json_data
+    return serialize
+
+
+def _getter(getter_class, names):
+    """
+    Returns function which always returns tuple of values
+    """
+    if not names:
+        return lambda obj: ()
+    if len(names) == 1:
+        get_one = getter_class(names[0])
+        return lambda obj: (get_one(obj),)
+    return getter_class(*names)
+
+
+def _scalar_id(name):
+    def render_related(instance, json_data):
+        value = getattr(instance, name)
+        json_data[name] = value.id if value is not None else None
+    return render_related
+
+
+def _collection_ids(name):
+    def render_related(instance, json_data):
+        value = getattr(instance, name)
+        json_data[name] = [v.id for v in value] \
+            if value is not None else None
+    return render_related
+
+
+def _nested_scalar(name, subfields):
+    def render_related(instance, json_data):
+        value = getattr(instance, name)
+        if value is not None:
+            handler = handlers[value.__class__.__name__]
+            json_data[name] = handler.render(value, fields=subfields)
+    return render_related
+
+
+def _nested_collection(name, subfields):
+    def render_related(instance, json_data):
+        value = getattr(instance, name)
+        if value is None:
+            return
+        if not value:
+            json_data[name] = []
+        else:
+            handler = handlers[value[0].__class__.__name__]
+            json_data[name] = [
+                handler.render(v, fields=subfields) for v in value
+            ]
+    return render_related
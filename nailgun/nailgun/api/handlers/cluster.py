@@ -14,7 +14,6 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-import json
 import traceback
 import web
 import netaddr
@@ -33,6 +32,8 @@ from nailgun.api.validators.cluster import ClusterValidator
 from nailgun.api.validators.cluster import AttributesValidator
 from nailgun.network.manager import NetworkManager
 from nailgun.api.handlers.base import JSONHandler, content_json
+from nailgun.api.handlers.base import build_json_response
+from nailgun.api.versions import cluster_versions
 from nailgun.api.handlers.node import NodeHandler
 from nailgun.api.handlers.tasks import TaskHandler
 from nailgun.task.helpers import TaskHelper
@@ -105,6 +106,7 @@ class ClusterHandler(JSONHandler):
             else:
                 setattr(cluster, key, value)
         db().commit()
+        cluster_versions.bump(cluster.id)
         return self.render(cluster)
 
     @content_json
@@ -169,15 +171,15 @@ class ClusterCollectionHandler(JSONHandler):
                 ).all()
                 map(cluster.nodes.append, nodes)
                 db().commit()
+                cluster_versions.bump(cluster.id)
                 for node in nodes:
                     netmanager.allow_network_assignment_to_all_interfaces(
                         node.id
                     )
                     netmanager.assign_networks_to_main_interface(node.id)
 
-            raise web.webapi.created(json.dumps(
-                ClusterHandler.render(cluster),
-                indent=4
+            raise web.webapi.created(build_json_response(
+                ClusterHandler.render(cluster)
             ))
         except (
             errors.OutOfVLANs,
@@ -17,10 +17,8 @@
 import re
 import os
 import time
-import json
 import logging
-import tarfile
-import tempfile
+import calendar
 from itertools import dropwhile
 
 import web
@@ -28,65 +26,25 @@ import web
 from nailgun.db import db
 from nailgun.settings import settings
 from nailgun.api.models import Node
+from nailgun.logs.index import get_index
+from nailgun.logs.follow import log_watcher
+from nailgun.logs.package import package_filter
+from nailgun.logs.package import package_stream
+from nailgun.logs.sources import log_sources
 from nailgun.api.handlers.base import JSONHandler, content_json
 
 logger = logging.getLogger(__name__)
 
 
-def read_backwards(file, bufsize=4096):
-    buf = ""
-    try:
-        file.seek(-1, 1)
-    except IOError:
-        return
-    trailing_newline = False
-    if file.read(1) == "\n":
-        trailing_newline = True
-        file.seek(-1, 1)
-
-    while True:
-        newline_pos = buf.rfind("\n")
-        pos = file.tell()
-        if newline_pos != -1:
-            line = buf[newline_pos + 1:]
-            buf = buf[:newline_pos]
-            if pos or newline_pos or trailing_newline:
-                line += "\n"
-            yield line
-        elif pos:
-            toread = min(bufsize, pos)
-            file.seek(-toread, 1)
-            buf = file.read(toread) + buf
-            file.seek(-toread, 1)
-            if pos == toread:
-                buf = "\n" + buf
-        else:
-            return
-
-
 class LogEntryCollectionHandler(JSONHandler):
 
-    @content_json
-    def GET(self):
-        user_data = web.input()
-        date_before = user_data.get('date_before')
-        if date_before:
-            try:
-                date_before = time.strptime(date_before,
-                                            settings.UI_LOG_DATE_FORMAT)
-            except ValueError:
-                logger.debug("Invalid 'date_before' value: %s", date_before)
-                raise web.badrequest("Invalid 'date_before' value")
-        date_after = user_data.get('date_after')
-        if date_after:
-            try:
-                date_after = time.strptime(date_after,
-                                           settings.UI_LOG_DATE_FORMAT)
-            except ValueError:
-                logger.debug("Invalid 'date_after' value: %s", date_after)
-                raise web.badrequest("Invalid 'date_after' value")
-        truncate_log = bool(user_data.get('truncate_log'))
+    def get_log_file(self, user_data):
+        """
+        Finds log source and path to log file requested.
 
+        :returns: tuple of log source from settings.LOGS and path.
+        :raises: web.badrequest, web.notfound
+        """
         if not user_data.get('source'):
             logger.debug("'source' must be specified")
             raise web.badrequest("'source' must be specified")
@@ -98,7 +56,7 @@ class LogEntryCollectionHandler(JSONHandler):
         if not log_config or (log_config[0].get('fake') and
                               not settings.FAKE_TASKS):
             logger.debug("Log source %r not found", user_data.source)
-            return web.notfound("Log source not found")
+            raise web.notfound("Log source not found")
         log_config = log_config[0]
 
         # If it is 'remote' and not 'fake' log source then calculate log file
@@ -110,7 +68,7 @@ class LogEntryCollectionHandler(JSONHandler):
                 raise web.badrequest("'node' must be specified")
             node = db().query(Node).get(user_data.node)
             if not node:
-                return web.notfound("Node not found")
+                raise web.notfound("Node not found")
             if not node.ip:
                 logger.error('Node %r has no assigned ip', node.id)
                 raise web.internalerror("Node has no assigned ip")
@@ -124,7 +82,7 @@ class LogEntryCollectionHandler(JSONHandler):
             if not os.path.exists(remote_log_dir):
                 logger.debug("Log files dir %r for node %s not found",
                              remote_log_dir, node.id)
-                return web.notfound("Log files dir for node not found")
+                raise web.notfound("Log files dir for node not found")
 
             log_file = os.path.join(remote_log_dir, log_config['path'])
         else:
@@ -136,23 +94,57 @@ class LogEntryCollectionHandler(JSONHandler):
                              log_file, node.id)
             else:
                 logger.debug("Log file %r not found", log_file)
-            return web.notfound("Log file not found")
+            raise web.notfound("Log file not found")
+
+        return log_config, log_file
 
+    def get_levels(self, user_data, log_config):
+        """
+        Returns levels allowed by 'level' filter or None if all
+        levels are allowed.
+        """
+        levels = None
         level = user_data.get('level')
-        allowed_levels = log_config['levels']
         if level is not None:
             if not (level in log_config['levels']):
                 raise web.badrequest("Invalid level")
-            allowed_levels = [l for l in dropwhile(lambda l: l != level,
-                                                   log_config['levels'])]
+            levels = [l for l in dropwhile(lambda l: l != level,
+                                           log_config['levels'])]
+        return levels
+
+    def get_index(self, log_file, log_config):
         try:
-            regexp = re.compile(log_config['regexp'])
+            return get_index(log_file, log_config)
         except re.error, e:
             logger.error('Invalid regular expression for file %r: %s',
                          log_config['id'], e)
             raise web.internalerror("Invalid regular expression in config")
 
-        entries = []
+    @content_json
+    def GET(self):
+        user_data = web.input()
+        date_before = user_data.get('date_before')
+        if date_before:
+            try:
+                date_before = calendar.timegm(time.strptime(
+                    date_before, settings.UI_LOG_DATE_FORMAT))
+            except ValueError:
+                logger.debug("Invalid 'date_before' value: %s", date_before)
+                raise web.badrequest("Invalid 'date_before' value")
+        date_after = user_data.get('date_after')
+        if date_after:
+            try:
+                date_after = calendar.timegm(time.strptime(
+                    date_after, settings.UI_LOG_DATE_FORMAT))
+            except ValueError:
+                logger.debug("Invalid 'date_after' value: %s", date_after)
+                raise web.badrequest("Invalid 'date_after' value")
+        truncate_log = bool(user_data.get('truncate_log'))
+
+        log_config, log_file = self.get_log_file(user_data)
+        levels = self.get_levels(user_data, log_config)
+        index = self.get_index(log_file, log_config)
+
         to_byte = None
         try:
             to_byte = int(user_data.get('to', 0))
@@ -162,11 +154,11 @@ class LogEntryCollectionHandler(JSONHandler):
 
         log_file_size = os.stat(log_file).st_size
         if to_byte >= log_file_size:
-            return json.dumps({
+            return {
                 'entries': [],
                 'to': log_file_size,
                 'has_more': False,
-            })
+            }
 
         try:
             max_entries = int(user_data.get('max_entries',
@@ -175,83 +167,114 @@ class LogEntryCollectionHandler(JSONHandler):
             logger.debug("Invalid 'max_entries' value: %d", max_entries)
             raise web.badrequest("Invalid 'max_entries' value")
 
-        has_more = False
-        with open(log_file, 'r') as f:
-            f.seek(0, 2)
-            # we need to calculate current position manually instead of using
-            # tell() because read_backwards uses buffering
-            pos = f.tell()
-            multilinebuf = []
-            for line in read_backwards(f):
-                pos -= len(line)
-                if not truncate_log and pos < to_byte:
-                    has_more = pos > 0
-                    break
-                entry = line.rstrip('\n')
-                if not len(entry):
-                    continue
-                if 'skip_regexp' in log_config and \
-                        re.match(log_config['skip_regexp'], entry):
-                        continue
-                m = regexp.match(entry)
-                if m is None:
-                    if log_config.get('multiline'):
-                        #  Add next multiline part to last entry if it exist.
-                        multilinebuf.append(entry)
-                    else:
-                        logger.debug("Unable to parse log entry '%s' from %s",
-                                     entry, log_file)
-                    continue
-                entry_text = m.group('text')
-                if len(multilinebuf):
-                    multilinebuf.reverse()
-                    entry_text += '\n' + '\n'.join(multilinebuf)
-                    multilinebuf = []
-                entry_level = m.group('level').upper() or 'INFO'
-                if level and not (entry_level in allowed_levels):
-                    continue
-                try:
-                    entry_date = time.strptime(m.group('date'),
-                                               log_config['date_format'])
-                except ValueError:
-                    logger.debug("Unable to parse date from log entry."
-                                 " Date format: %r, date part of entry: %r",
-                                 log_config['date_format'],
-                                 m.group('date'))
-                    continue
-                entries.append([
-                    time.strftime(settings.UI_LOG_DATE_FORMAT, entry_date),
-                    entry_level,
-                    entry_text
-                ])
-                if truncate_log and len(entries) >= max_entries:
-                    has_more = True
-                    break
+        # 'to' is ignored if log is truncated
+        entries, has_more, indexed_size = index.query(
+            to=0 if truncate_log else to_byte,
+            date_after=date_after,
+            date_before=date_before,
+            levels=levels,
+            limit=max_entries if truncate_log else None
+        )
 
+        # incomplete last line is returned with next entries
         return {
             'entries': entries,
-            'to': log_file_size,
+            'to': indexed_size,
+            'has_more': has_more,
+        }
+
+
+class LogEntryFollowHandler(LogEntryCollectionHandler):
+    """
+    Long polling variant of LogEntryCollectionHandler. Responds
+    with entries appended after 'to' as soon as they are indexed,
+    or with no entries when 'timeout' expires. Client passes 'to'
+    of response to next request.
+    """
+
+    @content_json
+    def GET(self):
+        user_data = web.input()
+        log_config, log_file = self.get_log_file(user_data)
+        levels = self.get_levels(user_data, log_config)
+        index = self.get_index(log_file, log_config)
+        try:
+            to_byte = int(user_data.get('to', 0))
+        except ValueError:
+            raise web.badrequest("Invalid 'to' value")
+        try:
+            timeout = min(
+                float(user_data.get('timeout',
+                                    settings.LOGS_FOLLOW['timeout'])),
+                settings.LOGS_FOLLOW['timeout']
+            )
+        except ValueError:
+            raise web.badrequest("Invalid 'timeout' value")
+
+        response = self.read_entries(index, to_byte, levels)
+        if response['to'] == to_byte:
+            if not log_watcher.follow(index, to_byte, timeout):
+                raise web.webapi.HTTPError(
+                    status="503 Service Unavailable",
+                    data="Too many clients are following logs"
+                )
+            response = self.read_entries(index, to_byte, levels)
+        return response
+
+    def read_entries(self, index, to_byte, levels):
+        entries, has_more, indexed_size = index.query(
+            to=to_byte, levels=levels)
+        if to_byte > indexed_size:
+            # log was rotated, new file is read from the beginning
+            entries, has_more, indexed_size = index.query(
+                to=0, levels=levels)
+        return {
+            'entries': entries,
+            'to': indexed_size,
             'has_more': has_more,
         }
 
 
 class LogPackageHandler(object):
+    """
+    Streams tar.gz package of LOGS_TO_PACK_FOR_SUPPORT. Optional
+    parameters: 'nodes', comma separated ids of nodes which logs
+    are packed, and 'date_after', files not modified since then
+    are left out.
+    """
 
     def GET(self):
-        f = tempfile.TemporaryFile(mode='r+b')
-        tf = tarfile.open(fileobj=f, mode='w:gz')
-        for arcname, path in settings.LOGS_TO_PACK_FOR_SUPPORT.items():
-            tf.add(path, arcname)
-        tf.close()
+        user_data = web.input(nodes=None, date_after=None)
+        node_dirs = None
+        if user_data.nodes:
+            try:
+                node_ids = set(map(int, user_data.nodes.split(',')))
+            except ValueError:
+                raise web.badrequest("Invalid 'nodes' value")
+            nodes = db().query(Node).filter(Node.id.in_(node_ids)).all()
+            if len(nodes) != len(node_ids):
+                raise web.notfound("Node not found")
+            # node logs dir is named by ip, it's linked by fqdn
+            node_dirs = set(
+                d for n in nodes for d in (n.ip, n.fqdn) if d
+            )
+        modified_after = None
+        if user_data.date_after:
+            try:
+                modified_after = time.mktime(time.strptime(
+                    user_data.date_after, settings.UI_LOG_DATE_FORMAT))
+            except ValueError:
+                raise web.badrequest("Invalid 'date_after' value")
 
         filename = 'fuelweb-logs-%s.tar.gz' % (
             time.strftime('%Y-%m-%d_%H:%M:%S', time.localtime()))
         web.header('Content-Type', 'application/octet-stream')
         web.header('Content-Disposition', 'attachment; filename="%s"' % (
             filename))
-        web.header('Content-Length', f.tell())
-        f.seek(0)
-        return f
+        return package_stream(
+            settings.LOGS_TO_PACK_FOR_SUPPORT,
+            package_filter(settings.SYSLOG_DIR, node_dirs, modified_after)
+        )
 
 
 class LogSourceCollectionHandler(JSONHandler):
@@ -282,7 +305,7 @@ class LogSourceByNodeCollectionHandler(JSONHandler):
 
         f = lambda x: (
             x.get('remote') and x.get('path') and x.get('base') and
-            os.access(getpath(x), os.R_OK) and os.path.isfile(getpath(x))
+            log_sources.isfile(getpath(x))
         )
         sources = filter(f, settings.LOGS)
         return sources
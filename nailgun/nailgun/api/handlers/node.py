@@ -14,17 +14,19 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-import json
 import traceback
+import itertools
 from datetime import datetime
 
 import web
+from sqlalchemy.orm import joinedload, defer
 
 from nailgun.db import db
 from nailgun import notifier
 from nailgun.logger import logger
 from nailgun.errors import errors
 from nailgun.api.models import Node
+from nailgun.api.models import NodeHeartbeat
 from nailgun.api.models import Network
 from nailgun.api.models import NetworkAssignment
 from nailgun.api.models import NodeNICInterface
@@ -38,7 +40,10 @@ from nailgun.network.manager import NetworkManager
 from nailgun.volumes.manager import VolumeManager
 from nailgun.api.models import Node, NodeAttributes
 from nailgun.api.handlers.base import JSONHandler, content_json
+from nailgun.api.handlers.base import build_json_response
+from nailgun.api.handlers.base import check_etag
 from nailgun.api.handlers.base import HandlerRegistrator
+from nailgun.api.versions import cluster_versions
 
 
 class NodeHandler(JSONHandler):
@@ -61,6 +66,37 @@ class NodeHandler(JSONHandler):
             logger.error(traceback.format_exc())
         return json_data
 
+    # columns used to build network data
+    network_columns = ('cluster_id', 'mac', 'meta')
+
+    @classmethod
+    def render_collection(cls, nodes, fields=None, with_networks=True):
+        """
+        Renders list of nodes with network data, using
+        constant number of queries for any number of nodes.
+        """
+        nodes_networks = {}
+        if with_networks:
+            network_manager = NetworkManager()
+            nodes_networks = network_manager.get_nodes_networks(
+                nodes,
+                skip_errors=True
+            )
+        json_list = []
+        for node in nodes:
+            json_data = None
+            try:
+                json_data = JSONHandler.render(
+                    node,
+                    fields=fields or cls.fields
+                )
+                if node.id in nodes_networks:
+                    json_data['network_data'] = nodes_networks[node.id]
+            except:
+                logger.error(traceback.format_exc())
+            json_list.append(json_data)
+        return json_list
+
     @content_json
     def GET(self, node_id):
         node = self.get_object_or_404(Node, node_id)
@@ -75,6 +111,7 @@ class NodeHandler(JSONHandler):
         data = self.checked_data(self.validator.validate_update)
 
         network_manager = NetworkManager()
+        old_cluster_id = node.cluster_id
 
         for key, value in data.iteritems():
             # we don't allow to update id explicitly
@@ -106,12 +143,15 @@ class NodeHandler(JSONHandler):
                 logger.warning(traceback.format_exc())
                 notifier.notify("error", msg, node_id=node.id)
         db().commit()
+        cluster_versions.bump(old_cluster_id, node.cluster_id)
         return self.render(node)
 
     def DELETE(self, node_id):
         node = self.get_object_or_404(Node, node_id)
+        cluster_id = node.cluster_id
         db().delete(node)
         db().commit()
+        cluster_versions.bump(cluster_id)
         raise web.webapi.HTTPError(
             status="204 No Content",
             data=""
@@ -121,19 +161,22 @@ class NodeHandler(JSONHandler):
 class NodeCollectionHandler(JSONHandler):
 
     validator = NodeValidator
+    collection_filters = ('cluster_id', 'status', 'online', 'role')
+    # fields rendered in PUT response for nodes which agents
+    # reported nothing new for, their meta isn't even loaded
+    check_in_fields = tuple(f for f in NodeHandler.fields if f != 'meta')
 
+    @check_etag('nodes')
     @content_json
     def GET(self):
-        user_data = web.input(cluster_id=None)
-        if user_data.cluster_id == '':
-            nodes = db().query(Node).filter_by(
-                cluster_id=None).all()
-        elif user_data.cluster_id:
-            nodes = db().query(Node).filter_by(
-                cluster_id=user_data.cluster_id).all()
-        else:
-            nodes = db().query(Node).all()
-        return map(NodeHandler.render, nodes)
+        requested = self.requested_fields()
+        with_networks = requested is None or 'network_data' in requested
+        nodes, fields = self.get_collection(
+            NodeHandler,
+            db().query(Node),
+            required=NodeHandler.network_columns if with_networks else ()
+        )
+        return NodeHandler.render_collection(nodes, fields, with_networks)
 
     @content_json
     def POST(self):
@@ -151,10 +194,12 @@ class NodeCollectionHandler(JSONHandler):
         node.timestamp = datetime.now()
         db().add(node)
         db().commit()
+        cluster_versions.bump(node.cluster_id)
         node.attributes = NodeAttributes()
 
         try:
             node.attributes.volumes = node.volume_manager.gen_volumes_info()
+            node.disks_hash = node.hash_disks(node.meta.get("disks"))
             if node.cluster:
                 node.cluster.add_pending_changes(
                     "disks",
@@ -214,9 +259,8 @@ class NodeCollectionHandler(JSONHandler):
             (cores, ram, hd_size),
             node_id=node.id
         )
-        raise web.webapi.created(json.dumps(
-            NodeHandler.render(node),
-            indent=4
+        raise web.webapi.created(build_json_response(
+            NodeHandler.render(node)
         ))
 
     @content_json
@@ -227,25 +271,44 @@ class NodeCollectionHandler(JSONHandler):
 
         network_manager = NetworkManager()
         q = db().query(Node)
+        macs = [nd["mac"] for nd in data if "mac" in nd]
+        # meta is loaded only for nodes which agents report changes
+        # for, nodes which just check in don't decode it at all
+        nodes_by_mac = dict(
+            (n.mac, n) for n in q.filter(Node.mac.in_(macs)).options(
+                joinedload('attributes'),
+                defer('meta')
+            )
+        ) if macs else {}
         nodes_updated = []
+        checked_in = []
+        back_online = []
+        notifications = []
+        # (node id, old cluster id, new cluster id) of nodes
+        # which networks are reassigned after commit
+        reassigned = []
+        # clusters which nodes were changed, deployment
+        # progress aggregates of them have to be rebuilt
+        clusters_ids = set()
         for nd in data:
             is_agent = nd.pop("is_agent") if "is_agent" in nd else False
             node = None
             if "mac" in nd:
-                node = q.filter_by(mac=nd["mac"]).first() \
+                node = nodes_by_mac.get(nd["mac"]) \
                     or self.validator.validate_existent_node_mac_update(nd)
             else:
                 node = q.get(nd["id"])
+            if is_agent and self._nothing_changed(node, nd):
+                checked_in.append(node)
+                nodes_updated.append(node)
+                continue
             if is_agent:
                 node.timestamp = datetime.now()
                 if not node.online:
                     node.online = True
-                    msg = u"Node '{0}' is back online".format(
-                        node.human_readable_name)
-                    logger.info(msg)
-                    notifier.notify("discover", msg, node_id=node.id)
-                db().commit()
-            if nd.get("cluster_id") is None and node.cluster:
+                    back_online.append(node)
+            if "cluster_id" in nd and nd["cluster_id"] is None \
+                    and node.cluster:
                 node.cluster.clear_pending_changes(node_id=node.id)
             old_cluster_id = node.cluster_id
             for key, value in nd.iteritems():
@@ -261,23 +324,15 @@ class NodeCollectionHandler(JSONHandler):
                     node.update_meta(value)
                 else:
                     setattr(node, key, value)
-            db().commit()
             if not node.attributes:
                 node.attributes = NodeAttributes()
-                db().commit()
             if not node.attributes.volumes:
                 node.attributes.volumes = \
                     node.volume_manager.gen_volumes_info()
-                db().commit()
+                node.disks_hash = node.hash_disks(node.meta.get("disks"))
             if not node.status in ('provisioning', 'deploying'):
                 variants = (
-                    "disks" in node.meta and
-                    len(node.meta["disks"]) != len(
-                        filter(
-                            lambda d: d["type"] == "disk",
-                            node.attributes.volumes
-                        )
-                    ),
+                    node.disks_changed,
                     "role" in nd,
                     "cluster_id" in nd
                 )
@@ -285,6 +340,8 @@ class NodeCollectionHandler(JSONHandler):
                     try:
                         node.attributes.volumes = \
                             node.volume_manager.gen_volumes_info()
+                        node.disks_hash = node.hash_disks(
+                            node.meta.get("disks"))
                         if node.cluster:
                             node.cluster.add_pending_changes(
                                 "disks",
@@ -299,27 +356,112 @@ class NodeCollectionHandler(JSONHandler):
                             str(exc) or "see logs for details"
                         )
                         logger.warning(traceback.format_exc())
-                        notifier.notify("error", msg, node_id=node.id)
+                        notifications.append({
+                            'topic': 'error',
+                            'message': msg,
+                            'node_id': node.id
+                        })
 
-                db().commit()
             if is_agent:
-                # Update node's NICs.
-                if node.meta and 'interfaces' in node.meta:
+                # Update node's NICs only if they were changed.
+                if node.meta and 'interfaces' in node.meta \
+                        and node.interfaces_changed:
                     # we won't update interfaces if data is invalid
                     network_manager.update_interfaces_info(node.id)
 
             nodes_updated.append(node)
-            db().commit()
+            clusters_ids.update((old_cluster_id, node.cluster_id))
             if 'cluster_id' in nd and nd['cluster_id'] != old_cluster_id:
-                if old_cluster_id:
-                    network_manager.clear_assigned_networks(node.id)
-                    network_manager.clear_all_allowed_networks(node.id)
-                if nd['cluster_id']:
-                    network_manager.allow_network_assignment_to_all_interfaces(
-                        node.id
-                    )
-                    network_manager.assign_networks_to_main_interface(node.id)
-        return map(NodeHandler.render, nodes_updated)
+                reassigned.append((node.id, old_cluster_id, nd['cluster_id']))
+        back_online.extend(self._check_in(checked_in))
+        for node in back_online:
+            clusters_ids.add(node.cluster_id)
+            msg = u"Node '{0}' is back online".format(
+                node.human_readable_name)
+            logger.info(msg)
+            notifications.append({
+                'topic': 'discover',
+                'message': msg,
+                'node_id': node.id
+            })
+        # all changes of nodes and notifications
+        # are committed in the same transaction
+        notifier.notify_many(notifications)
+        db().commit()
+        cluster_versions.bump(*clusters_ids)
+
+        for node_id, old_cluster_id, cluster_id in reassigned:
+            if old_cluster_id:
+                network_manager.clear_assigned_networks(node_id)
+                network_manager.clear_all_allowed_networks(node_id)
+            if cluster_id:
+                network_manager.allow_network_assignment_to_all_interfaces(
+                    node_id
+                )
+                network_manager.assign_networks_to_main_interface(node_id)
+
+        checked_in_ids = set(n.id for n in checked_in)
+        rendered = dict(
+            (json_data['id'], json_data) for json_data in itertools.chain(
+                NodeHandler.render_collection([
+                    n for n in nodes_updated if n.id not in checked_in_ids
+                ]),
+                # network data is built from meta too, agents
+                # don't use it, so it's skipped as well
+                NodeHandler.render_collection(
+                    checked_in,
+                    fields=self.check_in_fields,
+                    with_networks=False
+                )
+            ) if json_data
+        )
+        return [rendered.get(n.id) for n in nodes_updated]
+
+    @classmethod
+    def _nothing_changed(cls, node, nd):
+        """
+        Checks if data sent by agent matches what is already
+        stored for node. Meta is compared by hash of meta
+        reported last time.
+        """
+        if not (node.attributes and node.attributes.volumes):
+            return False
+        for key, value in nd.iteritems():
+            if key == "meta":
+                if Node.hash_meta(value) != node.meta_hash:
+                    return False
+            elif (key, value) == ("status", "discover") \
+                    and node.status == "provisioning":
+                # agent can't update provisioning back to discover
+                continue
+            elif not hasattr(node, key) or getattr(node, key) != value:
+                return False
+        return True
+
+    def _check_in(self, nodes):
+        """
+        Updates heartbeats of nodes which agents reported
+        nothing new with single query to narrow heartbeats
+        table, so wide rows of nodes aren't rewritten.
+        Returns nodes which are back online.
+        """
+        if not nodes:
+            return []
+        timestamp = datetime.now()
+        nodes_ids = set(n.id for n in nodes)
+        result = db().execute(
+            NodeHeartbeat.__table__.update().where(
+                NodeHeartbeat.node_id.in_(nodes_ids)
+            ).values(timestamp=timestamp)
+        )
+        if result.rowcount < len(nodes_ids):
+            for node in nodes:
+                if not node.heartbeat:
+                    node.timestamp = timestamp
+        back_online = [node for node in nodes if not node.online]
+        for node in back_online:
+            node.online = True
+        return back_online
 
 
 class NodeAttributesHandler(JSONHandler):
@@ -23,6 +23,7 @@ from nailgun.db import db
 from nailgun.api.models import Notification
 from nailgun.api.validators.notification import NotificationValidator
 from nailgun.api.handlers.base import JSONHandler, content_json
+from nailgun.api.handlers.base import check_etag
 
 
 class NotificationHandler(JSONHandler):
@@ -40,7 +41,7 @@ class NotificationHandler(JSONHandler):
 
     @classmethod
     def render(cls, instance, fields=None):
-        json_data = JSONHandler.render(instance, fields=cls.fields)
+        json_data = JSONHandler.render(instance, fields=fields or cls.fields)
         json_data["time"] = ":".join([
             instance.datetime.strftime("%H"),
             instance.datetime.strftime("%M"),
@@ -72,23 +73,27 @@ class NotificationHandler(JSONHandler):
 class NotificationCollectionHandler(JSONHandler):
 
     validator = NotificationValidator
+    collection_filters = ('cluster_id', 'status', 'topic')
+    # empty cluster_id was always ignored by this handler
+    collection_skip_empty = ('cluster_id',)
+    # Temporarly limit notifications number to prevent bloating UI by
+    # lots of old notifications. Client can request next pages using
+    # link from response headers.
+    collection_limit = 1000
+    collection_newest_first = True
 
+    @check_etag('notifications')
     @content_json
     def GET(self):
-        user_data = web.input(cluster_id=None)
-        query = db().query(Notification)
-        if user_data.cluster_id:
-            query = query.filter_by(cluster_id=user_data.cluster_id)
-        # Temporarly limit notifications number to prevent bloating UI by
-        # lots of old notifications. Normally, this should be done by querying
-        # separately unread notifications for notifier and use pagination for
-        # list of all notifications
-        query = query.limit(1000)
-        notifications = query.all()
-        return map(
-            NotificationHandler.render,
-            notifications
+        notifications, fields = self.get_collection(
+            NotificationHandler,
+            db().query(Notification),
+            required=('datetime',)
         )
+        return [
+            NotificationHandler.render(n, fields=fields)
+            for n in notifications
+        ]
 
     @content_json
     def PUT(self):
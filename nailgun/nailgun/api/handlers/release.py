@@ -14,7 +14,6 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-import json
 
 import web
 
@@ -23,6 +22,7 @@ from nailgun.errors import errors
 from nailgun.api.models import Release
 from nailgun.api.validators.release import ReleaseValidator
 from nailgun.api.handlers.base import JSONHandler, content_json
+from nailgun.api.handlers.base import build_json_response
 
 
 class ReleaseHandler(JSONHandler):
@@ -83,7 +83,6 @@ class ReleaseCollectionHandler(JSONHandler):
             setattr(release, key, value)
         db().add(release)
         db().commit()
-        raise web.webapi.created(json.dumps(
-            ReleaseHandler.render(release),
-            indent=4
+        raise web.webapi.created(build_json_response(
+            ReleaseHandler.render(release)
         ))
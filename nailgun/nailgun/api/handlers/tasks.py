@@ -20,7 +20,9 @@ import web
 
 from nailgun.db import db
 from nailgun.api.models import Task
+from nailgun.task.helpers import TaskHelper
 from nailgun.api.handlers.base import JSONHandler, content_json
+from nailgun.api.handlers.base import check_etag
 
 
 class TaskHandler(JSONHandler):
@@ -45,6 +47,9 @@ class TaskHandler(JSONHandler):
         task = self.get_object_or_404(Task, task_id)
         if task.status not in ("ready", "error"):
             raise web.badrequest("You cannot delete running task manually")
+        TaskHelper.drop_deploy_progress(
+            task.uuid, *[subtask.uuid for subtask in task.subtasks]
+        )
         for subtask in task.subtasks:
             db().delete(subtask)
         db().delete(task)
@@ -57,18 +62,10 @@ class TaskHandler(JSONHandler):
 
 class TaskCollectionHandler(JSONHandler):
 
+    collection_filters = ('cluster_id', 'status', 'name')
+
+    @check_etag('tasks')
     @content_json
     def GET(self):
-        user_data = web.input(cluster_id=None)
-        if user_data.cluster_id == '':
-            tasks = db().query(Task).filter_by(
-                cluster_id=None).all()
-        elif user_data.cluster_id:
-            tasks = db().query(Task).filter_by(
-                cluster_id=user_data.cluster_id).all()
-        else:
-            tasks = db().query(Task).all()
-        return map(
-            TaskHandler.render,
-            tasks
-        )
+        tasks, fields = self.get_collection(TaskHandler, db().query(Task))
+        return [TaskHandler.render(t, fields=fields) for t in tasks]
@@ -16,20 +16,23 @@
 #    under the License.
 
 import re
+import json
 import uuid
 import string
 import math
+import hashlib
 from datetime import datetime
 from random import choice
 from copy import deepcopy
 
 import web
 from netaddr import IPNetwork
-from sqlalchemy import Column, UniqueConstraint, Table
+from sqlalchemy import Column, UniqueConstraint, Table, Index
 from sqlalchemy import Integer, String, Unicode, Text, Boolean, Float
 from sqlalchemy import ForeignKey, Enum, DateTime
 from sqlalchemy import create_engine
-from sqlalchemy.orm import relationship, backref
+from sqlalchemy import event
+from sqlalchemy.orm import relationship, backref, deferred
 from sqlalchemy.ext.declarative import declarative_base
 
 from nailgun.logger import logger
@@ -59,9 +62,10 @@ class Release(Base):
     state = Column(Enum(*STATES, name='release_state'),
                    nullable=False,
                    default='not_available')
-    networks_metadata = Column(JSON, default=[])
-    attributes_metadata = Column(JSON, default={})
-    volumes_metadata = Column(JSON, default={})
+    # large JSON columns are loaded and decoded on first access
+    networks_metadata = deferred(Column(JSON, default=[]))
+    attributes_metadata = deferred(Column(JSON, default={}))
+    volumes_metadata = deferred(Column(JSON, default={}))
     clusters = relationship("Cluster", backref="release")
 
 
@@ -159,7 +163,7 @@ class Cluster(Base):
         if node_id:
             ch.node_id = node_id
         db().add(ch)
-        db().commit()
+        db().flush()
 
     def clear_pending_changes(self, node_id=None):
         chs = db().query(ClusterChanges).filter_by(
@@ -168,11 +172,15 @@ class Cluster(Base):
         if node_id:
             chs = chs.filter_by(node_id=node_id)
         map(db().delete, chs.all())
-        db().commit()
+        db().flush()
 
 
 class Node(Base):
     __tablename__ = 'nodes'
+    __table_args__ = (
+        Index('ix_nodes_cluster_id_status', 'cluster_id', 'status'),
+        Index('ix_nodes_online_status', 'online', 'status'),
+    )
     NODE_STATUSES = (
         'ready',
         'discover',
@@ -200,6 +208,13 @@ class Node(Base):
         default='discover'
     )
     meta = Column(JSON, default={})
+    # hash of meta last reported by agent, see update_meta
+    meta_hash = Column(String(32))
+    # hashes of meta which volumes and interfaces were generated
+    # from last time, volumes are regenerated (and configured ones
+    # are lost) only when disks_hash changes, see hash_disks
+    disks_hash = Column(String(32))
+    interfaces_hash = Column(String(32))
     mac = Column(String(17), nullable=False, unique=True)
     ip = Column(String(15))
     fqdn = Column(String(255))
@@ -213,13 +228,26 @@ class Node(Base):
     changes = relationship("ClusterChanges", backref="node")
     error_type = Column(Enum(*NODE_ERRORS, name='node_error_type'))
     error_msg = Column(String(255))
-    timestamp = Column(DateTime, nullable=False)
     online = Column(Boolean, default=True)
     attributes = relationship("NodeAttributes",
                               backref=backref("node"),
                               uselist=False)
     interfaces = relationship("NodeNICInterface", backref="node",
                               cascade="delete")
+    heartbeat = relationship("NodeHeartbeat",
+                             uselist=False,
+                             cascade="all, delete-orphan")
+
+    @property
+    def timestamp(self):
+        return self.heartbeat.timestamp if self.heartbeat else None
+
+    @timestamp.setter
+    def timestamp(self, value):
+        if self.heartbeat:
+            self.heartbeat.timestamp = value
+        else:
+            self.heartbeat = NodeHeartbeat(timestamp=value)
 
     @property
     def network_data(self):
@@ -273,8 +301,46 @@ class Node(Base):
             iface[param] = val
         return iface
 
+    @classmethod
+    def hash_meta(cls, data):
+        return hashlib.md5(json.dumps(data, sort_keys=True)).hexdigest()
+
+    @classmethod
+    def hash_disks(cls, disks):
+        """
+        Hashes only ids and sizes of disks which volumes are built
+        from, so order of disks and other fields reported by agent
+        don't cause regeneration of volumes.
+        """
+        return cls.hash_meta(sorted(
+            (d.get("disk"), d.get("size")) for d in disks or []
+        ))
+
+    @property
+    def disks_changed(self):
+        """
+        Checks if disks in meta differ from ones
+        volumes were generated for last time.
+        """
+        if "disks" not in self.meta:
+            return False
+        if self.disks_hash is None:
+            # volumes were generated before disks were hashed,
+            # so only number of disks can be compared
+            return len(self.meta["disks"]) != len(filter(
+                lambda d: d["type"] == "disk",
+                self.attributes.volumes
+            ))
+        return self.hash_disks(self.meta["disks"]) != self.disks_hash
+
+    @property
+    def interfaces_changed(self):
+        return self.hash_meta(self.meta.get("interfaces")) \
+            != self.interfaces_hash
+
     def update_meta(self, data):
         # helper for basic checking meta before updation
+        meta_hash = self.hash_meta(data)
         result = []
         for iface in data["interfaces"]:
             if not self._check_interface_has_required_params(iface):
@@ -284,14 +350,17 @@ class Node(Base):
                 )
                 data["interfaces"] = self.meta.get("interfaces")
                 self.meta = data
+                self.meta_hash = meta_hash
                 return
             result.append(self._clean_iface(iface))
 
         data["interfaces"] = result
         self.meta = data
+        self.meta_hash = meta_hash
 
     def create_meta(self, data):
         # helper for basic checking meta before creation
+        meta_hash = self.hash_meta(data)
         result = []
         for iface in data["interfaces"]:
             if not self._check_interface_has_required_params(iface):
@@ -304,6 +373,28 @@ class Node(Base):
 
         data["interfaces"] = result
         self.meta = data
+        self.meta_hash = meta_hash
+
+
+def reset_meta_hash(target, value, oldvalue, initiator):
+    # meta assigned directly doesn't match any reported one
+    target.meta_hash = None
+
+event.listen(Node.meta, 'set', reset_meta_hash)
+
+
+class NodeHeartbeat(Base):
+    """
+    Time of the last node agent check-in. It is stored apart from
+    nodes, so frequent check-ins don't rewrite wide rows of nodes.
+    """
+    __tablename__ = 'node_heartbeats'
+    node_id = Column(
+        Integer,
+        ForeignKey('nodes.id', ondelete='CASCADE'),
+        primary_key=True
+    )
+    timestamp = Column(DateTime, nullable=False, index=True)
 
 
 class NodeAttributes(Base):
@@ -316,6 +407,11 @@ class NodeAttributes(Base):
 
 class IPAddr(Base):
     __tablename__ = 'ip_addrs'
+    __table_args__ = (
+        Index('ix_ip_addrs_node_network', 'node', 'network'),
+        Index('ix_ip_addrs_network_node', 'network', 'node'),
+        Index('ix_ip_addrs_ip_addr', 'ip_addr'),
+    )
     id = Column(Integer, primary_key=True)
     network = Column(Integer, ForeignKey('networks.id', ondelete="CASCADE"))
     node = Column(Integer, ForeignKey('nodes.id', ondelete="CASCADE"))
@@ -342,10 +438,14 @@ class Network(Base):
     id = Column(Integer, primary_key=True)
     # can be nullable only for fuelweb admin net
     release = Column(Integer, ForeignKey('releases.id'))
-    name = Column(Unicode(100), nullable=False)
+    name = Column(Unicode(100), nullable=False, index=True)
     access = Column(String(20), nullable=False)
     vlan_id = Column(Integer, ForeignKey('vlan.id'))
-    network_group_id = Column(Integer, ForeignKey('network_groups.id'))
+    network_group_id = Column(
+        Integer,
+        ForeignKey('network_groups.id'),
+        index=True
+    )
     cidr = Column(String(25), nullable=False)
     gateway = Column(String(25))
     nodes = relationship(
@@ -560,8 +660,8 @@ class Task(Base):
         'download_release'
     )
     id = Column(Integer, primary_key=True)
-    cluster_id = Column(Integer, ForeignKey('clusters.id'))
-    uuid = Column(String(36), nullable=False,
+    cluster_id = Column(Integer, ForeignKey('clusters.id'), index=True)
+    uuid = Column(String(36), nullable=False, unique=True, index=True,
                   default=lambda: str(uuid.uuid4()))
     name = Column(
         Enum(*TASK_NAMES, name='task_name'),
@@ -575,9 +675,10 @@ class Task(Base):
         default='running'
     )
     progress = Column(Integer, default=0)
-    cache = Column(JSON, default={})
+    # whole RPC message, loaded and decoded on first access
+    cache = deferred(Column(JSON, default={}))
     result = Column(JSON, default={})
-    parent_id = Column(Integer, ForeignKey('tasks.id'))
+    parent_id = Column(Integer, ForeignKey('tasks.id'), index=True)
     subtasks = relationship(
         "Task",
         backref=backref('parent', remote_side=[id])
@@ -612,6 +713,10 @@ class Task(Base):
 
 class Notification(Base):
     __tablename__ = 'notifications'
+    __table_args__ = (
+        # collection filtered by cluster and paginated by id
+        Index('ix_notifications_cluster_id_id', 'cluster_id', 'id'),
+    )
 
     NOTIFICATION_STATUSES = (
         'read',
@@ -629,8 +734,16 @@ class Notification(Base):
         Integer,
         ForeignKey('clusters.id', ondelete='SET NULL')
     )
-    node_id = Column(Integer, ForeignKey('nodes.id', ondelete='SET NULL'))
-    task_id = Column(Integer, ForeignKey('tasks.id', ondelete='SET NULL'))
+    node_id = Column(
+        Integer,
+        ForeignKey('nodes.id', ondelete='SET NULL'),
+        index=True
+    )
+    task_id = Column(
+        Integer,
+        ForeignKey('tasks.id', ondelete='SET NULL'),
+        index=True
+    )
     topic = Column(
         Enum(*NOTIFICATION_TOPICS, name='notif_topic'),
         nullable=False
@@ -642,6 +755,9 @@ class Notification(Base):
         default='unread'
     )
     datetime = Column(DateTime, nullable=False)
+    # hash of (node_id, task uuid, message) for notifications
+    # about particular node in task, used to skip duplicates
+    dedup_key = Column(String(32), index=True)
 
 
 class L2Topology(Base):
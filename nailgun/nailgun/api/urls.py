@@ -51,6 +51,7 @@ from nailgun.api.handlers.notifications import NotificationHandler
 from nailgun.api.handlers.notifications import NotificationCollectionHandler
 
 from nailgun.api.handlers.logs import LogEntryCollectionHandler
+from nailgun.api.handlers.logs import LogEntryFollowHandler
 from nailgun.api.handlers.logs import LogPackageHandler
 from nailgun.api.handlers.logs import LogSourceCollectionHandler
 from nailgun.api.handlers.logs import LogSourceByNodeCollectionHandler
@@ -115,6 +116,8 @@ urls = (
     'NotificationHandler',
     r'/logs/?$',
     'LogEntryCollectionHandler',
+    r'/logs/follow/?$',
+    'LogEntryFollowHandler',
     r'/logs/package/?$',
     'LogPackageHandler',
     r'/logs/sources/?$',
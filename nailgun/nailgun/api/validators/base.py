@@ -13,8 +13,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-import json
-
+from nailgun import jsonutils
 from nailgun.errors import errors
 
 
@@ -23,7 +22,7 @@ class BasicValidator(object):
     def validate_json(cls, data):
         if data:
             try:
-                res = json.loads(data)
+                res = jsonutils.loads(data)
             except:
                 raise errors.InvalidData(
                     "Invalid json received",
@@ -165,6 +165,10 @@ class NodeValidator(BasicValidator):
             )
 
         q = db().query(Node)
+        macs = [nd["mac"] for nd in d if "mac" in nd]
+        known_macs = set(
+            mac for (mac,) in db().query(Node.mac).filter(Node.mac.in_(macs))
+        ) if macs else set()
         for nd in d:
             if not "mac" in nd and not "id" in nd:
                 raise errors.InvalidData(
@@ -172,9 +176,9 @@ class NodeValidator(BasicValidator):
                     log_message=True
                 )
             else:
-                if "mac" in nd:
-                    existent_node = q.filter_by(mac=nd["mac"]).first() \
-                        or cls.validate_existent_node_mac_update(nd)
+                if "mac" in nd and nd["mac"] not in known_macs:
+                    existent_node = \
+                        cls.validate_existent_node_mac_update(nd)
                     if not existent_node:
                         raise errors.InvalidData(
                             "Invalid MAC specified",
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import uuid
+import itertools
+import threading
+from weakref import WeakKeyDictionary
+
+from sqlalchemy import event
+from sqlalchemy.orm.session import Session
+
+from nailgun.api.models import Cluster
+from nailgun.api.models import Node
+from nailgun.api.models import NodeNICInterface
+from nailgun.api.models import NetworkAssignment
+from nailgun.api.models import AllowedNetworks
+from nailgun.api.models import IPAddr
+from nailgun.api.models import Network
+from nailgun.api.models import NetworkGroup
+from nailgun.api.models import Task
+from nailgun.api.models import Notification
+
+
+# models which rendered representation of resource depends on,
+# including tables written through secondary relationships
+RESOURCES = {
+    'nodes': (
+        Node, NodeNICInterface, NetworkAssignment, AllowedNetworks,
+        IPAddr, Network, NetworkGroup, Cluster
+    ),
+    'tasks': (Task, Cluster),
+    'notifications': (Notification, Cluster)
+}
+
+
+class ResourceVersions(object):
+    """
+    In-memory version counters of API resources.
+
+    Version of resource is changed after every committed
+    transaction which wrote to any of its models, so it
+    can be used as a cheap ETag for collection GET requests.
+    Counters live in API process, which also runs RPC receiver
+    and KeepAlive watcher, so all writes are noticed. Random
+    token makes ETags issued before restart invalid.
+    """
+
+    def __init__(self, resources):
+        self.token = uuid.uuid4().hex[:8]
+        self.resources = {}
+        for resource, models in resources.iteritems():
+            for model in models:
+                self.resources.setdefault(model, set()).add(resource)
+        self.versions = dict((r, 0) for r in resources)
+        self.counter = itertools.count(1)
+        self.pending = WeakKeyDictionary()
+        self.lock = threading.Lock()
+
+    def etag(self, resource):
+        return '"{0}-{1}"'.format(self.token, self.versions[resource])
+
+    def bump(self, *resources):
+        with self.lock:
+            version = next(self.counter)
+            for resource in resources:
+                self.versions[resource] = version
+
+    def changed(self, session, *models):
+        """
+        Marks resources which depend on models as changed
+        when session is committed. Should be called after
+        writes which bypass ORM, like INSERT executed with Core.
+        """
+        resources = set()
+        for model in models:
+            resources.update(self.resources.get(model, ()))
+        if resources:
+            with self.lock:
+                self.pending.setdefault(session, set()).update(resources)
+
+    def after_flush(self, session, flush_context):
+        self.changed(session, *set(
+            obj.__class__ for obj in itertools.chain(
+                session.new, session.dirty, session.deleted
+            )
+        ))
+
+    def after_bulk(self, session, query, query_context, result):
+        self.changed(session, *set(
+            d['type'] for d in query.column_descriptions
+        ))
+
+    def after_commit(self, session):
+        with self.lock:
+            resources = self.pending.pop(session, None)
+        if resources:
+            self.bump(*resources)
+
+    def after_rollback(self, session):
+        with self.lock:
+            self.pending.pop(session, None)
+
+    def listen(self):
+        event.listen(Session, 'after_flush', self.after_flush)
+        event.listen(Session, 'after_bulk_update', self.after_bulk)
+        event.listen(Session, 'after_bulk_delete', self.after_bulk)
+        event.listen(Session, 'after_commit', self.after_commit)
+        event.listen(Session, 'after_rollback', self.after_rollback)
+
+
+versions = ResourceVersions(RESOURCES)
+versions.listen()
+
+
+class ClusterVersions(object):
+    """
+    In-memory counters of changes of cluster nodes made
+    outside of deployment responses: nodes added to or removed
+    from cluster, changed by API or marked offline by KeepAlive
+    watcher. Deployment progress aggregates built for older
+    version of their cluster are rebuilt from database.
+    Counters have to be bumped after changes are committed.
+    """
+
+    def __init__(self):
+        self.versions = {}
+        self.lock = threading.Lock()
+
+    def get(self, cluster_id):
+        return self.versions.get(cluster_id, 0)
+
+    def bump(self, *cluster_ids):
+        with self.lock:
+            for cluster_id in cluster_ids:
+                if cluster_id is not None:
+                    self.versions[cluster_id] = \
+                        self.versions.get(cluster_id, 0) + 1
+
+
+cluster_versions = ClusterVersions()
@@ -23,6 +23,7 @@ from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.orm.query import Query
 from sqlalchemy.exc import ProgrammingError
 from sqlalchemy import create_engine
+from sqlalchemy.engine.reflection import Inspector
 
 from nailgun.logger import logger
 from nailgun.settings import settings
@@ -38,21 +39,26 @@ engine = create_engine(db_str, client_encoding='utf8')
 class NoCacheQuery(Query):
     """
     Override for common Query class.
-    Needed for automatic refreshing objects
-    from database during every query for evading
-    problems with multiple sessions
+    Refreshes objects from database during every query,
+    for sessions which can't expire objects loaded before
+    other sessions changed them.
     """
     def __init__(self, *args, **kwargs):
         self._populate_existing = True
         super(NoCacheQuery, self).__init__(*args, **kwargs)
 
 
+# Objects are reused from session identity map, so repeated
+# lookups of the same objects don't hit database. Session
+# is expired after every request (see load_db_driver) and
+# RPC response, code which needs changes made by other
+# sessions in the middle of transaction should refresh
+# objects explicitly with db().refresh() or expire_all().
 db = scoped_session(
     sessionmaker(
         autoflush=True,
         autocommit=False,
-        bind=engine,
-        query_cls=NoCacheQuery
+        bind=engine
     )
 )
 
@@ -74,6 +80,67 @@ def load_db_driver(handler):
 def syncdb():
     from nailgun.api.models import Base
     Base.metadata.create_all(engine)
+    upgradedb()
+
+
+def upgradedb():
+    """
+    Brings tables of existing database up to date with models:
+    adds missing nullable columns without foreign keys and
+    creates missing indexes. Tables have to be created before.
+    Can be safely run many times.
+    """
+    from nailgun.api.models import Base
+    inspector = Inspector.from_engine(engine)
+    with contextlib.closing(engine.connect()) as con:
+        trans = con.begin()
+        _move_node_timestamps(con, inspector)
+        for table in Base.metadata.sorted_tables:
+            columns = set(c['name'] for c in inspector.get_columns(
+                table.name))
+            for column in table.columns:
+                if column.name in columns:
+                    continue
+                if not column.nullable or column.foreign_keys:
+                    logger.warning(
+                        u"Can't add column %s.%s automatically",
+                        table.name, column.name
+                    )
+                    continue
+                logger.info(u"Adding column %s.%s", table.name, column.name)
+                con.execute("ALTER TABLE {0} ADD COLUMN {1} {2}".format(
+                    table.name,
+                    column.name,
+                    column.type.compile(dialect=engine.dialect)
+                ))
+            indexes = set(i['name'] for i in inspector.get_indexes(
+                table.name))
+            for index in table.indexes:
+                if index.name not in indexes:
+                    logger.info(u"Creating index %s", index.name)
+                    index.create(con)
+        trans.commit()
+
+
+def _move_node_timestamps(con, inspector):
+    """
+    Agent check-in time used to be stored in NOT NULL column
+    nodes.timestamp, now it is kept in node_heartbeats table.
+    Copies timestamps there and drops the column, otherwise
+    new nodes can't be inserted.
+    """
+    columns = set(c['name'] for c in inspector.get_columns('nodes'))
+    if 'timestamp' not in columns:
+        return
+    logger.info(u"Moving nodes.timestamp to node_heartbeats")
+    con.execute("""
+        INSERT INTO node_heartbeats (node_id, timestamp)
+        SELECT id, timestamp FROM nodes
+        WHERE timestamp IS NOT NULL AND id NOT IN (
+            SELECT node_id FROM node_heartbeats
+        )
+        """)
+    con.execute("ALTER TABLE nodes DROP COLUMN timestamp")
 
 
 def dropdb():
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+JSON encoding and decoding shared by API, database JSON
+columns and RPC. Codecs are chosen once at import time.
+
+Both stdlib json and simplejson encode with C speedups only
+when output isn't indented, and stdlib encoder is faster
+of them, so it's always used. Decoding is done by simplejson
+if its C speedups are built, it's faster than stdlib decoder.
+See nailgun/test/json_benchmark.py for measurements.
+"""
+
+import json
+
+try:
+    import simplejson
+except ImportError:
+    simplejson = None
+
+# scanner of simplejson is None if C speedups aren't built
+if simplejson is not None and simplejson.decoder.c_scanstring is None:
+    simplejson = None
+
+
+decoder = simplejson if simplejson is not None else json
+
+# name of decoder in use, e.g. for logging and benchmarks
+DECODER = decoder.__name__
+
+COMPACT_SEPARATORS = (',', ':')
+
+
+def dumps(data, pretty=False):
+    """
+    Encodes data into JSON string. Output is compact unless
+    pretty is set: indented output is several times slower
+    to build, because C encoder doesn't support indentation.
+
+    :param data: Data to encode.
+    :param pretty: Indent output for humans.
+    :type  pretty: bool
+    :returns: JSON string.
+    """
+    if pretty:
+        return json.dumps(data, indent=4)
+    return json.dumps(data, separators=COMPACT_SEPARATORS)
+
+
+def loads(data):
+    """
+    Decodes JSON string. Strings in result are always unicode,
+    as they are with stdlib json.
+
+    :param data: JSON string.
+    :type  data: str or unicode
+    :returns: Decoded data.
+    """
+    if isinstance(data, str):
+        # simplejson returns str for ASCII-only strings of str input
+        data = data.decode('utf-8')
+    return decoder.loads(data)
@@ -19,12 +19,15 @@ import threading
 import traceback
 from datetime import datetime, timedelta
 from itertools import repeat
-from sqlalchemy.sql import not_
+from sqlalchemy import and_, not_, select
+from sqlalchemy.sql.expression import true
 
 from nailgun import notifier
 from nailgun.db import db
 from nailgun.settings import settings
-from nailgun.api.models import Node
+from nailgun.api.models import Node, NodeHeartbeat
+from nailgun.api.versions import versions
+from nailgun.api.versions import cluster_versions
 from nailgun.logger import logger
 
 
@@ -37,7 +40,22 @@ class KeepAliveThread(threading.Thread):
         self.timeout = timeout or settings.KEEPALIVE['timeout']
 
     def reset_nodes_timestamp(self):
-        db().query(Node).update({'timestamp': datetime.now()})
+        """
+        Gives all agents time to check in after restart.
+        Only narrow heartbeats table is written, heartbeats
+        are created for nodes which don't have them yet.
+        """
+        now = datetime.now()
+        heartbeats = NodeHeartbeat.__table__
+        db().execute(heartbeats.update().values(timestamp=now))
+        missing = db().query(Node.id).filter(
+            not_(Node.id.in_(select([heartbeats.c.node_id])))
+        ).all()
+        if missing:
+            db().execute(heartbeats.insert(), [
+                {'node_id': node_id, 'timestamp': now}
+                for (node_id,) in missing
+            ])
         db().commit()
 
     def join(self, timeout=None):
@@ -51,9 +69,12 @@ class KeepAliveThread(threading.Thread):
         )
 
     def run(self):
+        reset = False
         while True:
             try:
-                self.reset_nodes_timestamp()
+                if not reset:
+                    self.reset_nodes_timestamp()
+                    reset = True
                 while not self.stop_status_checking.isSet():
                     self.update_status_nodes()
                     self.sleep()
@@ -66,19 +87,35 @@ class KeepAliveThread(threading.Thread):
                 break
 
     def update_status_nodes(self):
-        to_update = db().query(Node).filter(
-            not_(Node.status == 'provisioning')
-        ).filter(
-            datetime.now() > (Node.timestamp + timedelta(seconds=self.timeout))
-        ).filter_by(
-            online=True
+        """
+        Marks nodes which agents didn't check in for timeout
+        as offline with single UPDATE ... RETURNING and adds
+        notifications for them with single INSERT.
+        """
+        nodes = Node.__table__
+        stale = select([NodeHeartbeat.node_id]).where(
+            NodeHeartbeat.timestamp <
+            datetime.now() - timedelta(seconds=self.timeout)
         )
-        for node_db in to_update:
-            notifier.notify(
-                "error",
-                u"Node '{0}' has gone away".format(
-                    node_db.human_readable_name),
-                node_id=node_db.id
+        gone = db().execute(
+            nodes.update().where(and_(
+                nodes.c.id.in_(stale),
+                nodes.c.online == true(),
+                nodes.c.status != 'provisioning'
+            )).values(online=False).returning(
+                nodes.c.id, nodes.c.name, nodes.c.mac, nodes.c.cluster_id
             )
-        to_update.update({"online": False})
+        ).fetchall()
+        if gone:
+            versions.changed(db(), Node)
+        notifier.notify_many([
+            {
+                'topic': 'error',
+                'message': u"Node '{0}' has gone away".format(name or mac),
+                'node_id': node_id
+            } for node_id, name, mac, cluster_id in gone
+        ])
         db().commit()
+        cluster_versions.bump(*set(
+            cluster_id for node_id, name, mac, cluster_id in gone
+        ))
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+import logging
+import threading
+
+from nailgun.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class LogWatcher(threading.Thread):
+    """
+    Watches log files followed by clients and updates their
+    indexes when files grow. Each followed file is checked
+    once per interval however many clients follow it, and
+    clients are woken up only when new lines are indexed, so
+    appends made within interval are delivered as one batch.
+    Thread is started by first follower.
+    """
+
+    def __init__(self, interval=None, max_followers=None):
+        super(LogWatcher, self).__init__()
+        self.daemon = True
+        self.interval = interval or settings.LOGS_FOLLOW['interval']
+        self.max_followers = max_followers or \
+            settings.LOGS_FOLLOW['max_followers']
+        self.stop_watching = threading.Event()
+        self.condition = threading.Condition()
+        # path -> [index, followers count, last follow time]
+        self.watched = {}
+        # path -> indexed size followers were woken up at
+        self.sizes = {}
+        self.followers = 0
+
+    def follow(self, index, to, timeout):
+        """
+        Waits until log file grows beyond 'to' byte offset or
+        is rotated, or until timeout expires.
+
+        :param index: Index of followed log file.
+        :type  index: nailgun.logs.index.LogIndex
+        :param to: Indexed size of file known to client.
+        :param timeout: Seconds to wait.
+        :returns: False if too many clients are following logs
+            already and caller should not wait, True otherwise.
+        """
+        deadline = time.time() + timeout
+        with self.condition:
+            if self.followers >= self.max_followers:
+                return False
+            if self.ident is None:
+                self.start()
+            self.followers += 1
+            watched = self.watched.setdefault(index.path, [index, 0, 0])
+            watched[0] = index
+            watched[1] += 1
+            try:
+                while index.size == to:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+            finally:
+                self.followers -= 1
+                watched[1] -= 1
+                watched[2] = time.time()
+        return True
+
+    def join(self, timeout=None):
+        self.stop_watching.set()
+        super(LogWatcher, self).join(timeout)
+
+    def run(self):
+        while not self.stop_watching.isSet():
+            try:
+                self.update_indexes()
+            except Exception as exc:
+                logger.error("Error while updating indexes of followed "
+                             "logs: %s", exc)
+            self.stop_watching.wait(self.interval)
+
+    def update_indexes(self):
+        """
+        Updates indexes of followed files and wakes up followers
+        if any of them grew. Files nobody followed during last
+        interval aren't watched anymore.
+        """
+        forgotten_before = time.time() - self.interval
+        with self.condition:
+            for path, (index, followers, followed) in self.watched.items():
+                if not followers and followed < forgotten_before:
+                    del self.watched[path]
+                    self.sizes.pop(path, None)
+            indexes = [w[0] for w in self.watched.itervalues()]
+
+        for index in indexes:
+            try:
+                with index.lock:
+                    index.update()
+            except (IOError, OSError) as e:
+                logger.debug("Unable to update index of log file %r: %s",
+                             index.path, e)
+
+        with self.condition:
+            grown = [
+                index for index in indexes
+                if self.sizes.get(index.path) != index.size
+            ]
+            for index in grown:
+                self.sizes[index.path] = index.size
+            if grown:
+                self.condition.notify_all()
+
+
+log_watcher = LogWatcher()
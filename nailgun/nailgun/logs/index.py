@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Indexes of log files shown in UI.
+
+Index keeps byte offset, length, timestamp and level of every
+entry of log file, so log viewer seeks straight to requested
+entries instead of reading and parsing whole file on every
+request. Index is built incrementally: only lines appended
+since previous request are parsed. Indexes are cached in memory
+and saved as sidecar files into LOGS_INDEX_DIR, so big logs
+aren't parsed again after restart.
+"""
+
+import os
+import struct
+import hashlib
+import logging
+import threading
+from array import array
+from bisect import bisect_left
+from bisect import bisect_right
+from collections import OrderedDict
+
+from nailgun.settings import settings
+from nailgun.logs.parser import get_parser
+
+logger = logging.getLogger(__name__)
+
+
+class LogIndex(object):
+
+    MAGIC = 'NGLOGIX1'
+    # magic, config digest, inode, head length, head digest,
+    # bytes indexed, records count, continuation flag, sorted flag
+    HEADER = struct.Struct('<8s16sQI16sQQ??')
+    # offset, length, timestamp, level
+    RECORD = struct.Struct('<QIqB')
+    # size of file beginning used to notice rotation
+    HEAD_SIZE = 1024
+
+    def __init__(self, path, parser, index_path=None):
+        """
+        :param path: Path to log file.
+        :param parser: Parser of log format.
+        :type  parser: nailgun.logs.parser.LogParser
+        :param index_path: Path to sidecar file, index is kept
+            in memory only if it's not set.
+        """
+        self.path = path
+        self.index_path = index_path
+        self.parser = parser
+        self.digest = parser.digest
+        self.lock = threading.Lock()
+        # inode, size and mtime of file seen by last update
+        self.file_stat = None
+        self.reset()
+        self.load()
+
+    def reset(self):
+        self.inode = 0
+        self.head_len = 0
+        self.head_digest = hashlib.md5().digest()
+        # bytes of file indexed, always ends with complete line
+        self.size = 0
+        self.offsets = array('L')
+        self.lengths = array('L')
+        self.timestamps = array('l')
+        self.levels = array('B')
+        # whether lines not matching regexp continue last entry
+        self.extend_last = False
+        # whether timestamps can be searched by bisection
+        self.sorted = True
+        self.saved_count = 0
+        self.saved_size = 0
+
+    def load(self):
+        if not self.index_path:
+            return
+        try:
+            with open(self.index_path, 'rb') as f:
+                (magic, digest, inode, head_len, head_digest, size,
+                 count, extend_last, is_sorted) = self.HEADER.unpack(
+                    f.read(self.HEADER.size))
+                if magic != self.MAGIC or digest != self.digest:
+                    return
+                data = f.read(count * self.RECORD.size)
+        except (IOError, OSError, struct.error):
+            return
+        if len(data) != count * self.RECORD.size:
+            return
+
+        for pos in xrange(0, len(data), self.RECORD.size):
+            offset, length, timestamp, level = self.RECORD.unpack_from(
+                data, pos)
+            self.offsets.append(offset)
+            self.lengths.append(length)
+            self.timestamps.append(timestamp)
+            self.levels.append(level)
+        self.inode = inode
+        self.head_len = head_len
+        self.head_digest = head_digest
+        self.size = self.saved_size = size
+        self.saved_count = count
+        self.extend_last = extend_last
+        self.sorted = is_sorted
+
+    def save(self):
+        if not self.index_path or self.size == self.saved_size:
+            return
+        try:
+            index_dir = os.path.dirname(self.index_path)
+            if not os.path.isdir(index_dir):
+                os.makedirs(index_dir)
+            mode = 'r+b' if self.saved_count else 'wb'
+            with open(self.index_path, mode) as f:
+                # last saved record could be extended by new lines
+                start = max(self.saved_count - 1, 0)
+                f.seek(self.HEADER.size + start * self.RECORD.size)
+                f.write(''.join(
+                    self.RECORD.pack(self.offsets[i], self.lengths[i],
+                                     self.timestamps[i], self.levels[i])
+                    for i in xrange(start, len(self.offsets))
+                ))
+                f.seek(0)
+                f.write(self.HEADER.pack(
+                    self.MAGIC, self.digest, self.inode,
+                    self.head_len, self.head_digest, self.size,
+                    len(self.offsets), self.extend_last, self.sorted
+                ))
+        except (IOError, OSError) as e:
+            logger.warning("Unable to save index of log file %r: %s",
+                           self.path, e)
+            self.index_path = None
+            return
+        self.saved_count = len(self.offsets)
+        self.saved_size = self.size
+
+    def update(self):
+        """
+        Indexes lines appended to log file since previous call.
+        Index is built from scratch if file was rotated or truncated.
+        File isn't read if it wasn't changed since previous call.
+        """
+        stat = os.stat(self.path)
+        if (stat.st_ino, stat.st_size, stat.st_mtime) == self.file_stat:
+            return
+        with open(self.path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self.file_stat = (stat.st_ino, stat.st_size, stat.st_mtime)
+            if stat.st_ino != self.inode or stat.st_size < self.size or \
+                    self.read_head_digest(f, self.head_len) != \
+                    self.head_digest:
+                self.reset()
+                self.inode = stat.st_ino
+            if stat.st_size > self.size:
+                f.seek(self.size)
+                self.index_lines(f)
+            if self.head_len < min(self.size, self.HEAD_SIZE):
+                self.head_len = min(self.size, self.HEAD_SIZE)
+                self.head_digest = self.read_head_digest(f, self.head_len)
+        self.save()
+
+    def read_head_digest(self, f, length):
+        f.seek(0)
+        return hashlib.md5(f.read(length)).digest()
+
+    def index_lines(self, f):
+        parse_header = self.parser.parse_header
+        skip = self.parser.skip
+        multiline = self.parser.multiline
+        offsets, lengths = self.offsets, self.lengths
+        timestamps, levels = self.timestamps, self.levels
+        extend_last = self.extend_last
+        last_timestamp = timestamps[-1] if timestamps else None
+        pos = self.size
+        for line in f:
+            if line[-1] != '\n':
+                # line is being written, it's indexed when complete
+                break
+            offset = pos
+            pos += len(line)
+            entry = line[:-1]
+            if skip(entry):
+                continue
+            try:
+                header = parse_header(entry)
+            except ValueError:
+                logger.debug("Unable to parse date from log entry %r,"
+                             " date format: %r",
+                             entry, self.parser.date_format)
+                extend_last = False
+                continue
+            if header is None:
+                if extend_last:
+                    lengths[-1] = pos - offsets[-1]
+                elif not multiline:
+                    logger.debug("Unable to parse log entry '%s' from %s",
+                                 entry, self.path)
+                continue
+            timestamp, level = header
+            if last_timestamp is not None and timestamp < last_timestamp:
+                self.sorted = False
+            last_timestamp = timestamp
+            offsets.append(offset)
+            lengths.append(pos - offset)
+            timestamps.append(timestamp)
+            levels.append(level)
+            extend_last = multiline
+        self.extend_last = extend_last
+        self.size = pos
+
+    def search(self, to=0, date_after=None, date_before=None,
+               levels=None, limit=None):
+        """
+        Finds entries in index, newest first.
+
+        :param to: Skip entries starting before this byte offset.
+        :param date_after: Skip entries not newer than this timestamp.
+        :param date_before: Skip entries not older than this timestamp.
+        :param levels: Allowed levels, all levels are allowed if None.
+        :type  levels: list of str
+        :param limit: Maximum number of entries to return.
+        :returns: tuple of list of record numbers and flag whether
+            entries older than returned ones were left out.
+        """
+        first = bisect_left(self.offsets, to)
+        lo, hi = first, len(self.offsets)
+        if self.sorted:
+            if date_after is not None:
+                lo = bisect_right(self.timestamps, date_after, lo)
+            if date_before is not None:
+                hi = bisect_left(self.timestamps, date_before, lo)
+        level_ids = None
+        if levels is not None:
+            level_ids = self.parser.level_ids(levels)
+
+        records = []
+        for i in xrange(hi - 1, lo - 1, -1):
+            if level_ids is not None and self.levels[i] not in level_ids:
+                continue
+            timestamp = self.timestamps[i]
+            if date_after is not None and timestamp <= date_after:
+                continue
+            if date_before is not None and timestamp >= date_before:
+                continue
+            if limit is not None and len(records) >= limit:
+                return records, True
+            records.append(i)
+        return records, to > 0 and first > 0
+
+    def read(self, records):
+        """
+        Reads entries from log file.
+
+        :param records: Record numbers returned by search.
+        :returns: list of [date, level, text] lists, date is
+            formatted with UI_LOG_DATE_FORMAT.
+        """
+        entries = []
+        with open(self.path, 'rb') as f:
+            for i in records:
+                f.seek(self.offsets[i])
+                entry = self.parser.entry(f.read(self.lengths[i]),
+                                          self.timestamps[i])
+                # None if file was replaced after update
+                if entry is not None:
+                    entries.append(entry)
+        return entries
+
+    def query(self, **kwargs):
+        """
+        Brings index up to date and reads entries found by search.
+
+        :returns: tuple of entries, flag whether entries older than
+            returned ones were left out and size of indexed part of file.
+        """
+        with self.lock:
+            self.update()
+            records, has_more = self.search(**kwargs)
+            return self.read(records), has_more, self.size
+
+
+def index_path(path):
+    """
+    Path to sidecar index of log file, it mirrors absolute path
+    of log file under LOGS_INDEX_DIR. None if directory isn't set.
+    """
+    if not settings.LOGS_INDEX_DIR:
+        return None
+    return os.path.join(
+        settings.LOGS_INDEX_DIR,
+        os.path.abspath(path).lstrip(os.sep) + '.idx'
+    )
+
+
+# indexes are cached for most recently viewed files only
+MAX_CACHED_INDEXES = 64
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_index(path, log_config):
+    """
+    Returns index of log file, cached one if it was built
+    with the same log source settings.
+
+    :param path: Path to log file.
+    :param log_config: Log source from settings.LOGS.
+    :type  log_config: dict
+    :raises: re.error if regular expressions of log source
+        are invalid.
+    """
+    parser = get_parser(log_config)
+    with _indexes_lock:
+        index = _indexes.pop(path, None)
+        if index is None or index.parser is not parser:
+            index = LogIndex(path, parser, index_path(path))
+        _indexes[path] = index
+        while len(_indexes) > MAX_CACHED_INDEXES:
+            _indexes.popitem(last=False)
+        return index
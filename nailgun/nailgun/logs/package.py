@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Streaming of log package for support.
+
+Package is tar archive compressed with gzip. It's generated
+while it's sent: tar blocks are built from files as they are
+read and compressed chunk by chunk, so first bytes are sent
+right away and nothing is written to disk. Compression can be
+spread over several threads, then every chunk is compressed
+into separate gzip member. gzip and tar read such file as one
+stream.
+"""
+
+import os
+import stat
+import zlib
+import logging
+import tarfile
+from collections import deque
+from itertools import chain
+from multiprocessing.pool import ThreadPool
+
+from nailgun.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# makes zlib write gzip header and trailer
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def walk(path, arcname, accept=None):
+    """
+    Yields path and everything under it, symlinks aren't followed.
+
+    :param accept: Function which is called with path and its stat
+        and returns False if path should be left out of package.
+        Directories left out aren't walked.
+    :returns: iterator of tuples of arcname, path and stat.
+    """
+    try:
+        st = os.lstat(path)
+    except OSError as e:
+        logger.warning("Unable to add %r to log package: %s", path, e)
+        return
+    if accept is not None and not accept(path, st):
+        return
+    yield arcname, path, st
+    if stat.S_ISDIR(st.st_mode):
+        try:
+            names = sorted(os.listdir(path))
+        except OSError as e:
+            logger.warning("Unable to list %r for log package: %s", path, e)
+            return
+        for name in names:
+            for item in walk(os.path.join(path, name),
+                             os.path.join(arcname, name), accept):
+                yield item
+
+
+def get_tarinfo(arcname, path, st):
+    """
+    Builds tar header of regular file, directory or symlink.
+    None is returned for other file types.
+    """
+    info = tarfile.TarInfo(arcname)
+    info.mode = stat.S_IMODE(st.st_mode)
+    info.uid = st.st_uid
+    info.gid = st.st_gid
+    info.mtime = st.st_mtime
+    if stat.S_ISREG(st.st_mode):
+        info.type = tarfile.REGTYPE
+        info.size = st.st_size
+    elif stat.S_ISDIR(st.st_mode):
+        info.type = tarfile.DIRTYPE
+    elif stat.S_ISLNK(st.st_mode):
+        info.type = tarfile.SYMTYPE
+        info.linkname = os.readlink(path)
+    else:
+        return None
+    return info
+
+
+def tar_stream(items, chunk_size):
+    """
+    Yields tar archive of files piece by piece. Logs keep growing
+    while they are read, so exactly the size seen by walk is read
+    from every file.
+
+    :param items: Tuples of arcname, path and stat.
+    :param chunk_size: Maximum size of file data read at once.
+    """
+    size = 0
+    for arcname, path, st in items:
+        try:
+            info = get_tarinfo(arcname, path, st)
+            f = open(path, 'rb') if info and info.isreg() else None
+        except (IOError, OSError) as e:
+            logger.warning("Unable to add %r to log package: %s", path, e)
+            continue
+        if info is None:
+            continue
+
+        header = info.tobuf(tarfile.GNU_FORMAT)
+        size += len(header)
+        yield header
+        if f is None:
+            continue
+        with f:
+            left = info.size
+            while left:
+                data = f.read(min(chunk_size, left))
+                if not data:
+                    # file was truncated, tar header can't be changed
+                    data = tarfile.NUL * left
+                left -= len(data)
+                size += len(data)
+                yield data
+        padding = -info.size % tarfile.BLOCKSIZE
+        size += padding
+        yield tarfile.NUL * padding
+
+    end = tarfile.NUL * (2 * tarfile.BLOCKSIZE)
+    size += len(end)
+    yield end + tarfile.NUL * (-size % tarfile.RECORDSIZE)
+
+
+def rechunk(pieces, chunk_size):
+    """
+    Joins pieces of data into chunks of at least chunk_size.
+    """
+    buf = []
+    buffered = 0
+    for piece in pieces:
+        buf.append(piece)
+        buffered += len(piece)
+        if buffered >= chunk_size:
+            yield ''.join(buf)
+            buf = []
+            buffered = 0
+    if buf:
+        yield ''.join(buf)
+
+
+def gzip_stream(chunks, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def gzip_member(chunk, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    return compressor.compress(chunk) + compressor.flush()
+
+
+def parallel_gzip_stream(chunks, level, threads):
+    """
+    Compresses chunks into gzip members in several threads,
+    zlib releases GIL while compressing. Only a few chunks are
+    read ahead, so memory use doesn't depend on package size.
+    """
+    pool = ThreadPool(threads)
+    try:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(gzip_member, (chunk, level)))
+            if len(pending) >= 2 * threads:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+
+
+def package_stream(sources, accept=None):
+    """
+    Yields tar.gz package of log files.
+
+    :param sources: Mapping of names in package to paths.
+    :type  sources: dict
+    :param accept: Filter of files, see walk.
+    """
+    config = settings.LOGS_PACKAGE
+    items = chain.from_iterable(
+        walk(path, arcname, accept)
+        for arcname, path in sorted(sources.iteritems())
+    )
+    chunks = rechunk(tar_stream(items, config['chunk_size']),
+                     config['chunk_size'])
+    if config['compress_threads'] > 1:
+        return parallel_gzip_stream(chunks, config['compress_level'],
+                                    config['compress_threads'])
+    return gzip_stream(chunks, config['compress_level'])
+
+
+def package_filter(remote_dir=None, node_dirs=None, modified_after=None):
+    """
+    Builds filter of files for package.
+
+    :param remote_dir: Directory with logs of nodes.
+    :param node_dirs: Names of directories in remote_dir which are
+        packed, logs of all nodes are packed if None.
+    :param modified_after: Timestamp, files which weren't modified
+        since then are left out.
+    """
+    if remote_dir is not None:
+        remote_dir = os.path.normpath(remote_dir)
+
+    def accept(path, st):
+        if node_dirs is not None and \
+                os.path.dirname(path) == remote_dir and \
+                os.path.basename(path) not in node_dirs:
+            return False
+        if modified_after is not None and \
+                not stat.S_ISDIR(st.st_mode) and \
+                st.st_mtime < modified_after:
+            return False
+        return True
+    return accept
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Parsers of log formats from settings.LOGS.
+
+Regular expressions of every log source are compiled once,
+at startup, and parsers are shared by all indexes of files
+of the same format. Log lines carry dates with one second
+resolution and many lines are written within the same second,
+so dates are converted by time.strptime and time.strftime
+once per distinct value and memoized.
+See nailgun/test/log_benchmark.py for measurements.
+"""
+
+import re
+import time
+import hashlib
+import logging
+import calendar
+import threading
+
+from nailgun.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class LogParser(object):
+
+    # level id of entries which level isn't listed in config
+    OTHER_LEVEL = 255
+    # memoized values are forgotten when there are more of them
+    MAX_CACHED = 4096
+
+    def __init__(self, log_config):
+        """
+        :param log_config: Log source from settings.LOGS.
+        :type  log_config: dict
+        :raises: re.error if regular expressions of log source
+            are invalid.
+        """
+        self.digest = config_digest(log_config)
+        self.regexp = re.compile(log_config['regexp'])
+        self.skip_regexp = None
+        if log_config.get('skip_regexp'):
+            self.skip_regexp = re.compile(log_config['skip_regexp'])
+        self.date_format = log_config['date_format']
+        self.multiline = bool(log_config.get('multiline'))
+        self.levels = list(log_config['levels'])
+        self.level_names = dict((l, i) for i, l in enumerate(self.levels))
+        # raw level from log line -> (level, level id)
+        self.level_cache = {}
+        # raw date from log line -> timestamp
+        self.timestamp_cache = {}
+        # timestamp -> date formatted for UI
+        self.date_cache = {}
+
+    def level_ids(self, levels):
+        """
+        Converts level names to ids stored in index.
+        """
+        return set(self.level_names[l] for l in levels
+                   if l in self.level_names)
+
+    def parse_level(self, raw_level):
+        """
+        :returns: tuple of level name and its id.
+        """
+        try:
+            return self.level_cache[raw_level]
+        except KeyError:
+            pass
+        level = (raw_level or 'INFO').upper()
+        result = (level, self.level_names.get(level, self.OTHER_LEVEL))
+        self.level_cache[raw_level] = result
+        return result
+
+    def parse_timestamp(self, date):
+        """
+        Converts date from log line to UTC-based timestamp.
+
+        :raises: ValueError if date doesn't match date format.
+        """
+        try:
+            return self.timestamp_cache[date]
+        except KeyError:
+            pass
+        timestamp = calendar.timegm(time.strptime(date, self.date_format))
+        if len(self.timestamp_cache) >= self.MAX_CACHED:
+            self.timestamp_cache.clear()
+        self.timestamp_cache[date] = timestamp
+        return timestamp
+
+    def format_timestamp(self, timestamp):
+        """
+        Formats timestamp with UI_LOG_DATE_FORMAT.
+        """
+        try:
+            return self.date_cache[timestamp]
+        except KeyError:
+            pass
+        date = time.strftime(settings.UI_LOG_DATE_FORMAT,
+                             time.gmtime(timestamp))
+        if len(self.date_cache) >= self.MAX_CACHED:
+            self.date_cache.clear()
+        self.date_cache[timestamp] = date
+        return date
+
+    def parse_header(self, line):
+        """
+        Parses first line of entry.
+
+        :param line: Line without trailing newline.
+        :returns: tuple of timestamp and level id, or None if line
+            doesn't start an entry.
+        :raises: ValueError if line starts an entry but its date
+            doesn't match date format.
+        """
+        m = self.regexp.match(line)
+        if m is None:
+            return None
+        date, raw_level = m.group('date', 'level')
+        return self.parse_timestamp(date), self.parse_level(raw_level)[1]
+
+    def skip(self, line):
+        """
+        Whether line is left out of log: it's empty or matches
+        skip_regexp.
+        """
+        return not line or self.skip_regexp is not None and \
+            self.skip_regexp.match(line) is not None
+
+    def entry(self, data, timestamp):
+        """
+        Builds entry shown in UI from first line of entry and
+        lines which continue it.
+
+        :param data: Lines of entry as they are in log file.
+        :param timestamp: Timestamp of entry.
+        :returns: list of date, level and text, or None if first
+            line doesn't start an entry.
+        """
+        lines = data.split('\n')
+        m = self.regexp.match(lines[0])
+        if m is None:
+            return None
+        text = m.group('text')
+        if len(lines) > 2 or lines[-1]:
+            skip = self.skip
+            text = '\n'.join(
+                [text] + [l for l in lines[1:] if not skip(l)])
+        return [
+            self.format_timestamp(timestamp),
+            self.parse_level(m.group('level'))[0],
+            text
+        ]
+
+
+def config_digest(log_config):
+    """
+    Digest of log source settings which affect parsing.
+    Index built with other settings is thrown away.
+    """
+    return hashlib.md5(repr((
+        log_config['regexp'],
+        log_config.get('skip_regexp'),
+        log_config.get('date_format'),
+        bool(log_config.get('multiline')),
+        list(log_config['levels'])
+    ))).digest()
+
+
+_parsers = {}
+_parsers_lock = threading.Lock()
+
+
+def get_parser(log_config):
+    """
+    Returns parser of log source, it's compiled on first use
+    if it wasn't compiled at startup.
+
+    :param log_config: Log source from settings.LOGS.
+    :type  log_config: dict
+    :raises: re.error if regular expressions of log source
+        are invalid.
+    """
+    digest = config_digest(log_config)
+    with _parsers_lock:
+        parser = _parsers.get(digest)
+        if parser is None:
+            parser = _parsers[digest] = LogParser(log_config)
+        return parser
+
+
+def compile_parsers():
+    """
+    Compiles parsers of all log sources from settings.LOGS.
+    Called at startup, so invalid formats are reported before
+    first request for logs.
+    """
+    for log_config in settings.LOGS:
+        try:
+            get_parser(log_config)
+        except (re.error, KeyError) as e:
+            logger.error("Invalid settings of log %r: %r",
+                         log_config['id'], e)
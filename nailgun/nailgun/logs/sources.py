@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import time
+import threading
+
+from nailgun.settings import settings
+
+
+class DirListing(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.names = set(os.listdir(path))
+        self.listed = time.time()
+        self.checked = self.listed
+        self.mtime = None
+        # name -> whether it's readable regular file
+        self.files = {}
+
+    def isfile(self, name):
+        if name not in self.names:
+            return False
+        try:
+            return self.files[name]
+        except KeyError:
+            path = os.path.join(self.path, name)
+            result = os.access(path, os.R_OK) and os.path.isfile(path)
+            self.files[name] = result
+            return result
+
+
+class LogSourceRegistry(object):
+    """
+    Remembers contents of log directories, so log files of nodes
+    are looked up in memory. Directory is checked for changes
+    at most once per interval: files are created, removed or
+    renamed by rotation only together with mtime change of their
+    directory, so directory is listed again only if its mtime
+    changed. Listing made within a second after modification
+    isn't trusted, as mtime can have one second resolution.
+    Missing directories aren't remembered.
+    """
+
+    def __init__(self, interval=None):
+        self.interval = interval
+        self.dirs = {}
+        self.lock = threading.Lock()
+
+    def listing(self, path):
+        """
+        Returns up-to-date listing of directory or None
+        if it doesn't exist.
+        """
+        now = time.time()
+        interval = self.interval or settings.LOGS_SOURCES_CHECK_INTERVAL
+        with self.lock:
+            listing = self.dirs.get(path)
+            if listing is not None and now - listing.checked < interval:
+                return listing
+            try:
+                mtime = os.stat(path).st_mtime
+                if listing is None or listing.mtime != mtime:
+                    listing = DirListing(path)
+                    if listing.listed - mtime > 1:
+                        listing.mtime = mtime
+            except OSError:
+                self.dirs.pop(path, None)
+                return None
+            listing.checked = now
+            self.dirs[path] = listing
+            return listing
+
+    def isfile(self, path):
+        """
+        Whether path is readable regular file.
+        """
+        dirname, name = os.path.split(os.path.normpath(path))
+        listing = self.listing(dirname)
+        return listing is not None and listing.isfile(name)
+
+
+log_sources = LogSourceRegistry()
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from netaddr import IPAddress
+
+from nailgun.db import db
+from nailgun.errors import errors
+from nailgun.api.models import IPAddr
+
+
+class IPRangeBitmap(object):
+    """
+    Bitmap of used addresses inside one IP range.
+    Bit N is set when address (first + N) is already taken.
+    """
+
+    def __init__(self, first, last):
+        self.first = int(IPAddress(first))
+        self.last = int(IPAddress(last))
+        self.size = max(self.last - self.first + 1, 0)
+        self.bits = bytearray((self.size + 7) // 8)
+        # every address below cursor is known to be used
+        self.cursor = 0
+
+    def __contains__(self, ip_int):
+        return self.first <= ip_int <= self.last
+
+    def mark_used(self, ip_int):
+        if ip_int in self:
+            offset = ip_int - self.first
+            self.bits[offset >> 3] |= 1 << (offset & 7)
+
+    def next_free(self):
+        """
+        Returns integer value of the next free address
+        or None if range is exhausted. Fully used bytes
+        are skipped at once, so walking the whole range
+        costs at most size / 8 iterations.
+        """
+        while self.cursor < self.size:
+            byte = self.bits[self.cursor >> 3]
+            if byte == 0xFF:
+                self.cursor = ((self.cursor >> 3) + 1) << 3
+                continue
+            if not byte & (1 << (self.cursor & 7)):
+                return self.first + self.cursor
+            self.cursor += 1
+        return None
+
+
+class IPAllocator(object):
+    """
+    In-memory allocator of free IP addresses for Network Group.
+
+    Used addresses are read from database with a single query
+    when allocator is created, so any number of subsequent
+    allocations doesn't touch database. Addresses are handed
+    out in the same order as before: ranges in order they are
+    stored in Network Group, addresses in ascending order.
+    Network Group gateway is never allocated.
+    """
+
+    def __init__(self, network_group, used_ips=None):
+        """
+        :param network_group: NetworkGroup object.
+        :type  network_group: NetworkGroup
+        :param used_ips: Already known list of used IP addresses.
+        If not specified, it is loaded from database.
+        :type  used_ips: list
+        """
+        self.network_group_id = network_group.id
+        self.ranges = [
+            IPRangeBitmap(ir.first, ir.last)
+            for ir in network_group.ip_ranges
+        ]
+        if network_group.gateway:
+            self.mark_used(network_group.gateway)
+        if used_ips is None:
+            used_ips = self.load_used_ips()
+        map(self.mark_used, used_ips)
+
+    @classmethod
+    def load_used_ips(cls):
+        return [ip_addr for (ip_addr,) in db().query(IPAddr.ip_addr)]
+
+    def __contains__(self, ip_addr):
+        ip_int = int(IPAddress(ip_addr))
+        return any(ip_int in r for r in self.ranges)
+
+    def mark_used(self, ip_addr):
+        """
+        Marks address as taken in every range it belongs to.
+
+        :param ip_addr: IP address.
+        :type  ip_addr: str
+        """
+        ip_int = int(IPAddress(ip_addr))
+        for r in self.ranges:
+            r.mark_used(ip_int)
+
+    def allocate(self, num=1):
+        """
+        Returns list of free IP addresses and marks them as used.
+
+        :param num: Number of IP addresses to return.
+        :type  num: int
+        :returns: List of IP addresses as strings.
+        :raises: errors.OutOfIPs
+        """
+        free_ips = []
+        for r in self.ranges:
+            while len(free_ips) < num:
+                ip_int = r.next_free()
+                if ip_int is None:
+                    break
+                self.mark_used(ip_int)
+                free_ips.append(str(IPAddress(ip_int)))
+            if len(free_ips) == num:
+                return free_ips
+        # not enough addresses - give allocated ones back
+        for ip in free_ips:
+            self._release(int(IPAddress(ip)))
+        raise errors.OutOfIPs()
+
+    def _release(self, ip_int):
+        for r in self.ranges:
+            if ip_int in r:
+                offset = ip_int - r.first
+                r.bits[offset >> 3] &= ~(1 << (offset & 7)) & 0xFF
+                r.cursor = min(r.cursor, offset)
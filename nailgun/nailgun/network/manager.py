@@ -15,16 +15,20 @@
 #    under the License.
 
 import math
-from itertools import imap, ifilter, islice, chain, tee
+import traceback
+from itertools import imap
 
 import web
 from sqlalchemy.sql import not_
+from sqlalchemy.orm import joinedload, subqueryload, contains_eager
 from netaddr import IPSet, IPNetwork, IPRange, IPAddress
 
 from nailgun.db import db
 from nailgun.errors import errors
 from nailgun.logger import logger
 from nailgun.settings import settings
+from nailgun.network.allocator import IPAllocator
+from nailgun.api.versions import versions
 from nailgun.api.models import NetworkAssignment
 from nailgun.api.models import Node, NodeNICInterface, IPAddr, Cluster, Vlan
 from nailgun.api.models import Network, NetworkGroup, IPAddrRange
@@ -267,10 +271,36 @@ class NetworkManager(object):
         :raises: Exception, errors.AssignIPError
         """
 
-        cluster_id = db().query(Node).get(nodes_ids[0]).cluster_id
+        self.assign_ips_bulk(nodes_ids, [network_name])
+
+    def assign_ips_bulk(self, nodes_ids, network_names):
+        """
+        Idempotent assignment IP addresses to nodes
+        from several networks at once.
+
+        Works like assign_ips, but loads nodes and their
+        existing IP addresses with one query per network,
+        computes assignments in memory and stores all new
+        IP addresses with a single insert and commit.
+
+        :param nodes_ids: List of nodes IDs in database.
+        :type  nodes_ids: list
+        :param network_names: List of network names
+        :type  network_names: list
+        :returns: None
+        :raises: Exception, errors.AssignIPError
+        """
+        if not nodes_ids:
+            return
+
+        cluster_ids = dict(
+            db().query(Node.id, Node.cluster_id).filter(
+                Node.id.in_(nodes_ids)
+            )
+        )
+        cluster_id = cluster_ids.get(nodes_ids[0])
         for node_id in nodes_ids:
-            node = db().query(Node).get(node_id)
-            if node.cluster_id != cluster_id:
+            if cluster_ids.get(node_id) != cluster_id:
                 raise Exception(
                     u"Node id='{0}' doesn't belong to cluster_id='{1}'".format(
                         node_id,
@@ -278,45 +308,59 @@ class NetworkManager(object):
                     )
                 )
 
-        network = db().query(Network).join(NetworkGroup).\
-            filter(NetworkGroup.cluster_id == cluster_id).\
-            filter_by(name=network_name).first()
-
-        if not network:
-            raise errors.AssignIPError(
-                u"Network '%s' for cluster_id=%s not found." %
-                (network_name, cluster_id)
-            )
-
-        for node_id in nodes_ids:
-            node_ips = imap(
-                lambda i: i.ip_addr,
-                self._get_ips_except_admin(
-                    node_id=node_id,
-                    network_id=network.id
+        # several networks of cluster can share a name,
+        # the first one is used like in assign_ips before
+        networks = {}
+        for network in db().query(Network).join(NetworkGroup).\
+                filter(NetworkGroup.cluster_id == cluster_id).\
+                filter(Network.name.in_(network_names)).\
+                order_by(Network.id):
+            networks.setdefault(network.name, network)
+
+        used_ips = IPAllocator.load_used_ips()
+        new_ips = []
+        for network_name in network_names:
+            network = networks.get(network_name)
+            if not network:
+                raise errors.AssignIPError(
+                    u"Network '%s' for cluster_id=%s not found." %
+                    (network_name, cluster_id)
                 )
+
+            allocator = IPAllocator(network.network_group, used_ips)
+            nodes_with_ips = set(
+                node_id for node_id, ip_addr in
+                db().query(IPAddr.node, IPAddr.ip_addr).filter(
+                    IPAddr.network == network.id
+                ).filter(
+                    IPAddr.node.in_(nodes_ids)
+                ) if ip_addr in allocator
             )
-            # check if any of node_ips in required ranges
-            for ip in node_ips:
-                if self.check_ip_belongs_to_net(ip, network):
+            for node_id in nodes_ids:
+                if node_id in nodes_with_ips:
                     logger.info(
                         u"Node id='{0}' already has an IP address "
                         "inside '{1}' network.".format(
-                            node.id,
+                            node_id,
                             network.name
                         )
                     )
                     continue
 
-            # IP address has not been assigned, let's do it
-            free_ip = self.get_free_ips(network.network_group.id)[0]
-            ip_db = IPAddr(
-                network=network.id,
-                node=node_id,
-                ip_addr=free_ip
-            )
-            db().add(ip_db)
-            db().commit()
+                # IP address has not been assigned, let's do it
+                free_ip = allocator.allocate()[0]
+                used_ips.append(free_ip)
+                nodes_with_ips.add(node_id)
+                new_ips.append({
+                    'network': network.id,
+                    'node': node_id,
+                    'ip_addr': free_ip
+                })
+
+        if new_ips:
+            db().execute(IPAddr.__table__.insert(), new_ips)
+            versions.changed(db(), IPAddr)
+        db().commit()
 
     def assign_vip(self, cluster_id, network_name):
         """
@@ -368,7 +412,7 @@ class NetworkManager(object):
             vip = cluster_ips[0]
         else:
             # IP address has not been assigned, let's do it
-            vip = self.get_free_ips(network.network_group.id)[0]
+            vip = IPAllocator(network.network_group).allocate()[0]
             ne_db = IPAddr(network=network.id, ip_addr=vip)
             db().add(ne_db)
             db().commit()
@@ -384,32 +428,6 @@ class NetworkManager(object):
         )
         db().commit()
 
-    @classmethod
-    def _chunked_range(cls, iterable, chunksize=64):
-        """
-        We want to be able to iterate over iterable chunk by chunk.
-        We instantiate iter object from itarable. We then yield
-        iter instance slice in infinite loop. Iter slice starts
-        from the last used position and finishes on the position
-        which is offset with chunksize from the last used position.
-
-        :param iterable: Iterable object.
-        :type  iterable: iterable
-        :param chunksize: Size of chunk to iterate through.
-        :type  chunksize: int
-        :yields: iterator
-        :raises: StopIteration
-        """
-        it = iter(iterable)
-        while True:
-            s = islice(it, chunksize)
-            # Here we check if iterator is not empty calling
-            # next() method which raises StopInteration if
-            # iter is empty. If iter is not empty we yield
-            # iterator which is concatenation of fisrt element in
-            # slice and the ramained elements.
-            yield chain([s.next()], s)
-
     def check_ip_belongs_to_net(self, ip_addr, network):
         addr = IPAddress(ip_addr)
         ipranges = imap(
@@ -421,62 +439,12 @@ class NetworkManager(object):
                 return True
         return False
 
-    def _iter_free_ips(self, network_group):
-        """
-        Represents iterator over free IP addresses
-        in all ranges for given Network Group
-        """
-        for ip_addr in ifilter(
-            lambda ip: db().query(IPAddr).filter_by(
-                ip_addr=str(ip)
-            ).first() is None and not ip == network_group.gateway,
-            chain(*[
-                IPRange(ir.first, ir.last)
-                for ir in network_group.ip_ranges
-            ])
-        ):
-            yield ip_addr
-
     def get_free_ips(self, network_group_id, num=1):
         """
         Returns list of free IP addresses for given Network Group
         """
         ng = db().query(NetworkGroup).get(network_group_id)
-        free_ips = []
-        for ip in self._iter_free_ips(ng):
-            free_ips.append(str(ip))
-            if len(free_ips) == num:
-                break
-        if len(free_ips) < num:
-            raise errors.OutOfIPs()
-        return free_ips
-
-    def _get_free_ips_from_range(self, iterable, num=1):
-        """
-        Method for receiving free IP addresses from range.
-
-        :param iterable: Iterable object with IP addresses.
-        :type  iterable: iterable
-        :param num: Number of IP addresses to return.
-        :type  num: int
-        :returns: List of free IP addresses from given range.
-        :raises: errors.OutOfIPs
-        """
-        free_ips = []
-        for chunk in self._chunked_range(iterable):
-            from_range = set(chunk)
-            diff = from_range - set(
-                [i.ip_addr for i in db().query(IPAddr).
-                 filter(IPAddr.ip_addr.in_(from_range))]
-            )
-            while len(free_ips) < num:
-                try:
-                    free_ips.append(diff.pop())
-                except KeyError:
-                    break
-            if len(free_ips) == num:
-                return free_ips
-        raise errors.OutOfIPs()
+        return IPAllocator(ng).allocate(num)
 
     def _get_ips_except_admin(self, node_id=None, network_id=None):
         """
@@ -580,26 +548,105 @@ class NetworkManager(object):
         :returns: List of network info for node.
         """
         node_db = db().query(Node).get(node_id)
-        cluster_db = node_db.cluster
+        return self.get_nodes_networks([node_db])[node_db.id]
+
+    def get_nodes_networks(self, nodes, skip_errors=False):
+        """
+        Method for receiving network data for several nodes at once.
+        Number of queries doesn't depend on number of nodes.
+
+        :param nodes: List of Node objects.
+        :type  nodes: list
+        :param skip_errors: Log errors and leave failed nodes out of
+        result instead of raising an exception.
+        :type  skip_errors: bool
+        :returns: Dict of lists of network info by node ID.
+        """
+        nodes_ids = [n.id for n in nodes]
+        clusters_ids = set(n.cluster_id for n in nodes if n.cluster_id)
+        if not clusters_ids:
+            # Nodes don't belong to any cluster, so they should not have nets
+            return dict((node_id, []) for node_id in nodes_ids)
+
+        clusters = dict(
+            (c.id, c) for c in
+            db().query(Cluster).filter(Cluster.id.in_(clusters_ids))
+        )
+
+        ips = db().query(IPAddr).filter(
+            IPAddr.node.in_(nodes_ids)
+        ).order_by(IPAddr.id)
+        admin_net_id = self.get_admin_network_id(False)
+        if admin_net_id:
+            ips = ips.filter(not_(IPAddr.network == admin_net_id))
+        ips_by_node = {}
+        for ip in ips:
+            ips_by_node.setdefault(ip.node, []).append(ip)
+
+        nets = db().query(Network).join(NetworkGroup).options(
+            contains_eager('network_group')
+        ).filter(
+            NetworkGroup.cluster_id.in_(clusters_ids)
+        ).order_by(Network.id).all()
+        nets_by_id = dict((n.id, n) for n in nets)
+        nets_by_cluster = {}
+        for net in nets:
+            nets_by_cluster.setdefault(
+                net.network_group.cluster_id, []).append(net)
+        foreign_nets_ids = set(
+            ip.network for node_ips in ips_by_node.itervalues()
+            for ip in node_ips
+        ) - set(nets_by_id)
+        if foreign_nets_ids:
+            nets_by_id.update(
+                (n.id, n) for n in db().query(Network).options(
+                    joinedload('network_group')
+                ).filter(Network.id.in_(foreign_nets_ids))
+            )
+
+        interfaces_by_node = {}
+        for nic in db().query(NodeNICInterface).options(
+            subqueryload('assigned_networks')
+        ).filter(
+            NodeNICInterface.node_id.in_(nodes_ids)
+        ).order_by(NodeNICInterface.id):
+            interfaces_by_node.setdefault(nic.node_id, []).append(nic)
+
+        result = {}
+        for node_db in nodes:
+            try:
+                result[node_db.id] = self._build_node_networks(
+                    node_db,
+                    clusters.get(node_db.cluster_id),
+                    ips_by_node.get(node_db.id, []),
+                    nets_by_id,
+                    nets_by_cluster.get(node_db.cluster_id, []),
+                    interfaces_by_node.get(node_db.id, [])
+                )
+            except Exception:
+                if not skip_errors:
+                    raise
+                logger.error(traceback.format_exc())
+        return result
+
+    def _build_node_networks(self, node_db, cluster_db, ips,
+                             nets_by_id, cluster_nets, interfaces):
         if cluster_db is None:
-            # Node doesn't belong to any cluster, so it should not have nets
             return []
 
-        ips = self._get_ips_except_admin(node_id=node_id)
         network_data = []
         network_ids = []
         for i in ips:
-            net = db().query(Network).get(i.network)
-            interface = self._get_interface_by_network_name(
-                node_db.id,
+            net = nets_by_id[i.network]
+            interface = self._find_interface_by_network_name(
+                interfaces,
                 net.name
             )
 
             # Get prefix from netmask instead of cidr
             # for public network
             if net.name == 'public':
-                network_group = db().query(NetworkGroup).get(
-                    net.network_group_id)
+                network_group = net.network_group
 
                 # Convert netmask to prefix
                 prefix = str(IPNetwork(
@@ -620,18 +667,15 @@ class NetworkManager(object):
             network_ids.append(net.id)
 
         # And now let's add networks w/o IP addresses
-        nets = db().query(Network).join(NetworkGroup).\
-            filter(NetworkGroup.cluster_id == cluster_db.id)
-        if network_ids:
-            nets = nets.filter(not_(Network.id.in_(network_ids)))
+        nets = [n for n in cluster_nets if n.id not in network_ids]
 
         # For now, we pass information about all networks,
         #    so these vlans will be created on every node we call this func for
         # However it will end up with errors if we precreate vlans in VLAN mode
         #   in fixed network. We are skipping fixed nets in Vlan mode.
-        for net in nets.order_by(Network.id).all():
-            interface = self._get_interface_by_network_name(
-                node_db.id,
+        for net in nets:
+            interface = self._find_interface_by_network_name(
+                interfaces,
                 net.name
             )
 
@@ -681,19 +725,20 @@ class NetworkManager(object):
                 self.__add_new_interface(node, interface)
 
         self.__delete_not_found_interfaces(node, node.meta["interfaces"])
+        node.interfaces_hash = node.hash_meta(node.meta["interfaces"])
 
     def __add_new_interface(self, node, interface_attrs):
         interface = NodeNICInterface()
         interface.node_id = node.id
         self.__set_interface_attributes(interface, interface_attrs)
         db().add(interface)
-        db().commit()
+        db().flush()
         node.interfaces.append(interface)
 
     def __update_existing_interface(self, interface_id, interface_attrs):
         interface = db().query(NodeNICInterface).get(interface_id)
         self.__set_interface_attributes(interface, interface_attrs)
-        db().commit()
+        db().flush()
 
     def __set_interface_attributes(self, interface, interface_attrs):
         interface.name = interface_attrs["name"]
@@ -707,9 +752,10 @@ class NetworkManager(object):
             lambda interface: interface['mac'], interfaces)
 
         interfaces_to_delete = db().query(NodeNICInterface).filter(
-            NodeNICInterface.node_id == node.id).filter(
-                not_(NodeNICInterface.mac.in_(
-                    interfaces_mac_addresses))).all()
+            NodeNICInterface.node_id == node.id
+        ).filter(
+            not_(NodeNICInterface.mac.in_(interfaces_mac_addresses))
+        ).all()
 
         if interfaces_to_delete:
             mac_addresses = ' '.join(
@@ -759,7 +805,13 @@ class NetworkManager(object):
         network with specified network name
         """
         node_db = db().query(Node).get(node_id)
-        for interface in node_db.interfaces:
+        return self._find_interface_by_network_name(
+            node_db.interfaces,
+            network_name
+        )
+
+    def _find_interface_by_network_name(self, interfaces, network_name):
+        for interface in interfaces:
             for network in interface.assigned_networks:
                 if network.name == network_name:
                     return interface
@@ -16,40 +16,114 @@
 
 import json
 import web
+import hashlib
 from datetime import datetime
 
+from sqlalchemy import bindparam
+from sqlalchemy import select
+
 from nailgun.db import db
 from nailgun.logger import logger
 from nailgun.api.models import Notification, Task
+from nailgun.api.versions import versions
+
+
+# task is referenced by uuid, so it's id is looked up
+# by INSERT itself instead of separate query
+_insert_notification = Notification.__table__.insert().values(
+    topic=bindparam('n_topic'),
+    message=bindparam('n_message'),
+    cluster_id=bindparam('n_cluster_id'),
+    node_id=bindparam('n_node_id'),
+    task_id=select([Task.id]).where(
+        Task.uuid == bindparam('n_task_uuid')
+    ).as_scalar(),
+    dedup_key=bindparam('n_dedup_key'),
+    status='unread',
+    datetime=bindparam('n_datetime')
+)
 
 
 def notify(topic, message,
            cluster_id=None, node_id=None, task_uuid=None):
-    if topic == 'discover' and node_id is None:
-        raise Exception("No node id in discover notification")
-    task = None
-    if task_uuid:
-        task = db().query(Task).filter_by(uuid=task_uuid).first()
-
-    exist = None
-    if node_id and task:
-        exist = db().query(Notification).filter_by(
-            node_id=node_id,
-            message=message,
-            task=task
-        ).first()
-
-    if not exist:
-        notification = Notification()
-        notification.topic = topic
-        notification.message = message
-        notification.cluster_id = cluster_id
-        notification.node_id = node_id
-        if task:
-            notification.task_id = task.id
-        notification.datetime = datetime.now()
-        db().add(notification)
-        db().commit()
+    notify_many([{
+        'topic': topic,
+        'message': message,
+        'cluster_id': cluster_id,
+        'node_id': node_id,
+        'task_uuid': task_uuid
+    }])
+
+
+def dedup_key(node_id, message, task_uuid):
+    """
+    Returns key which identifies notification about node
+    in particular task or None if notification has no such key.
+    """
+    if not (node_id and task_uuid):
+        return None
+    if isinstance(message, unicode):
+        message = message.encode('utf-8')
+    return hashlib.md5(
+        "{0}:{1}:{2}".format(node_id, task_uuid, message)
+    ).hexdigest()
+
+
+def notify_many(notifications):
+    """
+    Adds many notifications with single INSERT.
+
+    Notifications about the same node, task and message are
+    added only once: duplicates are skipped both inside the list
+    and against already stored notifications, which are looked up
+    with single query by indexed dedup key.
+
+    :param notifications: List of dicts with the same
+    keys as arguments of notify: topic, message and optional
+    cluster_id, node_id and task_uuid.
+    :type  notifications: list
+    """
+    if not notifications:
+        return
+    for n in notifications:
+        if n['topic'] == 'discover' and n.get('node_id') is None:
+            raise Exception("No node id in discover notification")
+
+    keys = [
+        dedup_key(n.get('node_id'), n['message'], n.get('task_uuid'))
+        for n in notifications
+    ]
+    exist = set()
+    if any(keys):
+        # notifications of nonexistent tasks are not deduplicated
+        exist = set(key for (key,) in db().query(
+            Notification.dedup_key
+        ).join(Notification.task).filter(
+            Notification.dedup_key.in_(set(filter(None, keys)))
+        ))
+
+    now = datetime.now()
+    rows = []
+    for n, key in zip(notifications, keys):
+        if key:
+            if key in exist:
+                continue
+            exist.add(key)
+        rows.append({
+            'n_topic': n['topic'],
+            'n_message': n['message'],
+            'n_cluster_id': n.get('cluster_id'),
+            'n_node_id': n.get('node_id'),
+            'n_task_uuid': n.get('task_uuid'),
+            'n_dedup_key': key,
+            'n_datetime': now
+        })
+    if rows:
+        db().execute(_insert_notification, rows)
+        versions.changed(db(), Notification)
+    db().commit()
+    for row in rows:
         logger.info(
-            "Notification: topic: %s message: %s" % (topic, message)
+            "Notification: topic: %s message: %s" %
+            (row['n_topic'], row['n_message'])
         )
@@ -14,8 +14,14 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import threading
+
 from kombu import Connection, Exchange, Queue
+from kombu import serialization
+from kombu.common import maybe_declare
+from kombu.pools import producers
 
+from nailgun import jsonutils
 from nailgun.settings import settings
 
 creds = (
@@ -29,6 +35,16 @@ conn_str = 'amqp://{0}:{1}@{2}:{3}//'.format(
     *[settings.RABBITMQ.get(*cred) for cred in creds]
 )
 
+# messages are still sent as application/json, so registered
+# decoder is also used for all incoming JSON messages
+serialization.register(
+    'nailgun_json',
+    jsonutils.dumps,
+    jsonutils.loads,
+    content_type='application/json',
+    content_encoding='utf-8'
+)
+
 naily_exchange = Exchange(
     'naily',
     'topic',
@@ -54,9 +70,44 @@ nailgun_queue = Queue(
 )
 
 
+connection = None
+connection_lock = threading.Lock()
+
+
+def get_connection():
+    """
+    Returns process wide connection which pool of producers
+    is bound to. Pooled producers keep their connections open,
+    so TCP and AMQP handshake is made once per producer instead
+    of once per message. Publisher confirms are requested for
+    transports which support them.
+    """
+    global connection
+    with connection_lock:
+        if connection is None:
+            connection = Connection(
+                conn_str,
+                transport_options={'confirm_publish': True}
+            )
+    return connection
+
+
 def cast(name, message):
-    with Connection(conn_str) as conn:
-        with conn.Producer(serializer='json') as producer:
+    cast_many(name, [message])
+
+
+def cast_many(name, messages):
+    """
+    Publishes messages to naily exchange one after another
+    using single pooled producer. Naily queue is declared
+    only once for every connection.
+
+    :param name: Routing key.
+    :param messages: List of messages.
+    """
+    with producers[get_connection()].acquire(block=True) as producer:
+        maybe_declare(naily_queue, producer.channel)
+        for message in messages:
             producer.publish(message,
                              exchange=naily_exchange, routing_key=name,
-                             declare=[naily_queue])
+                             serializer='nailgun_json', retry=True)
@@ -17,8 +17,10 @@
 import time
 import Queue
 import types
+import threading
 import traceback
 import itertools
+from fractions import Fraction
 
 from web.utils import ThreadedDict
 from sqlalchemy import or_
@@ -29,6 +31,7 @@ from nailgun.db import db
 from nailgun.network.manager import NetworkManager
 from nailgun.settings import settings
 from nailgun.task.helpers import TaskHelper
+from nailgun.api.versions import cluster_versions
 from nailgun.api.models import Node, Network, NetworkGroup
 from nailgun.api.models import IPAddr, Task
 from nailgun.api.models import Release
@@ -39,8 +42,109 @@ class TaskNotFound(Exception):
     pass
 
 
+class DeploymentProgress(object):
+    """
+    Running aggregate of progress of cluster nodes being deployed.
+
+    Keeps sum and count of weighted progress of nodes, which are
+    updated by delta when nodes report new progress or status, so
+    cluster isn't reloaded on every response. Sum is kept as exact
+    fraction, so it doesn't drift after many updates. Aggregate
+    remembers version of cluster it was built for (see
+    cluster_versions), changes made by other writers make it stale.
+    """
+
+    def __init__(self, cluster_id, coeff):
+        self.cluster_id = cluster_id
+        self.coeff = coeff
+        self.version = cluster_versions.get(cluster_id)
+        self.nodes = {}
+        self.total = Fraction(0)
+        self.count = 0
+
+    @classmethod
+    def build(cls, cluster_id, coeff):
+        aggregate = cls(cluster_id, coeff)
+        map(aggregate.update, db().query(Node).filter_by(
+            cluster_id=cluster_id))
+        return aggregate
+
+    @property
+    def stale(self):
+        return self.version != cluster_versions.get(self.cluster_id)
+
+    @classmethod
+    def node_progress(cls, node, coeff):
+        """
+        Returns weighted progress of node or None
+        if node shouldn't be counted.
+        """
+        if node.status == "discover":
+            return 0
+        elif not node.online:
+            return 100
+        elif node.status in ['provisioning', 'provisioned'] or \
+                node.needs_reprovision:
+            return float(node.progress) * coeff
+        elif node.status in ['deploying', 'ready'] or \
+                node.needs_redeploy:
+            return 100.0 * coeff + float(node.progress) * (1.0 - coeff)
+        return None
+
+    def update(self, node):
+        old = self.nodes.pop(node.id, None)
+        if old is not None:
+            self.total -= Fraction(old)
+            self.count -= 1
+        if node.cluster_id != self.cluster_id:
+            return
+        new = self.node_progress(node, self.coeff)
+        if new is not None:
+            self.nodes[node.id] = new
+            self.total += Fraction(new)
+            self.count += 1
+
+    @property
+    def progress(self):
+        if self.count:
+            return int(float(self.total) / self.count)
+        return None
+
+
 class NailgunReceiver(object):
 
+    @classmethod
+    def _get_deploy_progress(cls, task):
+        """
+        Returns progress aggregate of task, which is built
+        from database if there is none or it is stale.
+        """
+        aggregate = TaskHelper.deploy_progress.get(task.uuid)
+        if aggregate is None or aggregate.stale:
+            aggregate = DeploymentProgress.build(
+                task.cluster_id,
+                settings.PROVISIONING_PROGRESS_COEFF or 0.3
+            )
+            TaskHelper.deploy_progress[task.uuid] = aggregate
+        return aggregate
+
+    @classmethod
+    def _get_nodes(cls, nodes):
+        """
+        Loads all nodes referenced in RPC response with single query.
+
+        :param nodes: List of node dicts with 'uid' key.
+        :type  nodes: list
+        :returns: Dict of Node objects by node id as string.
+        """
+        uids = set(str(n['uid']) for n in nodes)
+        if not uids:
+            return {}
+        return dict(
+            (str(n.id), n)
+            for n in db().query(Node).filter(Node.id.in_(uids))
+        )
+
     @classmethod
     def remove_nodes_resp(cls, **kwargs):
         logger.info("RPC method remove_nodes_resp received: %s" % kwargs)
@@ -52,8 +156,11 @@ class NailgunReceiver(object):
         status = kwargs.get('status')
         progress = kwargs.get('progress')
 
+        nodes_db = cls._get_nodes(nodes + inaccessible_nodes + error_nodes)
+        clusters_ids = set(n.cluster_id for n in nodes_db.itervalues())
+
         for node in nodes:
-            node_db = db().query(Node).get(node['uid'])
+            node_db = nodes_db.get(str(node['uid']))
             if not node_db:
                 logger.error(
                     u"Failed to delete node '%s': node doesn't exist",
@@ -64,7 +171,7 @@ class NailgunReceiver(object):
 
         for node in inaccessible_nodes:
             # Nodes which not answered by rpc just removed from db
-            node_db = db().query(Node).get(node['uid'])
+            node_db = nodes_db.get(str(node['uid']))
             if node_db:
                 logger.warn(
                     u'Node %s not answered by RPC, removing from db',
@@ -72,7 +179,7 @@ class NailgunReceiver(object):
                 db().delete(node_db)
 
         for node in error_nodes:
-            node_db = db().query(Node).get(node['uid'])
+            node_db = nodes_db.get(str(node['uid']))
             if not node_db:
                 logger.error(
                     u"Failed to delete node '%s' marked as error from Naily:"
@@ -83,15 +190,15 @@ class NailgunReceiver(object):
             node_db.status = 'error'
             db().add(node_db)
             node['name'] = node_db.name
-        db().commit()
 
+        notifications = []
         success_msg = u"No nodes were removed"
         err_msg = u"No errors occurred"
         if nodes:
             success_msg = u"Successfully removed {0} node(s)".format(
                 len(nodes)
             )
-            notifier.notify("done", success_msg)
+            notifications.append({'topic': "done", 'message': success_msg})
         if error_nodes:
             err_msg = u"Failed to remove {0} node(s): {1}".format(
                 len(error_nodes),
@@ -99,7 +206,11 @@ class NailgunReceiver(object):
                     [n.get('name') or "ID: {0}".format(n['uid'])
                         for n in error_nodes])
             )
-            notifier.notify("error", err_msg)
+            notifications.append({'topic': "error", 'message': err_msg})
+        # notifications are inserted in the same transaction
+        notifier.notify_many(notifications)
+        db().commit()
+        cluster_versions.bump(*clusters_ids)
         if not error_msg:
             error_msg = ". ".join([success_msg, err_msg])
 
@@ -180,10 +291,12 @@ class NailgunReceiver(object):
         if not status:
             status = task.status
 
-        error_nodes = []
+        aggregate = TaskHelper.deploy_progress.get(task_uuid)
+        nodes_db = cls._get_nodes(nodes)
+        notifications = []
         # First of all, let's update nodes in database
         for node in nodes:
-            node_db = db().query(Node).get(node['uid'])
+            node_db = nodes_db.get(str(node['uid']))
 
             if not node_db:
                 logger.warning(
@@ -221,44 +334,30 @@ class NailgunReceiver(object):
                                 and not node_db.error_msg:
                             node_db.error_msg = u"Node is offline"
                         # Notification on particular node failure
-                        notifier.notify(
-                            "error",
-                            u"Failed to deploy node '{0}': {1}".format(
+                        notifications.append({
+                            'topic': "error",
+                            'message': u"Failed to deploy node '{0}': {1}"
+                            .format(
                                 node_db.name,
                                 node_db.error_msg or "Unknown error"
                             ),
-                            cluster_id=task.cluster_id,
-                            node_id=node['uid'],
-                            task_uuid=task_uuid
-                        )
+                            'cluster_id': task.cluster_id,
+                            'node_id': node_db.id,
+                            'task_uuid': task_uuid
+                        })
 
-            db().add(node_db)
-            db().commit()
+        # notifications are inserted in the same transaction
+        notifier.notify_many(notifications)
+        db().commit()
+        if aggregate is not None:
+            map(aggregate.update, nodes_db.itervalues())
 
         # We should calculate task progress by nodes info
         task = db().query(Task).filter_by(uuid=task_uuid).first()
-        coeff = settings.PROVISIONING_PROGRESS_COEFF or 0.3
         if nodes and not progress:
-            nodes_progress = []
-            nodes_db = db().query(Node).filter_by(
-                cluster_id=task.cluster_id).all()
-            for node in nodes_db:
-                if node.status == "discover":
-                    nodes_progress.append(0)
-                elif not node.online:
-                    nodes_progress.append(100)
-                elif node.status in ['provisioning', 'provisioned'] or \
-                        node.needs_reprovision:
-                    nodes_progress.append(float(node.progress) * coeff)
-                elif node.status in ['deploying', 'ready'] or \
-                        node.needs_redeploy:
-                    nodes_progress.append(
-                        100.0 * coeff + float(node.progress) * (1.0 - coeff)
-                    )
-            if nodes_progress:
-                progress = int(
-                    float(sum(nodes_progress)) / len(nodes_progress)
-                )
+            nodes_progress = cls._get_deploy_progress(task).progress
+            if nodes_progress is not None:
+                progress = nodes_progress
 
         # Let's check the whole task status
         if status in ('error',):
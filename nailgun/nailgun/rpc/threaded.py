@@ -15,10 +15,12 @@
 #    under the License.
 
 import time
+import Queue
 import traceback
 import threading
+from collections import OrderedDict
 
-from kombu import Connection, Exchange, Queue
+from kombu import Connection
 from kombu.mixins import ConsumerMixin
 
 import nailgun.rpc as rpc
@@ -28,17 +30,116 @@ from nailgun.rpc.receiver import NailgunReceiver
 from nailgun.db import db
 
 
-class RPCConsumer(ConsumerMixin):
+# responses which may carry only progress of task and its nodes
+PROGRESS_METHODS = ('deploy_resp',)
+PROGRESS_ARGS = set(('task_uuid', 'nodes', 'progress'))
+PROGRESS_NODE_ARGS = set(('uid', 'progress'))
 
-    def __init__(self, connection, receiver):
-        self.connection = connection
+
+def is_progress_only(body):
+    if body.get("method") not in PROGRESS_METHODS:
+        return False
+    args = body.get("args", {})
+    if not args.get("task_uuid") or set(args) - PROGRESS_ARGS:
+        return False
+    return all(
+        not set(node) - PROGRESS_NODE_ARGS
+        for node in args.get("nodes") or []
+    )
+
+
+def merge_progress(first, second):
+    """
+    Merges two progress-only responses of the same task into
+    one, which leads to the same state as applying them one
+    after another: the latest progress of every node is kept.
+    """
+    nodes = OrderedDict(
+        (node["uid"], node) for node in first["args"].get("nodes") or []
+    )
+    for node in second["args"].get("nodes") or []:
+        nodes.pop(node["uid"], None)
+        nodes[node["uid"]] = node
+    args = {"task_uuid": first["args"]["task_uuid"]}
+    if nodes:
+        args["nodes"] = nodes.values()
+    if "progress" in second["args"]:
+        args["progress"] = second["args"]["progress"]
+    elif not second["args"].get("nodes") \
+            and "progress" in first["args"]:
+        # without nodes second response doesn't change task progress
+        args["progress"] = first["args"]["progress"]
+    return {"method": first["method"], "args": args}
+
+
+def coalesce(bodies):
+    """
+    Merges progress-only responses of every task which come
+    one after another (responses of other tasks may be between
+    them). Any other response of task, like status change or
+    error, is kept and is never merged with others.
+    """
+    result = []
+    last_progress = {}
+    for body in bodies:
+        task_uuid = body.get("args", {}).get("task_uuid")
+        if not is_progress_only(body):
+            last_progress.pop(task_uuid, None)
+            result.append(body)
+        elif task_uuid in last_progress:
+            i = last_progress[task_uuid]
+            result[i] = merge_progress(result[i], body)
+        else:
+            last_progress[task_uuid] = len(result)
+            result.append(body)
+    return result
+
+
+class RPCWorker(threading.Thread):
+    """
+    Applies responses routed to it. Every worker thread has
+    its own database session, responses of the same task
+    always go to the same worker, so they are applied in order
+    they were received. Responses which piled up in the worker
+    queue are taken at once and superseded progress responses
+    are coalesced, see coalesce.
+    """
+
+    def __init__(self, receiver, processed, window=None):
+        super(RPCWorker, self).__init__()
+        self.daemon = True
         self.receiver = receiver
+        self.messages = Queue.Queue()
+        self.processed = processed
+        self.window = int(window or settings.RPC_CONSUMER['window'])
 
-    def get_consumers(self, Consumer, channel):
-        return [Consumer(queues=[rpc.nailgun_queue],
-                         callbacks=[self.consume_msg])]
+    def run(self):
+        stop = False
+        while not stop:
+            batch = [self.messages.get()]
+            while len(batch) < self.window:
+                try:
+                    batch.append(self.messages.get_nowait())
+                except Queue.Empty:
+                    break
+            if None in batch:
+                stop = True
+                batch = batch[:batch.index(None)]
 
-    def consume_msg(self, body, msg):
+            bodies = coalesce([body for body, msg in batch])
+            if len(bodies) < len(batch):
+                logger.debug(
+                    "%d RPC responses coalesced into %d",
+                    len(batch), len(bodies)
+                )
+            map(self.process, bodies)
+            # channel isn't thread safe, so messages
+            # are acknowledged by consumer thread
+            for body, msg in batch:
+                self.processed.put(msg)
+        db.remove()
+
+    def process(self, body):
         callback = getattr(self.receiver, body["method"])
         try:
             callback(**body["args"])
@@ -48,7 +149,60 @@ class RPCConsumer(ConsumerMixin):
         finally:
             db().commit()
             db().expire_all()
-        msg.ack()
+
+
+class RPCConsumer(ConsumerMixin):
+
+    def __init__(self, connection, receiver,
+                 workers=None, prefetch_count=None):
+        self.connection = connection
+        self.receiver = receiver
+        self.prefetch_count = int(
+            prefetch_count or settings.RPC_CONSUMER['prefetch_count'])
+        self.processed = Queue.Queue()
+        self.workers = [
+            RPCWorker(receiver, self.processed)
+            for _ in xrange(int(workers or settings.RPC_CONSUMER['workers']))
+        ]
+
+    def get_consumers(self, Consumer, channel):
+        consumer = Consumer(queues=[rpc.nailgun_queue],
+                            callbacks=[self.consume_msg])
+        consumer.qos(prefetch_count=self.prefetch_count)
+        return [consumer]
+
+    def run(self, *args, **kwargs):
+        for worker in self.workers:
+            worker.start()
+        try:
+            super(RPCConsumer, self).run(*args, **kwargs)
+        finally:
+            for worker in self.workers:
+                worker.messages.put(None)
+            for worker in self.workers:
+                worker.join()
+            self.ack_processed()
+
+    def route(self, body):
+        task_uuid = body.get("args", {}).get("task_uuid")
+        return self.workers[hash(task_uuid) % len(self.workers)]
+
+    def consume_msg(self, body, msg):
+        self.route(body).messages.put((body, msg))
+
+    def on_iteration(self):
+        self.ack_processed()
+
+    def ack_processed(self):
+        while True:
+            try:
+                msg = self.processed.get_nowait()
+            except Queue.Empty:
+                break
+            try:
+                msg.ack()
+            except Exception:
+                logger.error(traceback.format_exc())
 
 
 class RPCKombuThread(threading.Thread):
@@ -29,6 +29,16 @@ from nailgun.network.manager import NetworkManager
 
 class TaskHelper(object):
 
+    # deployment progress aggregates by task uuid, built and
+    # updated by NailgunReceiver.deploy_resp, dropped when
+    # task is finished or deleted
+    deploy_progress = {}
+
+    @classmethod
+    def drop_deploy_progress(cls, *tasks_uuids):
+        for task_uuid in tasks_uuids:
+            cls.deploy_progress.pop(task_uuid, None)
+
     @classmethod
     def make_slave_name(cls, nid, role):
         return u"%s-%s" % (role, str(nid))
@@ -135,6 +145,8 @@ class TaskHelper(object):
                 )
         db().add(task)
         db().commit()
+        if task.status in ('ready', 'error'):
+            cls.drop_deploy_progress(task.uuid)
 
         if previous_status != status and task.cluster_id:
             logger.debug("Updating cluster status: "
@@ -158,6 +170,7 @@ class TaskHelper(object):
                         lambda s: s.message is not None, subtasks)))
                 db().add(task)
                 db().commit()
+                cls.drop_deploy_progress(task.uuid)
                 cls.update_cluster_status(uuid)
             elif all(map(lambda s: s.status in ('ready', 'error'), subtasks)):
                 task.status = 'error'
@@ -167,6 +180,7 @@ class TaskHelper(object):
                         lambda s: s.status == 'error', subtasks)))
                 db().add(task)
                 db().commit()
+                cls.drop_deploy_progress(task.uuid)
                 cls.update_cluster_status(uuid)
             else:
                 subtasks_with_progress = filter(
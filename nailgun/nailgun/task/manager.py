@@ -76,6 +76,9 @@ class DeploymentTaskManager(TaskManager):
             if task.status == "running":
                 raise errors.DeploymentAlreadyStarted()
             elif task.status in ("ready", "error"):
+                TaskHelper.drop_deploy_progress(
+                    task.uuid, *[subtask.uuid for subtask in task.subtasks]
+                )
                 for subtask in task.subtasks:
                     db().delete(subtask)
                 db().delete(task)
@@ -251,6 +254,9 @@ class ClusterDeletionManager(TaskManager):
             if task.status == "running":
                 raise errors.DeletionAlreadyStarted()
             elif task.status in ("ready", "error"):
+                TaskHelper.drop_deploy_progress(
+                    task.uuid, *[subtask.uuid for subtask in task.subtasks]
+                )
                 for subtask in task.subtasks:
                     db().delete(subtask)
                 db().delete(task)
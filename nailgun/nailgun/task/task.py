@@ -65,8 +65,14 @@ def fake_cast(queue, messages, **kwargs):
         make_thread(messages)
 
 
+def fake_cast_many(queue, messages, **kwargs):
+    for message in messages:
+        fake_cast(queue, message, **kwargs)
+
+
 if settings.FAKE_TASKS or settings.FAKE_TASKS_AMQP:
     rpc.cast = fake_cast
+    rpc.cast_many = fake_cast_many
 
 
 class DeploymentTask(object):
@@ -118,9 +124,10 @@ class DeploymentTask(object):
         nodes_ids = [n.id for n in nodes]
         if nodes_ids:
             logger.info("Assigning IP addresses to nodes..")
-            netmanager.assign_ips(nodes_ids, "management")
-            netmanager.assign_ips(nodes_ids, "public")
-            netmanager.assign_ips(nodes_ids, "storage")
+            netmanager.assign_ips_bulk(
+                nodes_ids,
+                ["management", "public", "storage"]
+            )
 
         nodes_with_attrs = []
         for n in nodes:
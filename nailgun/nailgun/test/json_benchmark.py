@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Measures JSON encoding and decoding of the largest payloads:
+node list returned by API and deployment message sent over RPC.
+Payloads are built from fixtures, no database is needed:
+
+    python -m nailgun.test.json_benchmark [nodes count]
+"""
+
+import os
+import sys
+import json
+import uuid
+import timeit
+from copy import deepcopy
+
+from nailgun import jsonutils
+
+
+def read_fixture(name):
+    path = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        'fixtures',
+        '{0}.json'.format(name)
+    )
+    with open(path) as fixture:
+        return json.load(fixture)
+
+
+def node_list(count):
+    node = read_fixture('sample_environment')[0]['fields']
+    nodes = []
+    for i in xrange(count):
+        data = deepcopy(node)
+        data.update({
+            'id': i + 1,
+            'cluster': 1,
+            'role': 'compute',
+            'fqdn': 'slave-{0}.example.com'.format(i + 1),
+            'network_data': [
+                {
+                    'name': name,
+                    'vlan': 100 + j,
+                    'dev': 'eth0',
+                    'ip': '10.{0}.{1}.{2}/24'.format(j, i // 250, i % 250),
+                    'netmask': '255.255.255.0',
+                    'brd': '10.{0}.{1}.255'.format(j, i // 250),
+                    'gateway': '10.{0}.0.1'.format(j)
+                } for j, name in enumerate(
+                    ('management', 'storage', 'public', 'floating', 'fixed')
+                )
+            ]
+        })
+        nodes.append(data)
+    return nodes
+
+
+def deploy_message(count):
+    release = [
+        r for r in read_fixture('openstack')
+        if r['model'] == 'nailgun.release'
+    ][0]['fields']
+    return {
+        'method': 'deploy',
+        'respond_to': 'deploy_resp',
+        'args': {
+            'task_uuid': str(uuid.uuid4()),
+            'nodes': node_list(count),
+            'attributes': release['attributes_metadata']
+        }
+    }
+
+
+CASES = (
+    ('stdlib json, indented', lambda d: json.dumps(d, indent=4), json.loads),
+    ('stdlib json, compact', json.dumps, json.loads),
+    ('jsonutils ({0}), compact'.format(jsonutils.DECODER),
+     jsonutils.dumps, jsonutils.loads)
+)
+
+
+def measure(name, payload, repeat=3):
+    print "{0} ({1:.1f} MB):".format(
+        name, len(json.dumps(payload)) / 1024.0 ** 2)
+    for case, dumps, loads in CASES:
+        encoded = dumps(payload)
+        dump_time = min(timeit.repeat(
+            lambda: dumps(payload), number=1, repeat=repeat))
+        load_time = min(timeit.repeat(
+            lambda: loads(encoded), number=1, repeat=repeat))
+        print "  {0:<34} dumps {1:7.3f}s  loads {2:7.3f}s".format(
+            case, dump_time, load_time)
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    measure("node list, {0} nodes".format(count), node_list(count))
+    measure("deploy message, {0} nodes".format(count), deploy_message(count))
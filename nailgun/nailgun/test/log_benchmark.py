@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Measures parsing of synthetic remote syslog of given size,
+1 GB by default, in remote syslog format of settings.LOGS:
+
+    python -m nailgun.test.log_benchmark [size in MB]
+
+Parsing line by line with time.strptime and time.strftime
+for every entry, as log handler used to do on every request,
+is compared to building index with precompiled parser.
+"""
+
+import os
+import re
+import sys
+import time
+import shutil
+import random
+import tempfile
+
+from nailgun.settings import settings
+from nailgun.logs.index import LogIndex
+from nailgun.logs.parser import LogParser
+
+
+LEVELS = ['debug', 'info', 'info', 'info', 'notice', 'warning', 'err']
+
+
+def read_backwards(file, bufsize=4096):
+    """
+    Yields lines of file from current position to beginning,
+    log handler read logs this way before logs were indexed.
+    """
+    buf = ""
+    try:
+        file.seek(-1, 1)
+    except IOError:
+        return
+    trailing_newline = False
+    if file.read(1) == "\n":
+        trailing_newline = True
+        file.seek(-1, 1)
+
+    while True:
+        newline_pos = buf.rfind("\n")
+        pos = file.tell()
+        if newline_pos != -1:
+            line = buf[newline_pos + 1:]
+            buf = buf[:newline_pos]
+            if pos or newline_pos or trailing_newline:
+                line += "\n"
+            yield line
+        elif pos:
+            toread = min(bufsize, pos)
+            file.seek(-toread, 1)
+            buf = file.read(toread) + buf
+            file.seek(-toread, 1)
+            if pos == toread:
+                buf = "\n" + buf
+        else:
+            return
+
+
+def write_syslog(path, size):
+    """
+    Writes about ten entries per second, every twentieth
+    entry is followed by two lines which continue it.
+    """
+    rnd = random.Random(42)
+    start = 1378000000
+    with open(path, 'w') as f:
+        i = 0
+        while f.tell() < size:
+            lines = []
+            for j in xrange(1000):
+                lines.append('{0} {1}: (/Stage[main]/Nova/Service[{2}]) '
+                             'Triggered refresh from {3} events\n'.format(
+                                 time.strftime('%Y-%m-%dT%H:%M:%S',
+                                               time.gmtime(start + i // 10)),
+                                 rnd.choice(LEVELS), i, j))
+                if i % 20 == 0:
+                    lines.append('  continued line of entry {0}\n'
+                                 '  one more line\n'.format(i))
+                i += 1
+            f.write(''.join(lines))
+
+
+def parse_per_line(path, log_config):
+    """
+    Reads whole log backwards and parses every line, as log
+    handler did on every request for full log.
+    """
+    regexp = re.compile(log_config['regexp'])
+    entries = 0
+    multilinebuf = []
+    with open(path, 'r') as f:
+        f.seek(0, 2)
+        for line in read_backwards(f):
+            entry = line.rstrip('\n')
+            if not len(entry):
+                continue
+            if 'skip_regexp' in log_config and \
+                    re.match(log_config['skip_regexp'], entry):
+                continue
+            m = regexp.match(entry)
+            if m is None:
+                if log_config.get('multiline'):
+                    multilinebuf.append(entry)
+                continue
+            entry_text = m.group('text')
+            if len(multilinebuf):
+                multilinebuf.reverse()
+                entry_text += '\n' + '\n'.join(multilinebuf)
+                multilinebuf = []
+            entry_level = m.group('level').upper() or 'INFO'
+            entry_date = time.strptime(m.group('date'),
+                                       log_config['date_format'])
+            [
+                time.strftime(settings.UI_LOG_DATE_FORMAT, entry_date),
+                entry_level,
+                entry_text
+            ]
+            entries += 1
+    return entries
+
+
+def build_index(path, log_config):
+    index = LogIndex(path, LogParser(log_config))
+    index.update()
+    return len(index.offsets)
+
+
+def measure(size):
+    log_config = [l for l in settings.LOGS if l['id'] == 'install/puppet'][0]
+    log_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(log_dir, 'puppet-agent.log')
+        write_syslog(path, size * 1024 ** 2)
+        print "remote syslog, {0} MB:".format(size)
+        for case, parse in (
+            ('per line parse', parse_per_line),
+            ('index with precompiled parser', build_index)
+        ):
+            start = time.time()
+            entries = parse(path, log_config)
+            duration = time.time() - start
+            print "  {0:<30} {1} entries {2:7.1f}s {3:6.1f} MB/s".format(
+                case, entries, duration, size / duration)
+    finally:
+        shutil.rmtree(log_dir)
+
+
+if __name__ == "__main__":
+    measure(int(sys.argv[1]) if len(sys.argv) > 1 else 1024)
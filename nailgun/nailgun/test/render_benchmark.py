@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Measures rendering of node list by JSONHandler.render with
+compiled serializers against reflective algorithm it replaced.
+Nodes are built from fixtures and not stored, no database
+is needed:
+
+    python -m nailgun.test.render_benchmark [nodes count]
+"""
+
+import os
+import sys
+import json
+import timeit
+from copy import deepcopy
+
+from nailgun.api.models import Cluster
+from nailgun.api.models import Node
+from nailgun.api.handlers.base import JSONHandler
+from nailgun.api.handlers.base import handlers
+from nailgun.api.handlers.node import NodeHandler
+
+
+def reflective_render(instance, fields):
+    """
+    Reference implementation of JSONHandler.render which
+    inspects instance class for every field of every object
+    """
+    json_data = {}
+    for field in fields:
+        if isinstance(field, (tuple,)):
+            if field[1] == '*':
+                subfields = None
+            else:
+                subfields = field[1:]
+
+            value = getattr(instance, field[0])
+            rel = getattr(
+                instance.__class__, field[0]).impl.__class__.__name__
+            if value is None:
+                pass
+            elif rel == 'ScalarObjectAttributeImpl':
+                handler = handlers[value.__class__.__name__]
+                json_data[field[0]] = reflective_render(
+                    value, subfields or handler.fields
+                )
+            elif rel == 'CollectionAttributeImpl':
+                if not value:
+                    json_data[field[0]] = []
+                else:
+                    handler = handlers[value[0].__class__.__name__]
+                    json_data[field[0]] = [
+                        reflective_render(v, subfields or handler.fields)
+                        for v in value
+                    ]
+        else:
+            value = getattr(instance, field)
+            if value is None:
+                json_data[field] = value
+            else:
+                f = getattr(instance.__class__, field)
+                if hasattr(f, "impl"):
+                    rel = f.impl.__class__.__name__
+                    if rel == 'ScalarObjectAttributeImpl':
+                        json_data[field] = value.id
+                    elif rel == 'CollectionAttributeImpl':
+                        json_data[field] = [v.id for v in value]
+                    else:
+                        json_data[field] = value
+                else:
+                    json_data[field] = value
+    return json_data
+
+
+def node_list(count):
+    path = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        'fixtures',
+        'sample_environment.json'
+    )
+    with open(path) as fixture:
+        node = json.load(fixture)[0]['fields']
+    cluster = Cluster(id=1, name=u'cluster')
+    nodes = []
+    for i in xrange(count):
+        data = deepcopy(node)
+        data.update({
+            'id': i + 1,
+            'mac': '52:54:00:{0:02x}:{1:02x}:{2:02x}'.format(
+                i >> 16 & 0xff, i >> 8 & 0xff, i & 0xff),
+            'fqdn': 'slave-{0}.example.com'.format(i + 1),
+            'role': 'compute',
+            'error_type': None,
+            'cluster': cluster
+        })
+        nodes.append(Node(**data))
+    return nodes
+
+
+def measure(count, number=20, repeat=3):
+    nodes = node_list(count)
+    fields = NodeHandler.fields
+    compiled = min(timeit.repeat(
+        lambda: [JSONHandler.render(n, fields=fields) for n in nodes],
+        number=number,
+        repeat=repeat
+    ))
+    reflective = min(timeit.repeat(
+        lambda: [reflective_render(n, fields) for n in nodes],
+        number=number,
+        repeat=repeat
+    ))
+    print "node list, {0} nodes, {1} renders:".format(count, number)
+    print "  {0:<12} {1:7.3f}s".format('reflective', reflective)
+    print "  {0:<12} {1:7.3f}s ({2:.1f}x)".format(
+        'compiled', compiled, reflective / compiled)
+
+
+if __name__ == "__main__":
+    measure(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
@@ -21,6 +21,7 @@ from paste.fixture import TestApp
 from mock import patch
 from sqlalchemy.sql import not_
 
+from nailgun import jsonutils
 from nailgun.api.models import Cluster, Release
 from nailgun.api.models import Network, NetworkGroup
 from nailgun.api.models import Network, NetworkGroup, NetworkConfiguration
@@ -38,6 +39,21 @@ class TestHandlers(BaseHandlers):
         response = json.loads(resp.body)
         self.assertEquals([], response)
 
+    def test_cluster_list_skips_release_metadata(self):
+        self.env.create_cluster(api=False)
+        self.env.create_cluster(api=False)
+        self.db.expunge_all()
+        with patch('nailgun.api.fields.jsonutils',
+                   wraps=jsonutils) as fields_json:
+            resp = self.app.get(
+                reverse('ClusterCollectionHandler'),
+                headers=self.default_headers
+            )
+        self.assertEquals(200, resp.status)
+        self.assertEquals(2, len(json.loads(resp.body)))
+        # release metadata isn't even loaded from database
+        self.assertFalse(fields_json.loads.called)
+
     def test_cluster_create(self):
         release_id = self.env.create_release(api=False).id
         resp = self.app.post(
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from datetime import datetime
+
+from sqlalchemy import not_
+from sqlalchemy.engine.reflection import Inspector
+
+from nailgun.db import engine
+from nailgun.db import upgradedb
+from nailgun.test.base import BaseHandlers
+from nailgun.api.models import Node
+from nailgun.api.models import NodeHeartbeat
+from nailgun.api.models import IPAddr
+from nailgun.api.models import Network
+from nailgun.api.models import Notification
+from nailgun.api.models import Task
+
+
+class TestQueryPlans(BaseHandlers):
+
+    def explain(self, query):
+        """
+        Returns query plan of ORM query. Sequential scans are
+        disabled, so planner chooses index whenever one fits
+        even for nearly empty tables of tests.
+        """
+        statement = query.statement.compile(dialect=engine.dialect)
+        connection = self.db.connection()
+        connection.execute("SET LOCAL enable_seqscan = off")
+        try:
+            return "\n".join(row[0] for row in connection.execute(
+                "EXPLAIN " + unicode(statement), statement.params
+            ))
+        finally:
+            self.db.rollback()
+
+    def assertIndexScan(self, query):
+        plan = self.explain(query)
+        self.assertNotIn("Seq Scan", plan, plan)
+
+    def test_task_lookups(self):
+        self.assertIndexScan(self.db.query(Task).filter_by(uuid="uuid"))
+        self.assertIndexScan(self.db.query(Task).filter_by(cluster_id=1))
+        self.assertIndexScan(self.db.query(Task).filter_by(parent_id=1))
+
+    def test_notification_lookups(self):
+        self.assertIndexScan(
+            self.db.query(Notification).filter_by(
+                cluster_id=1
+            ).order_by(Notification.id.desc()).limit(1000)
+        )
+        self.assertIndexScan(
+            self.db.query(Notification.dedup_key).filter(
+                Notification.dedup_key.in_(["a", "b"])
+            )
+        )
+        self.assertIndexScan(self.db.query(Notification).filter_by(
+            node_id=1))
+        self.assertIndexScan(self.db.query(Notification).filter_by(
+            task_id=1))
+
+    def test_ip_addr_lookups(self):
+        self.assertIndexScan(
+            self.db.query(IPAddr).filter_by(node=1, network=2)
+        )
+        self.assertIndexScan(
+            self.db.query(IPAddr).filter(IPAddr.node.in_([1, 2]))
+        )
+        self.assertIndexScan(
+            self.db.query(IPAddr).filter_by(network=1, node=None)
+        )
+        self.assertIndexScan(
+            self.db.query(IPAddr).filter_by(ip_addr="10.20.0.2")
+        )
+
+    def test_node_lookups(self):
+        self.assertIndexScan(
+            self.db.query(Node).filter_by(cluster_id=1, status="ready")
+        )
+        self.assertIndexScan(
+            self.db.query(Node).filter_by(online=True).filter(
+                not_(Node.status == "provisioning")
+            )
+        )
+        self.assertIndexScan(
+            self.db.query(NodeHeartbeat.node_id).filter(
+                NodeHeartbeat.timestamp < datetime.now()
+            )
+        )
+
+    def test_network_lookups(self):
+        self.assertIndexScan(
+            self.db.query(Network).filter_by(name="fuelweb_admin")
+        )
+        self.assertIndexScan(
+            self.db.query(Network).filter_by(network_group_id=1)
+        )
+
+
+class TestUpgradeDB(BaseHandlers):
+
+    def tearDown(self):
+        upgradedb()
+        super(TestUpgradeDB, self).tearDown()
+
+    def test_missing_indexes_and_columns_added(self):
+        self.db.execute("DROP INDEX ix_ip_addrs_node_network")
+        self.db.execute("ALTER TABLE notifications DROP COLUMN dedup_key")
+        self.db.commit()
+
+        upgradedb()
+
+        inspector = Inspector.from_engine(engine)
+        self.assertIn(
+            "ix_ip_addrs_node_network",
+            [i['name'] for i in inspector.get_indexes("ip_addrs")]
+        )
+        self.assertIn(
+            "dedup_key",
+            [c['name'] for c in inspector.get_columns("notifications")]
+        )
+        self.assertIn(
+            "ix_notifications_dedup_key",
+            [i['name'] for i in inspector.get_indexes("notifications")]
+        )
+
+    def test_node_timestamp_moved_to_heartbeats(self):
+        node_id = self.env.create_node(api=False).id
+        # nodes table as it was before heartbeats were split off
+        self.db.execute("DELETE FROM node_heartbeats")
+        self.db.execute("ALTER TABLE nodes ADD COLUMN timestamp TIMESTAMP")
+        self.db.execute("UPDATE nodes SET timestamp = '2013-07-01 12:00'")
+        self.db.execute(
+            "ALTER TABLE nodes ALTER COLUMN timestamp SET NOT NULL")
+        self.db.commit()
+
+        upgradedb()
+
+        inspector = Inspector.from_engine(engine)
+        self.assertNotIn(
+            "timestamp",
+            [c['name'] for c in inspector.get_columns("nodes")]
+        )
+        self.assertEquals(
+            self.db.query(NodeHeartbeat).get(node_id).timestamp,
+            datetime(2013, 7, 1, 12)
+        )
+        self.env.create_node(api=True)
+        self.assertEquals(self.db.query(Node).count(), 2)
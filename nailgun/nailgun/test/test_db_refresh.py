@@ -19,9 +19,11 @@ from datetime import datetime
 from unittest import TestCase
 
 from paste.fixture import TestApp
+from sqlalchemy import event
 from sqlalchemy.orm.events import orm
 
 from nailgun.api.models import Node
+from nailgun.db import db
 from nailgun.db import engine
 from nailgun.db import dropdb, syncdb, flush, NoCacheQuery
 from nailgun.wsgi import build_app
@@ -59,3 +61,26 @@ class TestDBRefresh(TestCase):
             Node.id == node.id
         ).first()
         self.assertEquals(node.mac, u"12345678")
+
+    def test_identity_map_reused(self):
+        node = Node()
+        node.mac = u"ASDFGHJKLMNOPR"
+        db().add(node)
+        db().commit()
+
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(engine, 'before_cursor_execute', count)
+        try:
+            node1 = db().query(Node).get(node.id)
+            node2 = db().query(Node).get(node.id)
+        finally:
+            engine.dispatch.before_cursor_execute.remove(count, engine)
+        db().commit()
+
+        self.assertIs(node1, node2)
+        # only expired object is loaded once
+        self.assertEquals(len(statements), 1)
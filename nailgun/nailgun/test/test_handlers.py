@@ -17,8 +17,15 @@
 import unittest
 import json
 
+from nailgun import jsonutils
 from nailgun.test.base import BaseHandlers
 from nailgun.test.base import reverse
+from nailgun.api.models import Node, Notification
+from nailgun.api.handlers.base import JSONHandler
+from nailgun.api.handlers.node import NodeHandler
+from nailgun.api.handlers.node import NodeNICsHandler
+from nailgun.api.handlers.notifications import NotificationHandler
+from nailgun.test.render_benchmark import reflective_render
 
 
 class TestHandlers(BaseHandlers):
@@ -38,3 +45,45 @@ class TestHandlers(BaseHandlers):
             self.assertTrue(resp.status in [404, 405])
             resp = self.app.post(test_url, expect_errors=True)
             self.assertTrue(resp.status in [404, 405])
+
+    def test_compiled_render_matches_reflective_render(self):
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[{"api": True}, {"api": True, "cluster_id": None}]
+        )
+        for node in self.db.query(Node).all():
+            for fields in (NodeHandler.fields, NodeNICsHandler.fields):
+                self.assertEquals(
+                    JSONHandler.render(node, fields=fields),
+                    reflective_render(node, fields)
+                )
+        for notification in self.db.query(Notification).all():
+            self.assertEquals(
+                JSONHandler.render(
+                    notification,
+                    fields=NotificationHandler.fields
+                ),
+                reflective_render(notification, NotificationHandler.fields)
+            )
+
+    def test_json_is_compact_unless_pretty_requested(self):
+        self.env.create_node(api=False)
+        compact = self.app.get(
+            reverse('NodeCollectionHandler'),
+            headers=self.default_headers
+        )
+        pretty = self.app.get(
+            reverse('NodeCollectionHandler') + '?pretty=1',
+            headers=self.default_headers
+        )
+        self.assertNotIn('\n', compact.body)
+        self.assertIn('\n    ', pretty.body)
+        self.assertEquals(json.loads(compact.body), json.loads(pretty.body))
+
+    def test_json_loads_returns_unicode(self):
+        data = jsonutils.loads(
+            '{"name": "node", "ru": "\\u0443\\u0437\\u0435\\u043b"}'
+        )
+        self.assertEquals(data, {u'name': u'node', u'ru': u'узел'})
+        self.assertTrue(all(isinstance(s, unicode) for s in data))
+        self.assertTrue(isinstance(data['name'], unicode))
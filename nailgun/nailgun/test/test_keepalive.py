@@ -70,3 +70,21 @@ class TestKeepalive(BaseHandlers):
         time.sleep(self.watcher.interval + 2)
         self.env.refresh_nodes()
         self.assertEqual(node.online, True)
+
+    def test_offline_node_notification(self):
+        node = self.env.create_node(status="discover",
+                                    role="controller",
+                                    name="Dead or alive")
+        self.env.wait_for_true(
+            self.check_online,
+            args=[node, False],
+            timeout=self.timeout)
+        notifications = self.db.query(Notification).filter_by(
+            node_id=node.id,
+            topic="error"
+        ).all()
+        self.assertEquals(len(notifications), 1)
+        self.assertEquals(
+            notifications[0].message,
+            u"Node 'Dead or alive' has gone away"
+        )
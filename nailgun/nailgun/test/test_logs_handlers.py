@@ -21,14 +21,21 @@ import time
 import json
 import os
 import tarfile
+import threading
 from StringIO import StringIO
 
+from mock import patch
+
 from nailgun.test.base import BaseHandlers
 from nailgun.test.base import reverse
 
 from nailgun.settings import settings
 
-from nailgun.api.handlers.logs import read_backwards
+from nailgun.test.log_benchmark import read_backwards
+from nailgun.logs.index import LogIndex
+from nailgun.logs.follow import LogWatcher
+from nailgun.logs.parser import LogParser
+from nailgun.logs.sources import LogSourceRegistry
 
 
 class TestLogs(BaseHandlers):
@@ -37,9 +44,11 @@ class TestLogs(BaseHandlers):
         super(TestLogs, self).setUp()
         self.log_dir = tempfile.mkdtemp()
         self.local_log_file = os.path.join(self.log_dir, 'nailgun.log')
+        self.index_dir = os.path.join(self.log_dir, 'index')
         regexp = (r'^(?P<date>\d{4}-\d{2}-\d{2}\s\d{2}:\d{2}:\d{2}):'
                   '(?P<level>\w+):(?P<text>\w+)$')
         settings.update({
+            'LOGS_INDEX_DIR': self.index_dir,
             'LOGS': [
                 {
                     'id': 'nailgun',
@@ -99,6 +108,41 @@ class TestLogs(BaseHandlers):
         response = json.loads(resp.body)
         self.assertEquals(response, [settings.LOGS[1]])
 
+    def test_log_source_registry(self):
+        node_dir = os.path.join(self.log_dir, '10.20.0.3')
+        os.makedirs(node_dir)
+        open(os.path.join(node_dir, 'puppet.log'), 'w').close()
+        os.utime(node_dir, (1000, 1000))
+        registry = LogSourceRegistry(interval=60)
+
+        with patch('os.listdir', wraps=os.listdir) as listdir:
+            self.assertTrue(registry.isfile(
+                os.path.join(node_dir, 'puppet.log')))
+            self.assertFalse(registry.isfile(
+                os.path.join(node_dir, 'anaconda.log')))
+            self.assertFalse(registry.isfile(
+                os.path.join(self.log_dir, '10.20.0.4', 'puppet.log')))
+            self.assertEquals(listdir.call_count, 1)
+
+            # directory isn't checked within interval
+            open(os.path.join(node_dir, 'anaconda.log'), 'w').close()
+            self.assertFalse(registry.isfile(
+                os.path.join(node_dir, 'anaconda.log')))
+
+            # it's listed again after interval if its mtime changed
+            registry.interval = 0.001
+            time.sleep(0.01)
+            self.assertTrue(registry.isfile(
+                os.path.join(node_dir, 'anaconda.log')))
+            self.assertEquals(listdir.call_count, 2)
+            os.utime(node_dir, (2000, 2000))
+            time.sleep(0.01)
+            registry.isfile(os.path.join(node_dir, 'anaconda.log'))
+            self.assertEquals(listdir.call_count, 3)
+            time.sleep(0.01)
+            registry.isfile(os.path.join(node_dir, 'anaconda.log'))
+            self.assertEquals(listdir.call_count, 3)
+
     def test_log_entry_collection_handler(self):
         node_ip = '10.20.30.40'
         log_entries = [
@@ -171,6 +215,173 @@ class TestLogs(BaseHandlers):
         self.assertEquals(response['entries'], log_entries)
         settings.LOGS[0]['multiline'] = False
 
+    def get_entries(self, **params):
+        params['source'] = settings.LOGS[0]['id']
+        resp = self.app.get(
+            reverse('LogEntryCollectionHandler'),
+            params=params,
+            headers=self.default_headers
+        )
+        self.assertEquals(200, resp.status)
+        return json.loads(resp.body)
+
+    def test_log_entry_filters(self):
+        settings.LOGS[0]['levels'] = ['DEBUG', 'INFO', 'ERROR']
+        log_entries = [
+            ['2013-09-01 10:00:00', 'DEBUG', 'text0'],
+            ['2013-09-01 10:00:01', 'INFO', 'text1'],
+            ['2013-09-01 10:00:02', 'ERROR', 'text2'],
+            ['2013-09-01 10:00:03', 'DEBUG', 'text3'],
+            ['2013-09-01 10:00:04', 'INFO', 'text4'],
+        ]
+        self._create_logfile_for_node(settings.LOGS[0], log_entries)
+        newest_first = log_entries[::-1]
+
+        response = self.get_entries(level='INFO')
+        self.assertEquals(response['entries'],
+                          [log_entries[4], log_entries[2], log_entries[1]])
+        self.assertFalse(response['has_more'])
+
+        response = self.get_entries(date_after=log_entries[1][0],
+                                    date_before=log_entries[4][0])
+        self.assertEquals(response['entries'], newest_first[1:3])
+
+        response = self.get_entries(truncate_log=1, max_entries=2)
+        self.assertEquals(response['entries'], newest_first[:2])
+        self.assertTrue(response['has_more'])
+
+        to = sum(len(':'.join(e) + '\n') for e in log_entries[:3])
+        response = self.get_entries(to=to)
+        self.assertEquals(response['entries'], newest_first[:2])
+        self.assertTrue(response['has_more'])
+        self.assertEquals(response['to'], os.stat(self.local_log_file).st_size)
+
+        resp = self.app.get(
+            reverse('LogEntryCollectionHandler'),
+            params={'source': settings.LOGS[0]['id'], 'date_after': 'bad'},
+            headers=self.default_headers,
+            expect_errors=True
+        )
+        self.assertEquals(400, resp.status)
+
+    def test_log_index_updated_incrementally(self):
+        log_config = dict(settings.LOGS[0], multiline=True)
+        index_path = os.path.join(self.index_dir, 'nailgun.log.idx')
+        index = LogIndex(
+            self.local_log_file, LogParser(log_config), index_path)
+        with open(self.local_log_file, 'w') as f:
+            f.write('2013-09-01 10:00:00:INFO:first\n'
+                    '2013-09-01 10:00:01:INFO:second\n'
+                    '2013-09-01 10:00:0')
+        entries, has_more, size = index.query()
+        self.assertEquals(
+            entries,
+            [['2013-09-01 10:00:01', 'INFO', 'second'],
+             ['2013-09-01 10:00:00', 'INFO', 'first']]
+        )
+        # incomplete line isn't indexed yet
+        self.assertEquals(size, 63)
+
+        with open(self.local_log_file, 'a') as f:
+            f.write('2:INFO:third\ncontinued\n')
+        entries, has_more, size = index.query(to=size)
+        self.assertEquals(
+            entries, [['2013-09-01 10:00:02', 'INFO', 'third\ncontinued']])
+        self.assertEquals(size, os.stat(self.local_log_file).st_size)
+
+        # next line continues last entry saved in sidecar
+        with open(self.local_log_file, 'a') as f:
+            f.write('more\n')
+        loaded = LogIndex(
+            self.local_log_file, LogParser(log_config), index_path)
+        self.assertEquals(loaded.size, size)
+        self.assertEquals(loaded.offsets, index.offsets)
+        entries, has_more, size = loaded.query(limit=1)
+        self.assertEquals(
+            entries,
+            [['2013-09-01 10:00:02', 'INFO', 'third\ncontinued\nmore']])
+        self.assertTrue(has_more)
+
+        # log is rotated
+        with open(self.local_log_file, 'w') as f:
+            f.write('2013-09-02 10:00:00:INFO:rotated\n')
+        entries, has_more, size = loaded.query()
+        self.assertEquals(
+            entries, [['2013-09-02 10:00:00', 'INFO', 'rotated']])
+        self.assertFalse(has_more)
+
+    def test_log_parser(self):
+        parser = LogParser(dict(
+            settings.LOGS[0],
+            levels=['DEBUG', 'INFO'],
+            skip_regexp=r'^skipped',
+            multiline=True
+        ))
+        with patch('time.strptime', wraps=time.strptime) as strptime:
+            for i in range(3):
+                self.assertEquals(
+                    parser.parse_header('2013-09-01 10:00:00:info:text'),
+                    (1378029600, 1)
+                )
+            self.assertEquals(strptime.call_count, 1)
+        self.assertEquals(
+            parser.parse_header('2013-09-01 10:00:00:WARN:text'),
+            (1378029600, LogParser.OTHER_LEVEL)
+        )
+        self.assertIsNone(parser.parse_header('continued'))
+        self.assertRaises(
+            ValueError, parser.parse_header, '2013-19-01 10:00:00:INFO:text')
+        self.assertTrue(parser.skip(''))
+        self.assertTrue(parser.skip('skipped line'))
+        self.assertFalse(parser.skip('continued'))
+        self.assertEquals(
+            parser.entry('2013-09-01 10:00:00:info:text\n'
+                         'continued\nskipped\n\nagain\n', 1378029600),
+            ['2013-09-01 10:00:00', 'INFO', 'text\ncontinued\nagain']
+        )
+
+    def test_log_entry_follow_handler(self):
+        log_entries = [
+            ['2013-09-01 10:00:00', 'INFO', 'first'],
+            ['2013-09-01 10:00:01', 'INFO', 'second'],
+        ]
+        self._create_logfile_for_node(settings.LOGS[0], log_entries[:1])
+        watcher = LogWatcher(interval=0.05, max_followers=1)
+
+        def follow(expect_errors=False, **params):
+            params['source'] = settings.LOGS[0]['id']
+            return self.app.get(
+                reverse('LogEntryFollowHandler'),
+                params=params,
+                headers=self.default_headers,
+                expect_errors=expect_errors
+            )
+
+        def append_entry():
+            with open(self.local_log_file, 'a') as f:
+                f.write(':'.join(log_entries[1]) + '\n')
+
+        with patch('nailgun.api.handlers.logs.log_watcher', watcher):
+            # entries already in log are returned without waiting
+            response = json.loads(follow(to=0).body)
+            self.assertEquals(response['entries'], log_entries[:1])
+            to = response['to']
+
+            response = json.loads(follow(to=to, timeout=0.1).body)
+            self.assertEquals(response['entries'], [])
+            self.assertEquals(response['to'], to)
+
+            threading.Timer(0.2, append_entry).start()
+            response = json.loads(follow(to=to, timeout=10).body)
+            self.assertEquals(response['entries'], log_entries[1:])
+            self.assertEquals(response['to'],
+                              os.stat(self.local_log_file).st_size)
+
+            watcher.followers = 1
+            resp = follow(to=response['to'], expect_errors=True)
+            self.assertEquals(503, resp.status)
+        watcher.join()
+
     def test_backward_reader(self):
         f = tempfile.TemporaryFile(mode='r+')
         forward_lines = []
@@ -239,3 +450,64 @@ class TestLogs(BaseHandlers):
         self.assertEquals(m.read(), 'testcontent')
         f.close()
         m.close()
+
+    def test_log_package_filters(self):
+        remote_dir = os.path.join(self.log_dir, 'remote')
+        for path in ('10.20.0.3/puppet.log', '10.20.0.4/puppet.log'):
+            os.makedirs(os.path.join(remote_dir, os.path.dirname(path)))
+            with open(os.path.join(remote_dir, path), 'w') as f:
+                f.write(path)
+        os.symlink('10.20.0.3', os.path.join(remote_dir, 'node-3.local'))
+        with open(self.local_log_file, 'w') as f:
+            f.write('old')
+        os.utime(self.local_log_file, (0, 0))
+        node = self.env.create_node(api=False, ip='10.20.0.3')
+        settings.LOGS_TO_PACK_FOR_SUPPORT = {'logs': self.log_dir}
+
+        def package(**params):
+            syslog_dir = settings.SYSLOG_DIR
+            settings.SYSLOG_DIR = remote_dir
+            try:
+                resp = self.app.get(reverse('LogPackageHandler'),
+                                    params=params)
+            finally:
+                settings.SYSLOG_DIR = syslog_dir
+            self.assertEquals(200, resp.status)
+            return tarfile.open(fileobj=StringIO(resp.body), mode='r:gz')
+
+        names = package().getnames()
+        self.assertIn('logs/nailgun.log', names)
+        self.assertIn('logs/remote/10.20.0.4/puppet.log', names)
+
+        tf = package(nodes=str(node.id))
+        names = tf.getnames()
+        self.assertIn('logs/nailgun.log', names)
+        self.assertIn('logs/remote/10.20.0.3/puppet.log', names)
+        self.assertNotIn('logs/remote/10.20.0.4', names)
+        self.assertNotIn('logs/remote/node-3.local', names)
+        self.assertEquals(
+            tf.extractfile('logs/remote/10.20.0.3/puppet.log').read(),
+            '10.20.0.3/puppet.log'
+        )
+
+        names = package(date_after='2013-01-01 00:00:00').getnames()
+        self.assertNotIn('logs/nailgun.log', names)
+        self.assertIn('logs/remote/10.20.0.4/puppet.log', names)
+
+    def test_log_package_parallel_compression(self):
+        contents = os.urandom(10000)
+        with open(self.local_log_file, 'w') as f:
+            f.write(contents)
+        settings.LOGS_TO_PACK_FOR_SUPPORT = {
+            'nailgun.log': self.local_log_file
+        }
+        package_settings = settings.LOGS_PACKAGE
+        settings.LOGS_PACKAGE = dict(
+            package_settings, chunk_size=1024, compress_threads=2)
+        try:
+            resp = self.app.get(reverse('LogPackageHandler'))
+        finally:
+            settings.LOGS_PACKAGE = package_settings
+        self.assertEquals(200, resp.status)
+        tf = tarfile.open(fileobj=StringIO(resp.body), mode='r:gz')
+        self.assertEquals(tf.extractfile('nailgun.log').read(), contents)
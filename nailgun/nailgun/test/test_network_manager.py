@@ -210,6 +210,132 @@ class TestNetworkManager(BaseHandlers):
         self.assertEquals(len(admin_ips), 1)
         self.assertEquals(admin_ips[0].ip_addr, '10.0.0.1')
 
+    def test_assign_ips_idempotent(self):
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[
+                {"pending_addition": True, "api": True},
+                {"pending_addition": True, "api": True}
+            ]
+        )
+        nodes_ids = [n.id for n in self.env.nodes]
+        self.env.network_manager.assign_ips(nodes_ids, "management")
+        ips = set([i.ip_addr for i in self.db.query(IPAddr).
+                   filter(IPAddr.node.in_(nodes_ids)).all()])
+        self.env.network_manager.assign_ips(nodes_ids, "management")
+        ips2 = set([i.ip_addr for i in self.db.query(IPAddr).
+                    filter(IPAddr.node.in_(nodes_ids)).all()])
+        self.assertEquals(len(ips), 2)
+        self.assertEquals(ips, ips2)
+
+    def test_assign_ips_bulk(self):
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[
+                {"pending_addition": True, "api": True},
+                {"pending_addition": True, "api": True}
+            ]
+        )
+        nodes_ids = [n.id for n in self.env.nodes]
+        net_names = ["management", "public", "storage"]
+        self.env.network_manager.assign_ips(nodes_ids[:1], "public")
+        self.env.network_manager.assign_ips_bulk(nodes_ids, net_names)
+
+        nets = self.db.query(Network).join(NetworkGroup).filter(
+            NetworkGroup.cluster_id == self.env.clusters[0].id
+        ).filter(Network.name.in_(net_names)).all()
+        self.assertEquals(len(nets), 3)
+        all_ips = []
+        for net in nets:
+            for node_id in nodes_ids:
+                ips = self.db.query(IPAddr).filter_by(
+                    node=node_id,
+                    network=net.id
+                ).all()
+                self.assertEquals(len(ips), 1)
+                self.assertTrue(
+                    self.env.network_manager.check_ip_belongs_to_net(
+                        ips[0].ip_addr,
+                        net
+                    )
+                )
+                all_ips.append(ips[0].ip_addr)
+        self.assertEquals(len(all_ips), len(set(all_ips)))
+
+        self.assertRaises(
+            errors.AssignIPError,
+            self.env.network_manager.assign_ips_bulk,
+            nodes_ids,
+            ["management", "unknown"]
+        )
+
+    def test_assign_ips_bulk_uses_first_network_with_name(self):
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[
+                {"pending_addition": True, "api": True},
+                {"pending_addition": True, "api": True}
+            ]
+        )
+        nodes_ids = [n.id for n in self.env.nodes]
+        first_net = self.db.query(Network).join(NetworkGroup).filter(
+            NetworkGroup.cluster_id == self.env.clusters[0].id
+        ).filter(Network.name == "management").order_by(Network.id).first()
+        second_net = Network(
+            release=first_net.release,
+            name=first_net.name,
+            access=first_net.access,
+            cidr=first_net.cidr,
+            network_group_id=first_net.network_group_id
+        )
+        self.db.add(second_net)
+        self.db.commit()
+
+        self.env.network_manager.assign_ips_bulk(nodes_ids, ["management"])
+
+        ips = self.db.query(IPAddr).filter(IPAddr.node.in_(nodes_ids)).all()
+        self.assertEquals(len(ips), 2)
+        self.assertEquals(
+            set(ip.network for ip in ips),
+            set([first_net.id])
+        )
+
+    def test_get_free_ips_skips_used_ips_and_gateway(self):
+        cluster = self.env.create_cluster(api=True)
+        ng = self.db.query(NetworkGroup).filter_by(
+            cluster_id=cluster['id'],
+            name='management'
+        ).first()
+        map(self.db.delete, ng.ip_ranges)
+        self.db.add_all([
+            IPAddrRange(
+                first='192.168.0.1',
+                last='192.168.0.3',
+                network_group_id=ng.id
+            ),
+            IPAddrRange(
+                first='192.168.0.20',
+                last='192.168.0.30',
+                network_group_id=ng.id
+            )
+        ])
+        ng.gateway = '192.168.0.1'
+        self.db.add(IPAddr(ip_addr='192.168.0.3'))
+        self.db.add(IPAddr(ip_addr='192.168.0.20'))
+        self.db.commit()
+
+        free_ips = self.env.network_manager.get_free_ips(ng.id, num=3)
+        self.assertEquals(
+            free_ips,
+            ['192.168.0.2', '192.168.0.21', '192.168.0.22']
+        )
+        self.assertRaises(
+            errors.OutOfIPs,
+            self.env.network_manager.get_free_ips,
+            ng.id,
+            num=12
+        )
+
     def test_vlan_set_null(self):
         cluster = self.env.create_cluster(api=True)
         cluster_db = self.env.clusters[0]
@@ -15,9 +15,13 @@
 #    under the License.
 
 import json
+from copy import deepcopy
 
+from mock import patch
 from paste.fixture import TestApp
+from sqlalchemy import event
 
+from nailgun.db import engine
 from nailgun.test.base import BaseHandlers
 from nailgun.test.base import reverse
 from nailgun.api.models import Node, Notification
@@ -70,6 +74,227 @@ class TestHandlers(BaseHandlers):
             response[0]['id']
         )
 
+    def _count_queries(self, func, *args, **kwargs):
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(engine, "before_cursor_execute", count)
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            engine.dispatch.before_cursor_execute.remove(count, engine)
+        return len(statements), result
+
+    def _get_cluster_nodes(self, cluster_id):
+        resp = self.app.get(
+            reverse('NodeCollectionHandler'),
+            params={'cluster_id': cluster_id},
+            headers=self.default_headers
+        )
+        self.assertEquals(200, resp.status)
+        return json.loads(resp.body)
+
+    def test_node_list_queries_count_is_constant(self):
+        self.env.create(
+            cluster_kwargs={"api": True},
+            nodes_kwargs=[{"api": True}] * 2
+        )
+        cluster_id = self.env.clusters[0].id
+        self.env.network_manager.assign_ips_bulk(
+            [n.id for n in self.env.nodes],
+            ["management", "public", "storage"]
+        )
+        queries, nodes = self._count_queries(
+            self._get_cluster_nodes, cluster_id
+        )
+        self.assertEquals(len(nodes), 2)
+
+        for i in xrange(3):
+            self.env.create_node(api=True, cluster_id=cluster_id)
+        self.env.network_manager.assign_ips_bulk(
+            [n.id for n in self.env.nodes],
+            ["management", "public", "storage"]
+        )
+        queries2, nodes = self._count_queries(
+            self._get_cluster_nodes, cluster_id
+        )
+        self.assertEquals(len(nodes), 5)
+        self.assertEquals(queries, queries2)
+        for node in nodes:
+            self.assertEquals(
+                set(["management", "public", "storage",
+                     "floating", "fixed", "admin"]),
+                set(n["name"] for n in node["network_data"])
+            )
+            self.assertEquals(
+                node["network_data"],
+                self.env.network_manager.get_node_networks(node["id"])
+            )
+
+    def test_node_list_pagination(self):
+        for i in xrange(5):
+            self.env.create_node(api=False)
+        nodes_ids = sorted(n.id for n in self.env.nodes)
+
+        resp = self.app.get(
+            reverse('NodeCollectionHandler'),
+            params={'limit': 2},
+            headers=self.default_headers
+        )
+        self.assertEquals(200, resp.status)
+        self.assertEquals(
+            [n['id'] for n in json.loads(resp.body)],
+            nodes_ids[:2]
+        )
+        self.assertIn(
+            'after_id={0}'.format(nodes_ids[1]),
+            resp.header('Link')
+        )
+
+        resp = self.app.get(
+            reverse('NodeCollectionHandler'),
+            params={'limit': 3, 'after_id': nodes_ids[1]},
+            headers=self.default_headers
+        )
+        self.assertEquals(
+            [n['id'] for n in json.loads(resp.body)],
+            nodes_ids[2:]
+        )
+        self.assertNotIn('Link', dict(resp.headers))
+
+    def test_node_list_filters(self):
+        self.env.create(
+            cluster_kwargs={"api": False},
+            nodes_kwargs=[
+                {"status": "ready", "online": True},
+                {"status": "error", "online": True},
+                {"status": "discover", "online": False},
+            ]
+        )
+        resp = self.app.get(
+            reverse('NodeCollectionHandler'),
+            params={'status': 'ready,error'},
+            headers=self.default_headers
+        )
+        self.assertEquals(
+            set(n['status'] for n in json.loads(resp.body)),
+            set(['ready', 'error'])
+        )
+        resp = self.app.get(
+            reverse('NodeCollectionHandler'),
+            params={'online': 'false'},
+            headers=self.default_headers
+        )
+        response = json.loads(resp.body)
+        self.assertEquals(len(response), 1)
+        self.assertEquals(response[0]['id'], self.env.nodes[2].id)
+
+        resp = self.app.get(
+            reverse('NodeCollectionHandler'),
+            params={'status': 'unknown'},
+            headers=self.default_headers,
+            expect_errors=True
+        )
+        self.assertEquals(400, resp.status)
+
+    def test_node_list_sparse_fields(self):
+        self.env.create(
+            cluster_kwargs={"api": False},
+            nodes_kwargs=[{"status": "ready"}]
+        )
+        resp = self.app.get(
+            reverse('NodeCollectionHandler'),
+            params={'fields': 'status,online'},
+            headers=self.default_headers
+        )
+        self.assertEquals(200, resp.status)
+        self.assertEquals(
+            json.loads(resp.body),
+            [{'id': self.env.nodes[0].id, 'status': 'ready', 'online': True}]
+        )
+
+    def test_node_list_not_modified(self):
+        node = self.env.create_node(api=False)
+        resp = self.app.get(
+            reverse('NodeCollectionHandler'),
+            headers=self.default_headers
+        )
+        etag = resp.header('ETag')
+
+        headers = dict(self.default_headers, **{'If-None-Match': etag})
+        resp = self.app.get(
+            reverse('NodeCollectionHandler'),
+            headers=headers
+        )
+        self.assertEquals(304, resp.status)
+        self.assertEquals('', resp.body)
+
+        # bulk update made by KeepAlive watcher changes version too
+        self.db.query(Node).filter(Node.id == node.id).update(
+            {'online': False}, synchronize_session=False)
+        self.db.commit()
+        resp = self.app.get(
+            reverse('NodeCollectionHandler'),
+            headers=headers
+        )
+        self.assertEquals(200, resp.status)
+        self.assertNotEqual(etag, resp.header('ETag'))
+        self.assertFalse(json.loads(resp.body)[0]['online'])
+
+    def test_node_list_modified_by_network_reassignment(self):
+        cluster = self.env.create_cluster(api=True)
+        mac = '123'
+        meta = {'interfaces': [
+            {'name': 'eth0', 'mac': mac},
+            {'name': 'eth1', 'mac': '654'},
+        ]}
+        node = self.env.create_node(api=True, meta=meta, mac=mac,
+                                    cluster_id=cluster['id'])
+        resp = self.app.get(
+            reverse('NodeCollectionHandler'),
+            headers=self.default_headers
+        )
+        etag = resp.header('ETag')
+        devs = set(
+            n['dev'] for n in json.loads(resp.body)[0]['network_data']
+            if n['name'] != 'admin'
+        )
+        self.assertEquals(devs, set(['eth0']))
+
+        resp = self.app.get(
+            reverse('NodeNICsHandler', kwargs={'node_id': node['id']}),
+            headers=self.default_headers
+        )
+        nics = json.loads(resp.body)
+        a_nets = filter(lambda nic: nic['mac'] == mac,
+                        nics)[0]['assigned_networks']
+        for nic in nics:
+            if nic['mac'] == mac:
+                nic['assigned_networks'] = []
+            else:
+                nic['assigned_networks'] = a_nets
+        resp = self.app.put(
+            reverse('NodeCollectionNICsHandler'),
+            json.dumps([{'id': node['id'], 'interfaces': nics}]),
+            headers=self.default_headers
+        )
+        self.assertEquals(200, resp.status)
+
+        headers = dict(self.default_headers, **{'If-None-Match': etag})
+        resp = self.app.get(
+            reverse('NodeCollectionHandler'),
+            headers=headers
+        )
+        self.assertEquals(200, resp.status)
+        self.assertNotEqual(etag, resp.header('ETag'))
+        devs = set(
+            n['dev'] for n in json.loads(resp.body)[0]['network_data']
+            if n['name'] != 'admin'
+        )
+        self.assertEquals(devs, set(['eth1']))
+
     def test_node_get_with_cluster_None(self):
         self.env.create(
             cluster_kwargs={"api": False},
@@ -155,6 +380,191 @@ class TestHandlers(BaseHandlers):
         self.assertEquals('new', node_db.manufacturer)
         self.assertEquals('provisioning', node_db.status)
 
+    def test_node_agent_check_in_with_same_meta(self):
+        meta = self.env.default_metadata()
+        self.env.create_node(api=True, meta=meta)
+        node_db = self.env.nodes[0]
+        node_db.online = False
+        timestamp = node_db.timestamp
+        self.db.commit()
+        node_data = {
+            'mac': node_db.mac,
+            'is_agent': True,
+            'status': 'discover',
+            'meta': deepcopy(meta)
+        }
+
+        # first check-in after creation is the same as creation data
+        with patch('nailgun.api.handlers.node.NetworkManager.'
+                   'update_interfaces_info') as update_mock:
+            resp = self.app.put(
+                reverse('NodeCollectionHandler'),
+                json.dumps([node_data]),
+                headers=self.default_headers
+            )
+        self.assertEquals(200, resp.status)
+        self.assertFalse(update_mock.called)
+        node_db = self.db.query(Node).get(node_db.id)
+        self.assertTrue(node_db.online)
+        self.assertGreater(node_db.timestamp, timestamp)
+
+        node_data['meta']['cpu'] = {'total': 64}
+        with patch('nailgun.api.handlers.node.NetworkManager.'
+                   'update_interfaces_info') as update_mock:
+            resp = self.app.put(
+                reverse('NodeCollectionHandler'),
+                json.dumps([node_data]),
+                headers=self.default_headers
+            )
+        self.assertEquals(200, resp.status)
+        self.assertFalse(update_mock.called)
+        node_db = self.db.query(Node).get(node_db.id)
+        self.assertEquals({'total': 64}, node_db.meta['cpu'])
+
+    def test_node_agents_back_online_commits_count_is_constant(self):
+        for i in xrange(8):
+            self.env.create_node(api=True)
+        self.db.query(Node).update(
+            {'online': False}, synchronize_session=False)
+        self.db.commit()
+
+        def put_agents_data(nodes):
+            nodes_data = []
+            for i, node in enumerate(nodes):
+                meta = deepcopy(node.meta)
+                # half of agents report changes, the rest just check in
+                if i % 2:
+                    meta['cpu'] = {'total': 64}
+                nodes_data.append({
+                    'mac': node.mac,
+                    'is_agent': True,
+                    'meta': meta
+                })
+            commits = []
+
+            def count(conn):
+                commits.append(conn)
+
+            event.listen(engine, "commit", count)
+            try:
+                resp = self.app.put(
+                    reverse('NodeCollectionHandler'),
+                    json.dumps(nodes_data),
+                    headers=self.default_headers
+                )
+            finally:
+                engine.dispatch.commit.remove(count, engine)
+            self.assertEquals(200, resp.status)
+            return len(commits)
+
+        commits = put_agents_data(self.env.nodes[:2])
+        commits2 = put_agents_data(self.env.nodes[2:])
+        self.assertEquals(commits, commits2)
+
+        self.db.expire_all()
+        self.assertTrue(all(n.online for n in self.db.query(Node)))
+        self.assertEquals(8, self.db.query(Notification).filter(
+            Notification.message.like(u"%is back online")
+        ).count())
+
+    def test_node_agent_check_in_response_without_meta(self):
+        cluster = self.env.create_cluster(api=True)
+        meta = self.env.default_metadata()
+        self.env.create_node(api=True, meta=meta, cluster_id=cluster['id'])
+        node_db = self.env.nodes[0]
+        node_data = {
+            'mac': node_db.mac,
+            'is_agent': True,
+            'meta': deepcopy(meta)
+        }
+        resp = self.app.put(
+            reverse('NodeCollectionHandler'),
+            json.dumps([node_data]),
+            headers=self.default_headers
+        )
+        self.assertEquals(200, resp.status)
+        response = json.loads(resp.body)
+        self.assertEquals(response[0]['id'], node_db.id)
+        self.assertNotIn('meta', response[0])
+        self.assertNotIn('network_data', response[0])
+
+        node_data['meta']['cpu'] = {'total': 64}
+        resp = self.app.put(
+            reverse('NodeCollectionHandler'),
+            json.dumps([node_data]),
+            headers=self.default_headers
+        )
+        self.assertEquals(200, resp.status)
+        response = json.loads(resp.body)
+        self.assertEquals({'total': 64}, response[0]['meta']['cpu'])
+        self.assertIn('network_data', response[0])
+
+    def test_node_agent_updates_only_changed_meta_sections(self):
+        meta = self.env.default_metadata()
+        self.env.create_node(api=True, meta=meta)
+        node_db = self.env.nodes[0]
+        node_data = {
+            'mac': node_db.mac,
+            'is_agent': True,
+            'meta': deepcopy(meta)
+        }
+
+        def check_in(changes):
+            node_data['meta'].update(changes)
+            with patch('nailgun.api.handlers.node.NetworkManager.'
+                       'update_interfaces_info') as interfaces_mock:
+                with patch('nailgun.volumes.manager.VolumeManager.'
+                           'gen_volumes_info') as volumes_mock:
+                    volumes_mock.return_value = [{'type': 'disk'}]
+                    resp = self.app.put(
+                        reverse('NodeCollectionHandler'),
+                        json.dumps([node_data]),
+                        headers=self.default_headers
+                    )
+            self.assertEquals(200, resp.status)
+            return interfaces_mock.called, volumes_mock.called
+
+        self.assertEquals(
+            (False, False),
+            check_in({'cpu': {'total': 64}})
+        )
+        self.assertEquals(
+            (False, True),
+            check_in({'disks': meta['disks'][:1]})
+        )
+        self.assertEquals(
+            (True, False),
+            check_in({'interfaces': meta['interfaces'][:1]})
+        )
+
+    def test_node_agent_cosmetic_disks_change_keeps_volumes(self):
+        meta = self.env.default_metadata()
+        self.env.create_node(api=True, meta=meta)
+        node_db = self.env.nodes[0]
+        volumes = deepcopy(node_db.attributes.volumes)
+        volumes.append({'type': 'vg', 'id': 'custom', 'volumes': []})
+        node_db.attributes.volumes = volumes
+        self.db.commit()
+
+        disks = deepcopy(meta['disks'])
+        disks.reverse()
+        for disk in disks:
+            disk['model'] = 'new agent field'
+        node_data = {
+            'mac': node_db.mac,
+            'is_agent': True,
+            'meta': dict(deepcopy(meta), disks=disks)
+        }
+        resp = self.app.put(
+            reverse('NodeCollectionHandler'),
+            json.dumps([node_data]),
+            headers=self.default_headers
+        )
+        self.assertEquals(200, resp.status)
+        node_db = self.db.query(Node).get(node_db.id)
+        self.assertEquals(disks, node_db.meta['disks'])
+        self.assertEquals(volumes, node_db.attributes.volumes)
+
     def test_node_timestamp_updated_only_by_agent(self):
         node = self.env.create_node(api=False)
         timestamp = node.timestamp
@@ -161,3 +161,53 @@ class TestNotification(BaseHandlers):
             notifications[0].message,
             "Cluster deletion fake error"
         )
+
+    def test_notify_many_skips_duplicates(self):
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[{"api": False}, {"api": False}]
+        )
+        cluster = self.env.clusters[0]
+        node1, node2 = self.env.nodes
+        task = Task(
+            uuid=str(uuid.uuid4()),
+            name="super",
+            cluster_id=cluster.id
+        )
+        self.db.add(task)
+        self.db.commit()
+
+        def error(node, message, task_uuid=task.uuid):
+            return {
+                'topic': 'error',
+                'message': message,
+                'cluster_id': cluster.id,
+                'node_id': node.id,
+                'task_uuid': task_uuid
+            }
+
+        notifier.notify_many([
+            error(node1, u"Failed"),
+            error(node1, u"Failed"),
+            error(node2, u"Failed")
+        ])
+        notifier.notify_many([
+            error(node1, u"Failed"),
+            error(node1, u"Отказ"),
+            error(node1, u"Failed", task_uuid=None)
+        ])
+
+        notifications = self.db.query(Notification).filter_by(
+            cluster_id=cluster.id
+        ).all()
+        self.assertEqual(
+            sorted(
+                (n.node_id, n.message, n.task_id) for n in notifications
+            ),
+            sorted([
+                (node1.id, u"Failed", task.id),
+                (node2.id, u"Failed", task.id),
+                (node1.id, u"Отказ", task.id),
+                (node1.id, u"Failed", None)
+            ])
+        )
@@ -17,9 +17,11 @@
 import unittest
 import json
 from paste.fixture import TestApp
+from mock import patch
 
 from nailgun.test.base import BaseHandlers
 from nailgun.test.base import reverse
+from nailgun.api.handlers.notifications import NotificationCollectionHandler
 
 
 class TestHandlers(BaseHandlers):
@@ -53,6 +55,83 @@ class TestHandlers(BaseHandlers):
         self.assertEquals(rn1['cluster'], n1.cluster_id)
         self.assertIsNone(rn0.get('cluster', None))
 
+    def test_filter_by_status(self):
+        n0 = self.env.create_notification()
+        self.env.create_notification(status='read')
+        resp = self.app.get(
+            reverse('NotificationCollectionHandler'),
+            params={'status': 'unread'},
+            headers=self.default_headers
+        )
+        self.assertEquals(200, resp.status)
+        response = json.loads(resp.body)
+        self.assertEquals([n['id'] for n in response], [n0.id])
+
+    def test_empty_cluster_id_is_ignored(self):
+        c = self.env.create_cluster(api=False)
+        n0 = self.env.create_notification()
+        n1 = self.env.create_notification(cluster_id=c.id)
+        resp = self.app.get(
+            reverse('NotificationCollectionHandler') + '?cluster_id=',
+            headers=self.default_headers
+        )
+        self.assertEquals(200, resp.status)
+        response = json.loads(resp.body)
+        self.assertEquals(
+            sorted(n['id'] for n in response),
+            sorted([n0.id, n1.id])
+        )
+
+    def test_default_page_has_newest_notifications(self):
+        ids = [self.env.create_notification().id for i in xrange(3)]
+        with patch.object(
+            NotificationCollectionHandler,
+            'collection_limit',
+            2
+        ):
+            resp = self.app.get(
+                reverse('NotificationCollectionHandler'),
+                headers=self.default_headers
+            )
+        self.assertEquals(200, resp.status)
+        response = json.loads(resp.body)
+        self.assertEquals([n['id'] for n in response], ids[:0:-1])
+
+        resp = self.app.get(
+            reverse('NotificationCollectionHandler'),
+            params={'limit': 2, 'after_id': ids[1]},
+            headers=self.default_headers
+        )
+        response = json.loads(resp.body)
+        self.assertEquals([n['id'] for n in response], ids[:1])
+
+    def test_not_modified(self):
+        n0 = self.env.create_notification()
+        resp = self.app.get(
+            reverse('NotificationCollectionHandler'),
+            headers=self.default_headers
+        )
+        etag = resp.header('ETag')
+
+        headers = dict(self.default_headers, **{'If-None-Match': etag})
+        resp = self.app.get(
+            reverse('NotificationCollectionHandler'),
+            headers=headers
+        )
+        self.assertEquals(304, resp.status)
+
+        self.app.put(
+            reverse('NotificationCollectionHandler'),
+            json.dumps([{'id': n0.id, 'status': 'read'}]),
+            headers=self.default_headers
+        )
+        resp = self.app.get(
+            reverse('NotificationCollectionHandler'),
+            headers=headers
+        )
+        self.assertEquals(200, resp.status)
+        self.assertEquals(json.loads(resp.body)[0]['status'], 'read')
+
     def test_update(self):
         c = self.env.create_cluster(api=False)
         n0 = self.env.create_notification()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2013 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import unittest
+
+from kombu import Connection
+from kombu.transport import memory
+from mock import patch
+
+import nailgun.rpc as rpc
+
+
+class TestCast(unittest.TestCase):
+
+    def setUp(self):
+        self.patchers = [
+            patch('nailgun.rpc.conn_str', 'memory://'),
+            patch('nailgun.rpc.connection', None)
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def get_messages(self):
+        messages = []
+        with Connection('memory://') as conn:
+            queue = rpc.naily_queue(conn.default_channel)
+            message = queue.get()
+            while message:
+                messages.append(message.payload)
+                message.ack()
+                message = queue.get()
+        return messages
+
+    def test_cast_reuses_connection(self):
+        establish_connection = memory.Transport.establish_connection
+        with patch.object(memory.Transport, 'establish_connection',
+                          autospec=True,
+                          side_effect=establish_connection) as connect:
+            rpc.cast('naily', {'method': 'first'})
+            rpc.cast('naily', {'method': 'second'})
+            rpc.cast_many('naily', [
+                {'method': 'third'},
+                {'method': 'fourth'}
+            ])
+        self.assertEquals(connect.call_count, 1)
+        self.assertEquals(
+            [m['method'] for m in self.get_messages()],
+            ['first', 'second', 'third', 'fourth']
+        )
@@ -17,12 +17,19 @@
 import json
 import time
 import uuid
+import threading
+from random import Random
 
+from kombu import Connection
 from mock import patch
 
 import nailgun.rpc as rpc
 from nailgun.rpc import receiver as rcvr
+from nailgun.api.versions import cluster_versions
+from nailgun.rpc.threaded import RPCConsumer, coalesce
 from nailgun.task.task import VerifyNetworksTask
+from nailgun.task.helpers import TaskHelper
+from nailgun.settings import settings
 from nailgun.test.base import BaseHandlers
 from nailgun.test.base import reverse
 from nailgun.api.models import Node
@@ -421,6 +428,193 @@ class TestConsumer(BaseHandlers):
         self.db.refresh(self.env.nodes[0])
         self.assertEqual(self.env.nodes[0].progress, 100)
 
+    def test_deploy_resp_notifies_each_failed_node_once(self):
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[
+                {"api": False, "status": "deploying"},
+                {"api": False, "status": "deploying"},
+                {"api": False, "status": "deploying"}
+            ]
+        )
+        task = Task(
+            uuid=str(uuid.uuid4()),
+            name="deploy",
+            cluster_id=self.env.clusters[0].id,
+            status="running"
+        )
+        self.db.add(task)
+        self.db.commit()
+        failed, offline, deploying = self.env.nodes
+        kwargs = {
+            'task_uuid': task.uuid,
+            'nodes': [
+                {'uid': str(failed.id), 'status': 'error', 'progress': 50},
+                {'uid': offline.id, 'online': False, 'progress': 40},
+                {'uid': deploying.id, 'progress': 30},
+                {'uid': 9999, 'progress': 30}
+            ]
+        }
+        self.receiver.deploy_resp(**kwargs)
+        self.receiver.deploy_resp(**kwargs)
+
+        self.env.refresh_nodes()
+        self.assertEqual(
+            [n.progress for n in self.env.nodes], [100, 100, 30])
+        self.assertEqual(offline.error_msg, u"Node is offline")
+        notifications = self.db.query(Notification).filter_by(
+            task_id=task.id).all()
+        self.assertEqual(
+            sorted(n.node_id for n in notifications),
+            sorted([failed.id, offline.id])
+        )
+        self.assertTrue(all(n.topic == 'error' for n in notifications))
+
+    # weights of nodes are exact binary fractions with this
+    # coefficient, so float sum doesn't depend on order of nodes
+    @patch.object(settings, 'PROVISIONING_PROGRESS_COEFF', 0.25)
+    def test_task_progress_by_nodes_matches_full_recount(self):
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[
+                {"status": "discover"},
+                {"status": "provisioning"},
+                {"status": "provisioning"},
+                {"status": "deploying"},
+                {"status": "deploying"},
+                {"status": "ready", "progress": 100},
+                {"status": "error", "error_type": "provision"},
+                {"status": "deploying", "online": False}
+            ]
+        )
+        cluster = self.env.clusters[0]
+        task = Task(
+            uuid=str(uuid.uuid4()),
+            name="deploy",
+            cluster_id=cluster.id,
+            status="running"
+        )
+        self.db.add(task)
+        self.db.commit()
+
+        def full_recount():
+            # deploy_resp code which reloaded all nodes of cluster
+            coeff = settings.PROVISIONING_PROGRESS_COEFF or 0.3
+            nodes_progress = []
+            nodes_db = self.db.query(Node).filter_by(
+                cluster_id=task.cluster_id).all()
+            for node in nodes_db:
+                if node.status == "discover":
+                    nodes_progress.append(0)
+                elif not node.online:
+                    nodes_progress.append(100)
+                elif node.status in ['provisioning', 'provisioned'] or \
+                        node.needs_reprovision:
+                    nodes_progress.append(float(node.progress) * coeff)
+                elif node.status in ['deploying', 'ready'] or \
+                        node.needs_redeploy:
+                    nodes_progress.append(
+                        100.0 * coeff + float(node.progress) * (1.0 - coeff)
+                    )
+            if nodes_progress:
+                return int(
+                    float(sum(nodes_progress)) / len(nodes_progress)
+                )
+
+        def change_cluster(i):
+            # changes made bypassing deploy_resp
+            if i % 4 == 0:
+                # the way KeepAlive watcher marks nodes offline
+                self.db.query(Node).filter(
+                    Node.id == random.choice(node_ids)
+                ).update({'online': False}, synchronize_session=False)
+                self.db.commit()
+                cluster_versions.bump(cluster.id)
+            elif i % 4 == 1:
+                node_ids.append(self.env.create_node(
+                    api=True,
+                    cluster_id=cluster.id,
+                    status='deploying',
+                    progress=random.randint(0, 100)
+                )['id'])
+            elif i % 4 == 2:
+                resp = self.app.put(
+                    reverse('NodeCollectionHandler'),
+                    json.dumps([{
+                        'id': random.choice(node_ids),
+                        'cluster_id': None
+                    }]),
+                    headers=self.default_headers
+                )
+                self.assertEquals(resp.status, 200)
+            else:
+                resp = self.app.put(
+                    reverse(
+                        'NodeHandler',
+                        kwargs={'node_id': random.choice(node_ids)}
+                    ),
+                    json.dumps({'status': 'error'}),
+                    headers=self.default_headers
+                )
+                self.assertEquals(resp.status, 200)
+
+        random = Random(42)
+        node_ids = [n.id for n in self.env.nodes]
+        for i in xrange(50):
+            nodes = []
+            for node_id in random.sample(node_ids, random.randint(1, 3)):
+                node = {
+                    'uid': node_id,
+                    'progress': random.randint(0, 100)
+                }
+                if random.random() < 0.2:
+                    node['status'] = random.choice(
+                        ['provisioned', 'deploying', 'ready'])
+                nodes.append(node)
+            self.receiver.deploy_resp(task_uuid=task.uuid, nodes=nodes)
+            self.db.refresh(task)
+            self.assertEqual(task.progress, full_recount())
+            if i % 5 == 4:
+                change_cluster(i // 5)
+
+    def test_task_progress_aggregate_dropped_with_task(self):
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[{"status": "provisioning"}]
+        )
+        cluster = self.env.clusters[0]
+        tasks = [
+            Task(
+                uuid=str(uuid.uuid4()),
+                name="deploy",
+                cluster_id=cluster.id,
+                status="running"
+            ) for i in xrange(3)
+        ]
+        self.db.add_all(tasks)
+        self.db.commit()
+        for task in tasks:
+            self.receiver.deploy_resp(
+                task_uuid=task.uuid,
+                nodes=[{'uid': self.env.nodes[0].id, 'progress': 50}]
+            )
+        self.assertTrue(all(
+            t.uuid in TaskHelper.deploy_progress for t in tasks
+        ))
+
+        TaskHelper.update_task_status(tasks[0].uuid, 'error', 100)
+        self.assertNotIn(tasks[0].uuid, TaskHelper.deploy_progress)
+
+        tasks[1].status = 'ready'
+        self.db.commit()
+        resp = self.app.delete(
+            reverse('TaskHandler', kwargs={'task_id': tasks[1].id}),
+            headers=self.default_headers
+        )
+        self.assertEquals(resp.status, 204)
+        self.assertNotIn(tasks[1].uuid, TaskHelper.deploy_progress)
+        self.assertIn(tasks[2].uuid, TaskHelper.deploy_progress)
+
     def test_remove_nodes_resp(self):
         self.env.create(
             cluster_kwargs={},
@@ -609,3 +803,136 @@ class TestConsumer(BaseHandlers):
             .join(NetworkGroup).\
             filter(NetworkGroup.cluster_id == cluster_db.id).all()
         self.assertNotEqual(len(nets_db), 0)
+
+
+class FakeReceiver(object):
+
+    calls = []
+
+    @classmethod
+    def test_resp(cls, task_uuid, number):
+        time.sleep(0.01)
+        cls.calls.append((task_uuid, number, threading.current_thread()))
+
+
+class TestConsumerPool(BaseHandlers):
+
+    def test_responses_of_task_applied_in_order(self):
+        tasks = [str(uuid.uuid4()) for _ in xrange(8)]
+        with Connection('memory://') as conn:
+            with conn.Producer(serializer='json') as producer:
+                for number in xrange(10):
+                    for task_uuid in tasks:
+                        producer.publish(
+                            {'method': 'test_resp',
+                             'args': {'task_uuid': task_uuid,
+                                      'number': number}},
+                            exchange=rpc.nailgun_exchange,
+                            routing_key='nailgun',
+                            declare=[rpc.nailgun_queue]
+                        )
+
+            consumer = RPCConsumer(conn, FakeReceiver,
+                                   workers=4, prefetch_count=100)
+            thread = threading.Thread(target=consumer.run)
+            thread.start()
+            self.env.wait_for_true(
+                lambda: len(FakeReceiver.calls) == 80,
+                timeout=10
+            )
+            consumer.should_stop = True
+            thread.join()
+
+            # all responses are acknowledged
+            self.assertIsNone(rpc.nailgun_queue(conn.default_channel).get())
+
+        for task_uuid in tasks:
+            calls = [c for c in FakeReceiver.calls if c[0] == task_uuid]
+            self.assertEquals([c[1] for c in calls], range(10))
+            self.assertEquals(len(set(c[2] for c in calls)), 1)
+        self.assertGreater(len(set(c[2] for c in FakeReceiver.calls)), 1)
+
+    def progress_resp(self, task_uuid, nodes=None, **kwargs):
+        args = {'task_uuid': task_uuid}
+        if nodes:
+            args['nodes'] = [
+                dict({'uid': uid}, **node) for uid, node in nodes
+            ]
+        args.update(kwargs)
+        return {'method': 'deploy_resp', 'args': args}
+
+    def test_coalesce_keeps_status_changes(self):
+        status_resp = self.progress_resp(
+            'a', [(1, {'status': 'error', 'progress': 100})])
+        bodies = [
+            self.progress_resp('a', [(1, {'progress': 10})]),
+            self.progress_resp('b', [(3, {'progress': 50})]),
+            self.progress_resp('a', [(2, {'progress': 5})]),
+            self.progress_resp('a', [(1, {'progress': 20})]),
+            status_resp,
+            self.progress_resp('a', [(1, {'progress': 30})]),
+            self.progress_resp('a', progress=40)
+        ]
+        self.assertEquals(coalesce(bodies), [
+            self.progress_resp(
+                'a', [(2, {'progress': 5}), (1, {'progress': 20})]),
+            self.progress_resp('b', [(3, {'progress': 50})]),
+            status_resp,
+            self.progress_resp('a', [(1, {'progress': 30})], progress=40)
+        ])
+
+    def test_coalesce_keeps_explicit_zero_progress(self):
+        self.assertEquals(coalesce([
+            self.progress_resp('a', progress=40),
+            self.progress_resp('a', progress=0)
+        ]), [self.progress_resp('a', progress=0)])
+        self.assertEquals(coalesce([
+            self.progress_resp('a', progress=0),
+            self.progress_resp('a', [(1, {'progress': 30})])
+        ]), [self.progress_resp('a', [(1, {'progress': 30})])])
+        self.assertEquals(coalesce([
+            self.progress_resp('a', progress=0),
+            self.progress_resp('a')
+        ]), [self.progress_resp('a', progress=0)])
+
+    def test_coalesced_progress_equals_sequential(self):
+        self.env.create(
+            cluster_kwargs={},
+            nodes_kwargs=[
+                {"status": "deploying"},
+                {"status": "provisioning"},
+                {"status": "deploying"}
+            ]
+        )
+        cluster = self.env.clusters[0]
+        task = Task(uuid=str(uuid.uuid4()), name="deploy",
+                    cluster_id=cluster.id, status="running")
+        self.db.add(task)
+        self.db.commit()
+        n1, n2, n3 = [n.id for n in self.env.nodes]
+        bodies = [
+            self.progress_resp(task.uuid, [(n1, {'progress': 10}),
+                                           (n2, {'progress': 15})]),
+            self.progress_resp(task.uuid, [(n3, {'progress': 40})]),
+            self.progress_resp(task.uuid, [(n1, {'progress': 30})]),
+            self.progress_resp(task.uuid, [(n2, {'progress': 60})])
+        ]
+
+        def apply_responses(bodies):
+            for node in self.env.nodes:
+                node.progress = 0
+            task.progress = 0
+            self.db.commit()
+            for body in bodies:
+                getattr(self.receiver, body['method'])(**body['args'])
+            self.env.refresh_nodes()
+            self.db.refresh(task)
+            return [n.progress for n in self.env.nodes], task.progress
+
+        self.receiver = rcvr.NailgunReceiver()
+        coalesced = coalesce(bodies)
+        self.assertEquals(len(coalesced), 1)
+        self.assertEquals(
+            apply_responses(bodies),
+            apply_responses(coalesced)
+        )
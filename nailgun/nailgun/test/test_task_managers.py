@@ -623,5 +623,5 @@ class TestTaskManagers(BaseHandlers):
         release = self.db.query(Release).get(release.id)
         self.assertEquals(release.state, 'downloading')
         self.env.wait_ready(task, timeout=5)
-        release = self.db.query(Release).get(release.id)
+        self.db.refresh(release)
         self.assertEquals(release.state, 'available')
@@ -80,8 +80,12 @@ def appstart(keepalive=False):
 
     app = build_app()
 
+    from nailgun.logs.parser import compile_parsers
+    compile_parsers()
+
     from nailgun.rpc import threaded
     from nailgun.keepalive import keep_alive
+    from nailgun.logs.follow import log_watcher
 
     if keepalive:
         logger.info("Running KeepAlive watcher...")
@@ -109,4 +113,7 @@ def appstart(keepalive=False):
     if not settings.FAKE_TASKS:
         logger.info("Stopping RPC consumer...")
         rpc_process.join()
+    if log_watcher.is_alive():
+        logger.info("Stopping log watcher...")
+        log_watcher.join()
     logger.info("Done")
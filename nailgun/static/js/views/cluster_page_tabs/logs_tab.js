@@ -38,15 +38,21 @@ function(utils, models, commonViews, logsTabTemplate, logEntryTemplate) {
             'change select[name=node]': 'onNodeChange',
             'change select[name=source]': 'updateLevels'
         },
-        scheduleUpdate: function() {
-            this.registerDeferred($.timeout(this.updateInterval).done(_.bind(this.update, this)));
+        scheduleUpdate: function(interval) {
+            this.registerDeferred($.timeout(_.isUndefined(interval) ? this.updateInterval : interval).done(_.bind(this.update, this)));
         },
         update: function() {
-            this.fetchLogs({to: this.to})
+            // server responds when new entries appear or when follow timeout expires
+            this.fetchLogs({to: this.to}, {url: '/api/logs/follow'})
                 .done(_.bind(function(data) {
                     this.appendLogEntries(data, false);
+                    this.scheduleUpdate(0);
                 }, this))
-                .always(_.bind(this.scheduleUpdate, this));
+                .fail(_.bind(function(xhr, status) {
+                    if (status != 'abort') {
+                        this.scheduleUpdate();
+                    }
+                }, this));
         },
         onTypeChange: function() {
             var chosenType = this.$('select[name=type]').val();
@@ -198,7 +204,7 @@ function(utils, models, commonViews, logsTabTemplate, logEntryTemplate) {
                         this.$('.table-logs .entries-skipped-msg').hide();
                     }
                     this.$('.table-logs').show();
-                    this.scheduleUpdate();
+                    this.scheduleUpdate(0);
                 }, this))
                 .fail(_.bind(function() {
                     this.$('.logs-fetch-error').show();
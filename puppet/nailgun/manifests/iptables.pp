@@ -21,5 +21,6 @@ class nailgun::iptables {
 
   access_to_nailgun_port { "nailgun_web":    port => '8000' }
   access_to_nailgun_port { "nailgun_repo":    port => '8080' }
+  access_to_nailgun_port { "remote_syslog":    port => '514' }
   ip_forward {'forward_slaves': network => "${ipaddress}/${netmask}"}
 }